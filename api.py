@@ -1,21 +1,77 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.datastructures import Headers
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pymongo.errors import ExecutionTimeout
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.middleware.base import RequestResponseEndpoint
-from starlette.types import ASGIApp, Scope, Receive, Send
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Message, Scope, Receive, Send
 
+from asyncio import CancelledError, create_task, Queue, wait
+from math import ceil
+from os import urandom
 from contextlib import asynccontextmanager
+from time import monotonic, perf_counter
+from typing import Optional
 
-from config import ORIGINS
+from config import (
+    COMPRESSION_ENABLED,
+    COMPRESSION_LEVEL,
+    COMPRESSION_MINIMUM_SIZE,
+    DEADLINE_MAX_IN_FLIGHT,
+    DEADLINE_RETRY_AFTER,
+    IMAGE_WORKER_IN_PROCESS,
+    MAX_BODY_SIZE,
+    ORIGINS,
+    PROFILING_ENABLED,
+    RATE_LIMIT_ENABLED,
+    ROUTE_MAX_BODY_SIZES,
+)
 from database.database import setup as setup_db
+from routes.archive import router as archive_router
 from routes.auth import router as auth_router
 from routes.avatar import router as avatar_router
 from routes.food import router as task_router
+from routes.job import router as job_router
+from routes.metrics import router as metrics_router
 from routes.order import router as order_router
+from routes.profile import router as profile_router
 from routes.user import router as user_router
+from utils.archiver import archiver
+from utils.bearer import cookie_value, decode_bearer
+from utils.compression import accepts_gzip, gzip_body
+from utils.deadline import request_deadline, route_budget
+from utils.email_filter import email_filter
+from utils.food_counters import food_counters
+from utils.food_ranker import food_ranker
+from utils.food_snapshot import food_snapshot
+from utils.geo_index import geo_index
+from utils.image_store import blob_collector
+from utils.image_worker import image_worker
+from utils.logger import log, request_id
+from utils.metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, metrics_exporter, RATE_LIMITED
+from utils.order_counts import order_count_reconciler
+from utils.profiler import (
+    PROFILE_HEADER,
+    profile_store,
+    profile_trigger,
+    RequestProfile,
+)
+from utils.rate_limit import rate_limiter
+
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
 
 
 class SetAuthorizationFromCookiesMiddleware:
+    """
+    Turns the token cookie into a bearer Authorization header for clients
+    that authenticate with cookies. Headers are scanned once, in place;
+    ASGI servers already lowercase their names. The header list is
+    replaced on the scope itself, so the route the router records there
+    stays visible to the metrics and access log middlewares outside.
+    """
     app: ASGIApp
 
     def __init__(self, app: ASGIApp):
@@ -26,40 +82,540 @@ class SetAuthorizationFromCookiesMiddleware:
             await self.app(scope, receive, send)
             return
 
-        headers: dict[bytes, bytes] = dict(list(map(
-            lambda pair: (pair[0].lower(), pair[1]),
-            scope["headers"]
-        )))
-        if headers.get(b"authorization") is None and headers.get(b"cookie") is not None:
-            token = headers[b"cookie"].split(b"token=")[-1].split(b";")[0]
-            headers[b"authorization"] = b"Bearer " + token
-            scope["headers"] = list(headers.items())
+        cookie = None
+        for key, value in scope["headers"]:
+            if key == b"authorization":
+                await self.app(scope, receive, send)
+                return
+            if key == b"cookie":
+                # HTTP/2 may split cookies over several headers.
+                cookie = value if cookie is None else cookie + b"; " + value
+
+        token = cookie_value(cookie, b"token") if cookie is not None else None
+        if token:
+            scope["headers"] = [*scope["headers"], (b"authorization", b"Bearer " + token)]
         await self.app(scope, receive, send)
 
-    @classmethod
-    def _add_custom_headers(cls, scope: Scope):
-        scope["headers"].append((b"token", b"my_token"))
+
+class PreflightMiddleware:
+    """
+    Answers CORS preflight requests before the rest of the stack. They
+    carry no credentials and never reach a route, so deadlines, rate
+    limits and cookie parsing are skipped. Other requests still get their
+    CORS headers from the CORSMiddleware next to the router.
+    """
+    app: ASGIApp
+    cors: CORSMiddleware
+
+    def __init__(self, app: ASGIApp, cors: CORSMiddleware):
+        self.app = app
+        self.cors = cors
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if "origin" not in headers or "access-control-request-method" not in headers:
+            await self.app(scope, receive, send)
+            return
+
+        response = self.cors.preflight_response(request_headers=headers)
+        await response(scope, receive, send)
+
+
+class CompressionMiddleware:
+    """
+    Gzips JSON and text responses of at least minimum_size bytes for clients
+    that accept it. Responses that already carry a Content-Encoding, like
+    the cached food list, and streamed bodies pass through untouched.
+    """
+    app: ASGIApp
+    minimum_size: int
+    level: int
+
+    def __init__(self, app: ASGIApp, minimum_size: int, level: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for key, value in scope["headers"]:
+            if key.lower() == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        if not accepts_gzip(accept_encoding):
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+
+        async def send_wrapper(message: Message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (
+                    "content-encoding" not in headers
+                    and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                ):
+                    # Held until the body shows whether it is worth it.
+                    start = message
+                    return
+            elif start is not None:
+                held, start = start, None
+                body = message.get("body", b"")
+                if not message.get("more_body", False) and len(body) >= self.minimum_size:
+                    body = gzip_body(body, self.level)
+                    headers = MutableHeaders(raw=held["headers"])
+                    headers["Content-Encoding"] = "gzip"
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {"type": "http.response.body", "body": body}
+                await send(held)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class MetricsMiddleware:
+    """
+    Records request latency by route template and the number of requests
+    in flight. The route is only known once routing has run, so the
+    in-flight gauge is labelled by method alone.
+    """
+    app: ASGIApp
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method)
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(method)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                perf_counter() - start,
+                method,
+                route.path if route is not None else "unmatched",
+                f"{status_code // 100}xx",
+            )
+
+
+class AccessLogMiddleware:
+    """
+    Gives each request an ID, taken from X-Request-ID if the client sent a
+    usable one, that the log records made while serving it carry and the
+    response echoes back. Writes the access record once the response is
+    sent, and an error record with the traceback for unhandled exceptions.
+    """
+    app: ASGIApp
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rid = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                if 0 < len(value) <= 128 and value.isascii() and value.decode().isprintable():
+                    rid = value.decode()
+                break
+        if rid is None:
+            rid = urandom(8).hex()
+        token = request_id.set(rid)
+
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                MutableHeaders(scope=message).append("X-Request-ID", rid)
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as error:
+            log.error("unhandled_exception", exc=error, method=scope["method"], path=scope["path"])
+            raise
+        finally:
+            route = scope.get("route")
+            client = scope.get("client")
+            log.access(
+                scope["method"],
+                scope["path"],
+                route.path if route is not None else None,
+                status_code,
+                perf_counter() - start,
+                client[0] if client else None,
+            )
+            request_id.reset(token)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests profile_trigger picks and stores the reports.
+    Only installed when profiling is enabled in the config.
+    """
+    app: ASGIApp
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        signature = None
+        authorization = None
+        for key, value in scope["headers"]:
+            key = key.lower()
+            if key == PROFILE_HEADER:
+                signature = value
+            elif key == b"authorization":
+                authorization = value
+        if not profile_trigger.wants(signature, authorization, scope["query_string"]):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        profile = RequestProfile()
+        profile_trigger.busy = True
+        start = perf_counter()
+        profile.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.stop()
+            profile_trigger.busy = False
+            summary = (
+                f"{scope['method']} {scope['path']} {status_code} "
+                f"{(perf_counter() - start) * 1000:.2f}ms {profile.name}"
+            )
+            await run_in_threadpool(
+                lambda: profile_store.save(summary, profile.report())
+            )
+
+
+SERVER_BUSY = JSONResponse(
+    {"detail": "Server busy"},
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    headers={"Retry-After": str(DEADLINE_RETRY_AFTER)}
+)
+DEADLINE_EXCEEDED = JSONResponse(
+    {"detail": "Request deadline exceeded"},
+    status_code=status.HTTP_504_GATEWAY_TIMEOUT
+)
+
+
+BODY_TOO_LARGE = JSONResponse(
+    {"detail": "Request body too large"},
+    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+)
+BODY_GREW_TOO_LARGE = HTTPException(
+    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    detail="Request body too large"
+)
+
+
+class BodySizeLimitMiddleware:
+    """
+    Caps request bodies at max_body_size, or at the endpoint's entry in
+    route_max_body_sizes, while they are received. Starlette spools a
+    multipart upload to disk before the endpoint sees it, so this is the
+    only place an oversized upload can be stopped early. A Content-Length
+    over the limit is answered with 413 without reading the body; a body
+    that grows past it fails the read with 413.
+    """
+    app: ASGIApp
+    router: Router
+
+    def __init__(self, app: ASGIApp, router: Router):
+        self.app = app
+        self.router = router
+
+    def limit(self, scope: Scope) -> int:
+        if not ROUTE_MAX_BODY_SIZES:
+            return MAX_BODY_SIZE
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return ROUTE_MAX_BODY_SIZES.get(route.name, MAX_BODY_SIZE)
+        return MAX_BODY_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = None
+        has_body = False
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                content_length = value
+                has_body = True
+            elif name == b"transfer-encoding":
+                has_body = True
+        if not has_body:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limit(scope)
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await BODY_TOO_LARGE(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_wrapper() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise BODY_GREW_TOO_LARGE
+            return message
+
+        await self.app(scope, receive_wrapper, send)
+
+
+class DeadlineMiddleware:
+    """
+    Gives each request a time budget and cancels it once the budget is
+    spent or the client disconnects. The budget is visible to the database
+    layer through request_deadline. Past max_in_flight concurrent requests,
+    new ones are turned away with a 503 before any work is done.
+    """
+    app: ASGIApp
+    router: Router
+    max_in_flight: int
+    in_flight: int
+
+    def __init__(self, app: ASGIApp, router: Router, max_in_flight: int = DEADLINE_MAX_IN_FLIGHT):
+        self.app = app
+        self.router = router
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            await SERVER_BUSY(scope, receive, send)
+            return
+
+        budget = route_budget(self.router, scope)
+        self.in_flight += 1
+        token = request_deadline.set(monotonic() + budget)
+        try:
+            await self._run(scope, receive, send, budget)
+        finally:
+            request_deadline.reset(token)
+            self.in_flight -= 1
+
+    async def _run(self, scope: Scope, receive: Receive, send: Send, budget: float):
+        started = False
+        finished = False
+
+        async def send_wrapper(message: Message):
+            nonlocal started, finished
+            if message["type"] == "http.response.start":
+                started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished = True
+            await send(message)
+
+        # The watcher reads ahead of the application to notice a
+        # disconnect while it is busy with something else. Two slots fit
+        # an unread empty body plus the disconnect, while a large body
+        # still only arrives as fast as the application consumes it.
+        messages: Queue[Message] = Queue(maxsize=2)
+        task = create_task(self.app(scope, messages.get, send_wrapper))
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    if not finished:
+                        task.cancel()
+                    return
+
+        watcher = create_task(watch_disconnect())
+        try:
+            done, _ = await wait({task}, timeout=budget)
+        except CancelledError:
+            task.cancel()
+            raise
+        finally:
+            watcher.cancel()
+
+        if not done:
+            task.cancel()
+            await wait({task})
+            if not started:
+                await DEADLINE_EXCEEDED(scope, receive, send)
+            return
+        if task.cancelled():
+            # The client went away.
+            return
+        task.result()
+
+
+class RateLimitMiddleware:
+    """
+    Token-bucket limits for the unauthenticated, expensive endpoints. It
+    answers 429 before the body is read, so a flood never reaches the
+    validation or bcrypt.
+    """
+    app: ASGIApp
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = rate_limiter.limit_for(scope["path"])
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        authorization = None
+        for key, value in scope["headers"]:
+            if key.lower() == b"authorization":
+                authorization = value
+                break
+        payload = decode_bearer(authorization)
+        client = scope.get("client")
+
+        retry_after = await rate_limiter.check(
+            scope["path"],
+            limit,
+            client[0] if client else None,
+            payload.get("sub") if payload else None,
+        )
+        if retry_after:
+            RATE_LIMITED.inc(scope["path"])
+            response = JSONResponse(
+                {"detail": "Too many requests"},
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(ceil(retry_after))}
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+food_snapshot.add_listener(geo_index)
+food_snapshot.add_listener(food_ranker)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    log.start()
     await setup_db()
+    await food_snapshot.start()
+    await food_ranker.start()
+    await food_counters.start()
+    await order_count_reconciler.start()
+    await archiver.start()
+    await blob_collector.start()
+    await email_filter.start()
+    await metrics_exporter.start()
+    if IMAGE_WORKER_IN_PROCESS:
+        await image_worker.start()
 
     yield
 
-app = FastAPI(lifespan=lifespan)
+    await image_worker.stop()
+    await metrics_exporter.stop()
+    await email_filter.stop()
+    await blob_collector.stop()
+    await archiver.stop()
+    await order_count_reconciler.stop()
+    await food_counters.stop()
+    await food_ranker.stop()
+    await food_snapshot.stop()
+    log.stop()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+
+@app.exception_handler(ExecutionTimeout)
+async def execution_timeout_handler(request: Request, exc: ExecutionTimeout):
+    return DEADLINE_EXCEEDED
 
 app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(task_router)
 app.include_router(avatar_router)
 app.include_router(order_router)
+app.include_router(job_router)
+app.include_router(metrics_router)
+app.include_router(profile_router)
+app.include_router(archive_router)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+cors_options = {
+    "allow_origins": ORIGINS,
+    "allow_credentials": True,
+    "allow_methods": ["*"],
+    "allow_headers": ["*"],
+}
+app.add_middleware(CORSMiddleware, **cors_options)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
 app.add_middleware(SetAuthorizationFromCookiesMiddleware)
+app.add_middleware(BodySizeLimitMiddleware, router=app.router)
+app.add_middleware(DeadlineMiddleware, router=app.router)
+if COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MINIMUM_SIZE,
+        level=COMPRESSION_LEVEL,
+    )
+app.add_middleware(PreflightMiddleware, cors=CORSMiddleware(app=None, **cors_options))
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(AccessLogMiddleware)
@@ -0,0 +1,54 @@
+"""
+Map clustering over the in-memory geohash index.
+
+    python -m benchmarks.bench_clusters [points]
+"""
+import numpy as np
+
+from sys import argv
+from time import perf_counter, time
+
+from utils.geo_index import GeoIndex
+
+REPEAT = 50
+
+
+def timed(repeat: int, func, *args) -> float:
+    start = perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (perf_counter() - start) / repeat * 1000
+
+
+def main(points: int) -> None:
+    rng = np.random.default_rng(0)
+    # Taiwan-sized box so most zoom levels produce many clusters.
+    latitudes = rng.uniform(21.9, 25.3, points)
+    longitudes = rng.uniform(120.0, 122.0, points)
+    expires_at = time() + 3600
+    uids = [str(i) for i in range(points)]
+
+    index = GeoIndex()
+    start = perf_counter()
+    index.load(zip(uids, latitudes, longitudes, [expires_at] * points))
+    print(f"bulk load {points} points: {(perf_counter() - start) * 1000:.1f} ms")
+
+    for zoom in (4, 8, 12, 16):
+        clusters = index.clusters(21.9, 120.0, 25.3, 122.0, zoom)
+        elapsed = timed(REPEAT, index.clusters, 21.9, 120.0, 25.3, 122.0, zoom)
+        print(f"zoom {zoom:2d}: {len(clusters):6d} clusters in {elapsed:.2f} ms")
+
+    elapsed = timed(REPEAT, index.clusters, 24.9, 121.4, 25.2, 121.7, 14)
+    print(f"city viewport at zoom 14: {elapsed:.2f} ms")
+
+    start = perf_counter()
+    for i in range(1000):
+        index.add(f"new-{i}", 25.0, 121.5, expires_at)
+    for i in range(1000):
+        index.discard(uids[i])
+    elapsed = (perf_counter() - start) / 2000 * 1e6
+    print(f"incremental add/remove: {elapsed:.1f} us per operation")
+
+
+if __name__ == "__main__":
+    main(int(argv[1]) if len(argv) > 1 else 100_000)
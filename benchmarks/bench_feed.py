@@ -0,0 +1,59 @@
+"""
+Vectorized "for you" scoring over the columnar food store.
+
+    python -m benchmarks.bench_feed [candidates]
+"""
+import numpy as np
+
+from sys import argv
+from time import perf_counter, time
+
+from utils.food_ranker import FoodRanker, TAG_SLOTS
+
+REPEAT = 200
+
+
+class Entry():
+    def __init__(self, uid: str, doc: dict, expires_at: float):
+        self.uid = uid
+        self.doc = doc
+        self.expires_at = expires_at
+
+
+def main(candidates: int) -> None:
+    rng = np.random.default_rng(0)
+    now = time()
+    entries = [
+        Entry(
+            str(i),
+            {
+                "latitude": float(rng.uniform(24.9, 25.2)),
+                "longitude": float(rng.uniform(121.4, 121.7)),
+                "tags": rng.choice(16, size=3, replace=False).tolist(),
+            },
+            now + float(rng.uniform(-600, 6 * 3600)),
+        )
+        for i in range(candidates)
+    ]
+
+    ranker = FoodRanker()
+    start = perf_counter()
+    ranker.on_reset(entries)
+    print(f"load {candidates} candidates: {(perf_counter() - start) * 1000:.1f} ms")
+
+    for i in range(0, candidates, 7):
+        ranker.adjust_load(str(i), int(rng.integers(0, 5)))
+
+    preference = np.zeros(TAG_SLOTS, dtype=np.float32)
+    preference[[1, 4, 9]] = [0.5, 0.3, 0.2]
+
+    for limit in (20, 100):
+        start = perf_counter()
+        for _ in range(REPEAT):
+            ranker.rank((25.05, 121.55), preference, limit)
+        elapsed = (perf_counter() - start) / REPEAT * 1000
+        print(f"rank top {limit}: {elapsed:.2f} ms per request")
+
+
+if __name__ == "__main__":
+    main(int(argv[1]) if len(argv) > 1 else 50_000)
@@ -0,0 +1,101 @@
+"""
+Bulk food import against one POST /food per item, through the full ASGI
+stack.
+
+    python -m benchmarks.bench_food_import [--mongo URI] [--items N]
+
+Both paths create the same --items foods in a freshly dropped --db. The
+import is sent once as NDJSON and once as a JSON array. mongomock checks
+unique indexes by scanning the collection, so on the in-memory backend
+every insert costs O(collection) and large --items measure mongomock;
+use --mongo for realistic numbers.
+"""
+from orjson import dumps
+
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from time import perf_counter
+
+from .bench_routes import food_body, use_memory_backend
+
+
+def admin_headers(user_id: str) -> dict[str, str]:
+    from jwt import encode
+
+    from config import JWT_KEY
+    from schemas.jwt import JWTPayload
+
+    payload = JWTPayload(sub=user_id, is_admin=True).model_dump()
+    token = encode(payload=payload, key=JWT_KEY, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def main(args: Namespace) -> None:
+    import config
+    config.MONGODB_DB = args.db
+    config.RATE_LIMIT_ENABLED = False
+    config.LOG_ENABLED = False
+    if args.mongo is None:
+        use_memory_backend()
+    else:
+        config.MONGODB_URI = args.mongo
+        config.MONGODB_TLS = False
+        config.MONGODB_CAFILE = None
+
+    from httpx import ASGITransport, AsyncClient
+
+    from api import app
+    from database.database import client, setup as setup_db
+    from schemas.food import Food
+    from schemas.user import User
+
+    bodies = [food_body(i + 1) for i in range(args.items)]
+    payloads = {
+        "ndjson": b"\n".join(dumps(body) for body in bodies),
+        "array": dumps(bodies),
+    }
+
+    async def reset() -> dict[str, str]:
+        await client.drop_database(args.db)
+        await setup_db()
+        user = User(
+            email="admin@example.com",
+            username="admin",
+            phone="0912345678",
+            password=b"",
+        )
+        await user.insert()
+        return admin_headers(str(user.uid))
+
+    print(f"{'path':16s} {'items':>7s} {'seconds':>9s} {'items/s':>9s}")
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            headers = await reset()
+            start = perf_counter()
+            for body in bodies:
+                response = await http.post("/food", json=body, headers=headers)
+                assert response.status_code == 201, response.text
+            elapsed = perf_counter() - start
+            print(f"{'POST /food':16s} {args.items:7d} {elapsed:9.2f} {args.items / elapsed:9.0f}")
+
+            for name, payload in payloads.items():
+                headers = await reset()
+                start = perf_counter()
+                response = await http.post("/food/import", content=payload, headers=headers)
+                elapsed = perf_counter() - start
+                assert response.json()["imported"] == args.items, response.text
+                assert await Food.get_motor_collection().count_documents({}) == args.items
+                print(f"{'import ' + name:16s} {args.items:7d} {elapsed:9.2f} {args.items / elapsed:9.0f}")
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--mongo", help="URI of a mongod to run against instead of the in-memory backend")
+    parser.add_argument("--db", default="foodhood_bench", help="database to drop and seed")
+    parser.add_argument("--items", type=int, default=1000, help="foods to create per path")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(main(parse_args()))
@@ -0,0 +1,122 @@
+"""
+CPU time and stored bytes of the upload pipeline, before and after the
+ingestion normalization.
+
+    python -m benchmarks.bench_image_ingest [image directory]
+
+Without a directory a synthetic corpus of phone-sized photos is used.
+"""
+import numpy as np
+from PIL import Image, ImageOps
+
+from io import BytesIO
+from pathlib import Path
+from sys import argv
+from time import process_time
+from typing import Optional
+
+from config import IMAGE_PHOTO_MAX_SIZE
+from utils.image import process_image, sniff_format
+
+EXIF_ORIENTATION = 0x0112
+
+
+def legacy_pipeline(data: bytes) -> bytes:
+    output_bytes = BytesIO()
+    with Image.open(BytesIO(data)) as img:
+        img.verify()
+
+    with Image.open(BytesIO(data)) as img:
+        img_sdr = ImageOps.autocontrast(img)
+        img_sdr.save(output_bytes, format=img.format)
+    return output_bytes.getvalue()
+
+
+def normalized_pipeline(data: bytes) -> bytes:
+    buffer = BytesIO(data)
+    output, _ = process_image(buffer, sniff_format(data[:12]), IMAGE_PHOTO_MAX_SIZE)
+    return output
+
+
+def synthetic_photo(width: int, height: int, seed: int) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        128 + 100 * np.sin(x / (width / 7) + seed),
+        128 + 100 * np.cos(y / (height / 5)),
+        128 + 60 * np.sin((x + y) / (width / 3)),
+    ], axis=-1)
+    base += rng.normal(0, 3, base.shape)
+    return Image.fromarray(np.clip(base, 0, 255).astype(np.uint8), "RGB")
+
+
+def synthetic_corpus() -> list[tuple[str, bytes]]:
+    corpus = []
+
+    for index, (width, height) in enumerate(((4032, 3024), (4000, 3000))):
+        buffer = BytesIO()
+        synthetic_photo(width, height, index).save(buffer, "JPEG", quality=92)
+        corpus.append((f"photo_{width}x{height}.jpg", buffer.getvalue()))
+
+    buffer = BytesIO()
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    synthetic_photo(4032, 3024, 7).save(buffer, "JPEG", quality=92, exif=exif)
+    corpus.append(("rotated_4032x3024.jpg", buffer.getvalue()))
+
+    buffer = BytesIO()
+    synthetic_photo(1600, 1600, 3).convert("RGBA").save(buffer, "PNG")
+    corpus.append(("screenshot_1600x1600.png", buffer.getvalue()))
+
+    return corpus
+
+
+def directory_corpus(directory: Path) -> list[tuple[str, bytes]]:
+    corpus = []
+    for path in sorted(directory.iterdir()):
+        data = path.read_bytes()
+        if sniff_format(data[:12]) is not None:
+            corpus.append((path.name, data))
+    return corpus
+
+
+def measure(pipeline, data: bytes) -> tuple[float, Optional[int]]:
+    start = process_time()
+    try:
+        output = pipeline(data)
+    except OSError:
+        # The legacy pipeline cannot autocontrast images with alpha.
+        return (process_time() - start) * 1000, None
+    return (process_time() - start) * 1000, len(output)
+
+
+def main() -> None:
+    if len(argv) > 1:
+        corpus = directory_corpus(Path(argv[1]))
+    else:
+        corpus = synthetic_corpus()
+
+    totals = [0.0, 0, 0.0, 0]
+    print(f"{'image':28s} {'input':>10s} {'before ms':>10s} {'before B':>10s} {'after ms':>10s} {'after B':>10s}")
+    for name, data in corpus:
+        legacy_ms, legacy_bytes = measure(legacy_pipeline, data)
+        normalized_ms, normalized_bytes = measure(normalized_pipeline, data)
+        print(
+            f"{name:28s} {len(data):10d} {legacy_ms:10.1f} "
+            f"{legacy_bytes if legacy_bytes is not None else 'rejected':>10} "
+            f"{normalized_ms:10.1f} {normalized_bytes:10d}"
+        )
+        if legacy_bytes is None:
+            continue
+        totals[0] += legacy_ms
+        totals[1] += legacy_bytes
+        totals[2] += normalized_ms
+        totals[3] += normalized_bytes
+    print(
+        f"{'total (accepted by both)':28s} {'':10s} {totals[0]:10.1f} {totals[1]:10d} "
+        f"{totals[2]:10.1f} {totals[3]:10d}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Lean read endpoints against the Beanie hydration they replaced: latency
+and traced allocation per request, through the full ASGI stack.
+
+    python -m benchmarks.bench_lean_reads [--mongo URI] [--requests N]
+
+The hydrating versions are mounted under /hydrated for the run only.
+Latency is measured without tracing; the allocation pass runs the same
+requests again under tracemalloc and reports the peak memory allocated
+while serving one request. The food snapshot is off unless --snapshot is
+given, so GET /food/{food_id} is measured on its database path.
+"""
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from statistics import mean, median
+from time import perf_counter
+from tracemalloc import get_traced_memory, reset_peak, start as start_tracing, stop as stop_tracing
+from typing import Any, Callable
+
+from .bench_routes import pick, seed_data, Seed, use_memory_backend
+
+
+def hydrated_router():
+    """The read endpoints as they were: Beanie documents, dumped and revalidated."""
+    from fastapi import APIRouter, HTTPException
+
+    from routes.auth import UIDDepends
+    from schemas.food import Food, FoodView
+    from schemas.order import Order, OrderView
+    from schemas.user import User, UserView
+
+    router = APIRouter(prefix="/hydrated")
+
+    @router.get("/food/{food_id}", response_model=FoodView)
+    async def get_food(food_id: str) -> FoodView:
+        food = await Food.find_one(Food.uid == food_id, fetch_links=True)
+        if food is None:
+            raise HTTPException(404)
+        return FoodView(**food.model_dump())
+
+    @router.get("/food/{food_id}/status", response_model=list[OrderView])
+    async def get_food_status(food_id: str) -> list[OrderView]:
+        food = await Food.find_one(Food.uid == food_id)
+        if food is None:
+            raise HTTPException(404)
+        return await Order.find(Order.foodId == food_id, projection_model=OrderView).to_list()
+
+    @router.get("/user/{user_id}", response_model=UserView)
+    async def get_user_data(user_id: str) -> UserView:
+        user = await User.find_one(User.uid == user_id)
+        if user is None:
+            raise HTTPException(404)
+        return UserView(**user.model_dump())
+
+    @router.get("/order", response_model=list[OrderView])
+    async def get_my_orders(user_id: UIDDepends) -> list[OrderView]:
+        return await Order.find(Order.userId == user_id, projection_model=OrderView).to_list()
+
+    return router
+
+
+ROUTES: list[tuple[str, Callable[[Seed, int], tuple[str, dict[str, Any]]]]] = [
+    ("GET /food/{food_id}", lambda s, i: (f"/food/{pick(s.foods, i)}", {})),
+    ("GET /food/{food_id}/status", lambda s, i: (f"/food/{pick(s.foods, i)}/status", {})),
+    ("GET /user/{user_id}", lambda s, i: (f"/user/{pick(s.users, i)}", {})),
+    ("GET /order", lambda s, i: ("/order", {"headers": s.headers})),
+]
+
+
+async def measure(client, seed: Seed, make, prefix: str, requests: int) -> dict[str, float]:
+    for i in range(10):
+        url, kwargs = make(seed, i)
+        response = await client.get(prefix + url, **kwargs)
+        assert response.status_code == 200, (prefix + url, response.status_code)
+
+    latencies = []
+    for i in range(requests):
+        url, kwargs = make(seed, i)
+        start = perf_counter()
+        await client.get(prefix + url, **kwargs)
+        latencies.append(perf_counter() - start)
+
+    peaks = []
+    start_tracing()
+    try:
+        for i in range(requests):
+            url, kwargs = make(seed, i)
+            before, _ = get_traced_memory()
+            reset_peak()
+            await client.get(prefix + url, **kwargs)
+            peaks.append(get_traced_memory()[1] - before)
+    finally:
+        stop_tracing()
+
+    return {
+        "p50_ms": median(latencies) * 1000,
+        "mean_ms": mean(latencies) * 1000,
+        "peak_kib": mean(peaks) / 1024,
+    }
+
+
+async def main(args: Namespace) -> None:
+    import config
+    config.MONGODB_DB = args.db
+    config.RATE_LIMIT_ENABLED = False
+    config.SNAPSHOT_ENABLED = args.snapshot
+    if args.mongo is None:
+        use_memory_backend()
+    else:
+        config.MONGODB_URI = args.mongo
+        config.MONGODB_TLS = False
+        config.MONGODB_CAFILE = None
+
+    from httpx import ASGITransport, AsyncClient
+
+    from api import app
+    from database.database import client, setup as setup_db
+
+    app.include_router(hydrated_router())
+    await client.drop_database(args.db)
+    await setup_db()
+    seed = await seed_data(args)
+
+    print(
+        f"{'route':28s} {'path':9s} {'p50 ms':>8s} {'mean ms':>8s} {'peak KiB':>9s}"
+    )
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://bench") as http:
+            for name, make in ROUTES:
+                for path, prefix in (("hydrated", "/hydrated"), ("lean", "")):
+                    result = await measure(http, seed, make, prefix, args.requests)
+                    print(
+                        f"{name:28s} {path:9s} {result['p50_ms']:8.2f} "
+                        f"{result['mean_ms']:8.2f} {result['peak_kib']:9.1f}"
+                    )
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--mongo", help="URI of a mongod to run against instead of the in-memory backend")
+    parser.add_argument("--db", default="foodhood_bench", help="database to drop and seed")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--foods", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route and path")
+    parser.add_argument("--snapshot", action="store_true", help="serve GET /food/{food_id} from the snapshot")
+    args = parser.parse_args()
+    # seed_data also seeds the orders bench_routes cancels and updates.
+    args.warmup = 0
+    return args
+
+
+if __name__ == "__main__":
+    run(main(parse_args()))
@@ -0,0 +1,531 @@
+"""
+Throughput and latency of every route, driven in-process through the ASGI
+transport against seeded data.
+
+    python -m benchmarks.bench_routes [--mongo URI] [--baseline PATH] ...
+
+Without --mongo an in-memory Motor stand-in (mongomock-motor) is used. With
+--mongo the --db database is dropped and reseeded, so never point it at a
+database you care about.
+
+Results are written as JSON. When a baseline exists the run is compared
+against it and exits with status 1 if any route's p95 latency or throughput
+regressed by more than --threshold. Latencies are only comparable between
+runs on the same machine and backend; refresh the baseline with
+--save-baseline after an intended change.
+
+Requests ask for identity encoding unless --gzip is given. The in-process
+client decompresses on the same CPU as the server, which real clients
+don't, so compare wire bytes rather than throughput across that flag.
+"""
+import numpy as np
+from PIL import Image
+
+from argparse import ArgumentParser, Namespace
+from asyncio import gather, run, sleep
+from io import BytesIO
+from json import dumps, loads
+from pathlib import Path
+from platform import python_version
+from sys import exit
+from time import perf_counter, time
+from typing import Any, Callable, Optional
+
+BASELINE = Path(__file__).with_name("baseline_routes.json")
+PASSWORD = "benchmark-password"
+
+
+class Seed():
+    """Identifiers of the seeded data the scenarios draw from."""
+    headers: dict[str, str]
+    email: str
+    user_id: str
+    users: list[str]
+    foods: list[str]
+    photos: list[tuple[str, int]]
+    jobs: list[str]
+    cancel_orders: list[str]
+    update_orders: list[str]
+    jpeg: bytes
+
+    def __init__(self):
+        self.headers = {}
+        self.users = []
+        self.foods = []
+        self.photos = []
+        self.jobs = []
+        self.cancel_orders = []
+        self.update_orders = []
+
+
+class Scenario():
+    """
+    One route. make(seed, i) returns the URL and the request arguments of
+    the i-th request; max_requests caps routes dominated by bcrypt.
+    """
+    method: str
+    route: str
+    make: Callable[[Seed, int], tuple[str, dict[str, Any]]]
+    expect: tuple[int, ...]
+    max_requests: Optional[int]
+
+    def __init__(
+        self,
+        method: str,
+        route: str,
+        make: Callable[[Seed, int], tuple[str, dict[str, Any]]],
+        expect: tuple[int, ...] = (200,),
+        max_requests: Optional[int] = None,
+    ):
+        self.method = method
+        self.route = route
+        self.make = make
+        self.expect = expect
+        self.max_requests = max_requests
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.route}"
+
+
+def food_body(i: int) -> dict[str, Any]:
+    rng = np.random.default_rng(i)
+    return {
+        "title": f"Food {i}",
+        "description": "Leftover lunch boxes, still warm.",
+        "includesVegetarian": bool(rng.integers(2)),
+        "needTableware": bool(rng.integers(2)),
+        "tags": sorted({int(tag) for tag in rng.integers(0, 20, 3)}),
+        "latitude": float(rng.uniform(24.95, 25.15)),
+        "longitude": float(rng.uniform(121.45, 121.65)),
+        "locationDescription": "Near the station exit",
+        "validityPeriod": float(rng.choice([1, 2, 4, 8])),
+        "createdAt": int(time() - rng.uniform(0, 3600)),
+    }
+
+
+def synthetic_jpeg(width: int, height: int, seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    img = Image.fromarray(pixels, "RGB").resize((width, height))
+    buffer = BytesIO()
+    img.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def pick(items: list, i: int):
+    return items[i % len(items)]
+
+
+SCENARIOS = [
+    Scenario("POST", "/auth/check", lambda s, i: (
+        "/auth/check", {"json": {"email": s.email}})),
+    Scenario("POST", "/auth/login", lambda s, i: (
+        "/auth/login", {"json": {"email": s.email, "password": PASSWORD}}),
+        max_requests=20),
+    Scenario("POST", "/auth/register", lambda s, i: (
+        "/auth/register", {"json": {
+            "email": f"register-{i}-{int(time() * 1000)}@example.com",
+            "username": f"register{i}",
+            "phone": "0912345678",
+            "password": PASSWORD,
+        }}), expect=(201,), max_requests=20),
+    Scenario("PUT", "/auth/refresh", lambda s, i: (
+        "/auth/refresh", {"headers": s.headers})),
+    Scenario("GET", "/user", lambda s, i: (
+        "/user", {"headers": s.headers})),
+    Scenario("PUT", "/user", lambda s, i: (
+        "/user", {"headers": s.headers, "json": {"username": f"bench{i}"}}),
+        expect=(201,)),
+    Scenario("GET", "/user/{user_id}", lambda s, i: (
+        f"/user/{pick(s.users, i)}", {})),
+    Scenario("GET", "/food", lambda s, i: ("/food", {})),
+    Scenario("POST", "/food", lambda s, i: (
+        "/food", {"headers": s.headers, "json": food_body(i)}),
+        expect=(201,)),
+    Scenario("GET", "/food/clusters", lambda s, i: (
+        "/food/clusters", {"params": {
+            "south": 24.9, "west": 121.4, "north": 25.2, "east": 121.7,
+            "zoom": 10 + i % 6,
+        }})),
+    Scenario("GET", "/food/feed", lambda s, i: (
+        "/food/feed", {"headers": s.headers, "params": {
+            "latitude": 25.05, "longitude": 121.55, "limit": 20,
+        }})),
+    Scenario("GET", "/food/{food_id}", lambda s, i: (
+        f"/food/{pick(s.foods, i)}", {})),
+    Scenario("GET", "/food/{food_id}/photos/{index}", lambda s, i: (
+        "/food/{}/photos/{}".format(*pick(s.photos, i)), {})),
+    Scenario("GET", "/food/{food_id}/order", lambda s, i: (
+        f"/food/{pick(s.foods, i)}/order", {"headers": s.headers})),
+    Scenario("GET", "/food/{food_id}/status", lambda s, i: (
+        f"/food/{pick(s.foods, i)}/status", {})),
+    Scenario("GET", "/order", lambda s, i: (
+        "/order", {"headers": s.headers})),
+    Scenario("PUT", "/order/{order_id}", lambda s, i: (
+        f"/order/{pick(s.update_orders, i)}", {
+            "headers": s.headers, "json": {"received": i % 2 == 0},
+        })),
+    Scenario("DELETE", "/order/{order_id}", lambda s, i: (
+        f"/order/{s.cancel_orders[i]}", {"headers": s.headers}),
+        expect=(204,)),
+    Scenario("GET", "/avatar", lambda s, i: (
+        "/avatar", {"headers": s.headers})),
+    Scenario("GET", "/avatar/{uid}", lambda s, i: (
+        f"/avatar/{pick(s.users, i)}", {})),
+    Scenario("GET", "/job/{job_id}", lambda s, i: (
+        f"/job/{pick(s.jobs, i)}", {})),
+    Scenario("GET", "/metrics", lambda s, i: ("/metrics", {})),
+    # Uploads last: the jobs they enqueue keep the in-process worker busy.
+    Scenario("POST", "/food/{food_id}/photos", lambda s, i: (
+        f"/food/{pick(s.foods, i)}/photos", {
+            "files": [("file", ("photo.jpg", s.jpeg, "image/jpeg"))],
+        }), expect=(202,)),
+    Scenario("POST", "/avatar", lambda s, i: (
+        "/avatar", {
+            "headers": s.headers,
+            "files": {"file": ("avatar.jpg", s.jpeg, "image/jpeg")},
+        }), expect=(202,)),
+    Scenario("DELETE", "/avatar", lambda s, i: (
+        "/avatar", {"headers": s.headers}), expect=(204,)),
+]
+
+
+def use_memory_backend() -> None:
+    """Swap Motor for mongomock-motor before the database module is imported."""
+    try:
+        import mongomock.collection
+        import mongomock_motor
+    except ImportError:
+        exit("The in-memory backend needs mongomock-motor; pass --mongo to use a mongod.")
+    import motor.motor_asyncio
+    from pymongo.errors import OperationFailure
+
+    def watch(*args, **kwargs):
+        # Like a standalone mongod: the snapshot falls back to polling.
+        raise OperationFailure("Change streams are not supported", 40573)
+
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def add_update_without_sort(self, *args, sort=None, **kwargs):
+        # pymongo 4.11 passes sort, which mongomock's bulk builder predates.
+        return add_update(self, *args, **kwargs)
+
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    mongomock.collection.Collection.watch = watch
+    mongomock.collection.BulkOperationBuilder.add_update = add_update_without_sort
+
+
+async def seed_data(args: Namespace) -> Seed:
+    from bcrypt import gensalt, hashpw
+    from bson import Binary
+    from hashlib import sha256
+
+    from routes.auth import generate_jwt
+    from schemas.avatar import Avatar
+    from schemas.food import Food
+    from schemas.food_image import FoodImage
+    from schemas.image_blob import ImageBlob
+    from schemas.image_job import ImageJob
+    from schemas.order import Order
+    from schemas.user import User
+
+    rng = np.random.default_rng(0)
+    seed = Seed()
+    # One hash for everyone, seeding should not take users * 250 ms.
+    password = hashpw(PASSWORD.encode("utf-8"), gensalt())
+
+    users = [
+        User(
+            email=f"user{i}@example.com",
+            username=f"user{i}",
+            phone="0912345678",
+            password=password,
+        )
+        for i in range(args.users)
+    ]
+    await User.insert_many(users)
+    bench_user = users[0]
+    seed.email = bench_user.email
+    seed.user_id = str(bench_user.uid)
+    seed.users = [str(user.uid) for user in users]
+    seed.headers = {
+        "Authorization": f"Bearer {generate_jwt(bench_user).access_token}"
+    }
+
+    seed.jpeg = synthetic_jpeg(1280, 960, 0)
+    blobs = []
+    for i in range(8):
+        data = synthetic_jpeg(800, 600, i + 1)
+        blobs.append(ImageBlob(
+            sha256=sha256(data).hexdigest(),
+            raw_hashes=[],
+            content_type="image/jpeg",
+            data=Binary(data),
+        ))
+
+    foods = []
+    images = []
+    for i in range(args.foods):
+        food = Food(**food_body(i + 1), authorId=pick(seed.users, i))
+        food.imageCount = int(rng.integers(0, 4))
+        for index in range(food.imageCount):
+            blob = blobs[int(rng.integers(len(blobs)))]
+            blob.ref_count += 1
+            images.append(FoodImage(
+                food_id=food.uid,
+                index=index,
+                blob=blob.sha256,
+                content_type=blob.content_type,
+            ))
+            seed.photos.append((str(food.uid), index))
+        foods.append(food)
+    await Food.insert_many(foods)
+    await FoodImage.insert_many(images)
+    seed.foods = [str(food.uid) for food in foods]
+
+    avatars = []
+    for uid in seed.users[1::2]:
+        blob = blobs[int(rng.integers(len(blobs)))]
+        blob.ref_count += 1
+        avatars.append(Avatar(uid=uid, blob=blob.sha256, content_type=blob.content_type))
+    await Avatar.insert_many(avatars)
+    await ImageBlob.insert_many(blobs)
+
+    orders = []
+    for _ in range(args.orders):
+        received = bool(rng.integers(2))
+        orders.append(Order(
+            foodId=pick(seed.foods, int(rng.integers(args.foods))),
+            userId=pick(seed.users, int(rng.integers(1, args.users))),
+            received=received,
+            complete=received and bool(rng.integers(2)),
+        ))
+    own = [
+        Order(foodId=pick(seed.foods, i), userId=seed.user_id)
+        for i in range(args.requests + args.warmup + 50)
+    ]
+    await Order.insert_many(orders + own)
+    seed.cancel_orders = [str(order.uid) for order in own[50:]]
+    seed.update_orders = [str(order.uid) for order in own[:50]]
+
+    jobs = [
+        ImageJob(
+            kind="photo",
+            target_id=pick(seed.foods, i),
+            image_format="JPEG",
+            raw_digest="0" * 64,
+            status="done",
+        )
+        for i in range(100)
+    ]
+    await ImageJob.insert_many(jobs)
+    seed.jobs = [str(job.uid) for job in jobs]
+
+    return seed
+
+
+async def measure(
+    client,
+    seed: Seed,
+    scenario: Scenario,
+    requests: int,
+    warmup: int,
+    concurrency: int,
+) -> dict[str, Any]:
+    if scenario.max_requests is not None:
+        requests = min(requests, scenario.max_requests)
+        warmup = min(warmup, 1)
+
+    latencies = np.empty(requests, dtype=np.float64)
+    errors = 0
+    cursor = 0
+    downloaded = 0
+
+    async def send(i: int) -> int:
+        nonlocal downloaded
+        url, kwargs = scenario.make(seed, i)
+        response = await client.request(scenario.method, url, **kwargs)
+        downloaded += response.num_bytes_downloaded
+        return response.status_code
+
+    for i in range(warmup):
+        await send(requests + i)
+    downloaded = 0
+
+    async def worker() -> None:
+        nonlocal cursor, errors
+        while cursor < requests:
+            i = cursor
+            cursor += 1
+            start = perf_counter()
+            status_code = await send(i)
+            latencies[i] = perf_counter() - start
+            if status_code not in scenario.expect:
+                errors += 1
+
+    start = perf_counter()
+    await gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "bytes": downloaded / requests,
+    }
+
+
+def compare(
+    results: dict[str, dict[str, Any]],
+    baseline: dict[str, dict[str, Any]],
+    threshold: float,
+) -> list[str]:
+    """
+    Names of the routes whose p95 latency rose, or whose throughput fell, by
+    more than threshold relative to the baseline.
+    """
+    regressions = []
+    print()
+    print(f"{'route':40s} {'p95 ms':>10s} {'base':>10s} {'req/s':>10s} {'base':>10s}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        regressed = (
+            result["p95_ms"] > base["p95_ms"] * (1 + threshold)
+            or result["throughput"] < base["throughput"] / (1 + threshold)
+        )
+        print(
+            f"{name:40s} {result['p95_ms']:10.2f} {base['p95_ms']:10.2f} "
+            f"{result['throughput']:10.1f} {base['throughput']:10.1f}"
+            f"{'  REGRESSED' if regressed else ''}"
+        )
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+async def main(args: Namespace) -> int:
+    # The backend has to be chosen before the application is imported,
+    # database.database creates its client at import time.
+    import config
+    config.MONGODB_DB = args.db
+    # Every request comes from one address, the limiter would measure itself.
+    config.RATE_LIMIT_ENABLED = False
+    # The scenario measures rendering, not the admin check in front of it.
+    config.METRICS_PUBLIC = True
+    if args.mongo is None:
+        use_memory_backend()
+    else:
+        config.MONGODB_URI = args.mongo
+        config.MONGODB_TLS = False
+        config.MONGODB_CAFILE = None
+
+    from httpx import ASGITransport, AsyncClient
+
+    from api import app
+    from database.database import client, setup as setup_db
+
+    await client.drop_database(args.db)
+    await setup_db()
+    start = perf_counter()
+    seed = await seed_data(args)
+    print(
+        f"seeded {args.users} users, {args.foods} foods, {len(seed.photos)} photos, "
+        f"{args.orders} orders in {perf_counter() - start:.1f} s"
+    )
+
+    results: dict[str, dict[str, Any]] = {}
+    async with app.router.lifespan_context(app):
+        # Let the background loaders pick up the seeded data.
+        await sleep(0.5)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(
+            transport=transport,
+            base_url="http://bench",
+            headers={"Accept-Encoding": "gzip" if args.gzip else "identity"},
+        ) as http:
+            print(
+                f"{'route':40s} {'req/s':>10s} {'p50 ms':>10s} {'p95 ms':>10s} "
+                f"{'p99 ms':>10s} {'bytes':>10s} {'errors':>7s}"
+            )
+            for scenario in SCENARIOS:
+                if args.route and not any(part in scenario.name for part in args.route):
+                    continue
+                result = await measure(
+                    http,
+                    seed,
+                    scenario,
+                    args.requests,
+                    args.warmup,
+                    args.concurrency,
+                )
+                results[scenario.name] = result
+                print(
+                    f"{scenario.name:40s} {result['throughput']:10.1f} "
+                    f"{result['p50_ms']:10.2f} {result['p95_ms']:10.2f} "
+                    f"{result['p99_ms']:10.2f} {result['bytes']:10.0f} {result['errors']:7d}"
+                )
+
+    report = {
+        "meta": {
+            "backend": "mongod" if args.mongo else "memory",
+            "python": python_version(),
+            "timestamp": int(time()),
+            "users": args.users,
+            "foods": args.foods,
+            "orders": args.orders,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "gzip": args.gzip,
+        },
+        "routes": results,
+    }
+    args.output.write_text(dumps(report, indent=2) + "\n")
+    print(f"\nwrote {args.output}")
+
+    if args.save_baseline:
+        args.baseline.write_text(dumps(report, indent=2) + "\n")
+        print(f"wrote baseline {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        return 0
+    baseline = loads(args.baseline.read_text())
+    for key in ("backend", "users", "foods", "orders", "concurrency", "gzip"):
+        if baseline["meta"].get(key, False) != report["meta"][key]:
+            print(f"baseline was measured with {key}={baseline['meta'].get(key, False)}, not comparing")
+            return 0
+    regressions = compare(results, baseline["routes"], args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} route(s) regressed by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--mongo", help="URI of a mongod to run against instead of the in-memory backend")
+    parser.add_argument("--db", default="foodhood_bench", help="database to drop and seed")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--foods", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--gzip", action="store_true", help="accept gzip-encoded responses")
+    parser.add_argument("--route", action="append", help="only run routes whose name contains this, repeatable")
+    parser.add_argument("--output", type=Path, default=Path("bench_routes.json"))
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    exit(run(main(parse_args())))
@@ -0,0 +1,83 @@
+"""
+Cold start of a worker with and without fast_start: importing the
+application, then running its lifespan startup until it would serve.
+Every sample is a fresh interpreter.
+
+    python -m benchmarks.bench_startup [--mongo URI] [--repeat N]
+
+Without --mongo the in-memory backend of bench_routes is used, where
+index builds cost next to nothing; use a mongod for representative numbers.
+"""
+from argparse import ArgumentParser, Namespace, SUPPRESS
+from asyncio import run
+from json import dumps, loads
+from statistics import median
+from subprocess import run as run_process
+from sys import executable
+from time import perf_counter
+
+
+async def child(args: Namespace) -> None:
+    start = perf_counter()
+    import config
+    config.FAST_START = args.child == "fast"
+    config.MONGODB_DB = args.db
+    if args.mongo is None:
+        from .bench_routes import use_memory_backend
+        use_memory_backend()
+    else:
+        config.MONGODB_URI = args.mongo
+        config.MONGODB_TLS = False
+        config.MONGODB_CAFILE = None
+
+    from api import app
+    imported = perf_counter()
+
+    async with app.router.lifespan_context(app):
+        ready = perf_counter()
+    print(dumps({
+        "import_ms": (imported - start) * 1000,
+        "startup_ms": (ready - imported) * 1000,
+    }))
+
+
+def sample(args: Namespace, mode: str) -> dict[str, float]:
+    command = [executable, "-m", "benchmarks.bench_startup", "--child", mode, "--db", args.db]
+    if args.mongo is not None:
+        command += ["--mongo", args.mongo]
+
+    start = perf_counter()
+    result = run_process(command, capture_output=True, check=True, text=True)
+    wall = (perf_counter() - start) * 1000
+    timings = loads(result.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = wall
+    return timings
+
+
+def main(args: Namespace) -> None:
+    print(f"{'mode':8s} {'import ms':>10s} {'startup ms':>11s} {'process ms':>11s}")
+    for mode in ("indexes", "fast"):
+        samples = [sample(args, mode) for _ in range(args.repeat)]
+        print(
+            f"{mode:8s} "
+            f"{median(s['import_ms'] for s in samples):10.1f} "
+            f"{median(s['startup_ms'] for s in samples):11.1f} "
+            f"{median(s['process_ms'] for s in samples):11.1f}"
+        )
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--mongo", help="URI of a mongod to run against instead of the in-memory backend")
+    parser.add_argument("--db", default="foodhood_bench")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per mode, the median is reported")
+    parser.add_argument("--child", choices=("indexes", "fast"), help=SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.child is not None:
+        run(child(arguments))
+    else:
+        main(arguments)
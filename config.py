@@ -1,6 +1,6 @@
 from orjson import dumps, loads, OPT_INDENT_2
 from pydantic import BaseModel
-from os import urandom
+from os import path, urandom
 from typing import Optional
 
 
@@ -9,27 +9,234 @@ class MongoDBConfig(BaseModel):
     db_name: str = "foodhood"
     use_tls: bool = False
     tls_cafile: Optional[str] = None
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    max_idle_time_ms: Optional[int] = None
+    wait_queue_timeout_ms: Optional[int] = None
+    server_selection_timeout_ms: int = 30000
+    # Any of "zstd", "snappy" and "zlib"; zstd and snappy need their packages.
+    compressors: list[str] = []
+    max_time_ms: Optional[int] = None
+    # Keyed by endpoint function name, e.g. {"get_food_list": 500}.
+    route_max_time_ms: dict[str, int] = {}
+    secondary_reads: bool = False
+
+
+class SnapshotConfig(BaseModel):
+    enabled: bool = True
+    max_staleness: float = 30.0
+    refresh_interval: float = 10.0
+
+
+class FeedConfig(BaseModel):
+    distance_weight: float = 1.0
+    distance_scale_km: float = 2.0
+    urgency_weight: float = 0.5
+    urgency_scale_hours: float = 2.0
+    tag_weight: float = 0.8
+    load_weight: float = 0.6
+    load_refresh_interval: float = 30.0
+
+
+class PopularityConfig(BaseModel):
+    # Counters lost in a crash are at most one interval's worth.
+    flush_interval: float = 5.0
+    max_pending: int = 10_000
+    half_life_hours: float = 6.0
+    detail_view_weight: float = 1.0
+    photo_view_weight: float = 0.5
+    order_weight: float = 5.0
+
+
+class OrderCountConfig(BaseModel):
+    # How often per-food order counts are recomputed to repair drift.
+    reconcile_interval: float = 3600.0
+    # Foods whose counts are checked per query.
+    reconcile_page_size: int = 1000
+
+
+class FoodImportConfig(BaseModel):
+    # An import stops with 413 at the item past this many.
+    max_items: int = 10_000
+    # Foods per insert_many.
+    chunk_size: int = 1000
+
+
+class ArchiveConfig(BaseModel):
+    enabled: bool = True
+    interval: float = 3600.0
+    # Foods expired this long ago move to FoodsArchive with their orders.
+    min_age_hours: float = 24.0 * 30
+    # Foods expired this long ago move even with orders still not complete,
+    # those orders are taken as abandoned and move with them.
+    abandon_after_hours: float = 24.0 * 90
+    # Documents copied and deleted per insertMany/deleteMany.
+    batch_size: int = 500
+    # Sleep between batches, so a large backlog doesn't saturate the primary.
+    batch_pause: float = 0.2
+
+
+class ImageConfig(BaseModel):
+    avatar_max_size: int = 512
+    photo_max_size: int = 1600
+    quality: int = 85
+    max_pixels: int = 50_000_000
+    blob_gc_interval: float = 3600.0
+    blob_gc_grace: float = 600.0
+
+
+class BodyLimitConfig(BaseModel):
+    max_body_size: int = 1024 * 1024
+    # Bytes, keyed by endpoint function name, e.g. {"update_avatar": 6291456}.
+    route_max_body_sizes: dict[str, int] = {
+        "update_avatar": 6 * 1024 * 1024,
+        "upload_food_photos": 64 * 1024 * 1024,
+        "import_food": 32 * 1024 * 1024,
+    }
+
+
+class ImageWorkerConfig(BaseModel):
+    in_process: bool = True
+    concurrency: int = 2
+    poll_interval: float = 1.0
+    visibility_timeout: float = 60.0
+    max_attempts: int = 5
+    retry_backoff: float = 5.0
+    job_retention: int = 86400
+
+
+class CompressionConfig(BaseModel):
+    enabled: bool = True
+    # Bytes; smaller responses gain less than the gzip header costs.
+    minimum_size: int = 1024
+    level: int = 6
+    # Cached bodies, like the food list, are compressed once per version.
+    cached_level: int = 9
+
+
+class LoggingConfig(BaseModel):
+    enabled: bool = True
+    # JSON lines are appended to this file, or written to stdout if None.
+    path: Optional[str] = None
+    # Records past this many waiting are dropped and counted.
+    queue_size: int = 10_000
+    batch_size: int = 256
+    # Fraction of successful requests faster than slow_request_seconds
+    # that get an access record; errors and slow requests always do.
+    success_sample_rate: float = 1.0
+    slow_request_seconds: float = 1.0
+
+
+class ProfilingConfig(BaseModel):
+    enabled: bool = False
+    sample_every: int = 0
+    directory: str = "profiles"
+    max_profiles: int = 100
+    signature_ttl: int = 300
+
+
+class MetricsConfig(BaseModel):
+    # Serve /metrics without an admin token, for scrapers on a private network.
+    public: bool = False
+    # With several workers, where each dumps its metrics for the others.
+    directory: str = "metrics"
+    flush_interval: float = 5.0
+
+
+class DeadlineConfig(BaseModel):
+    default_budget: float = 30.0
+    # Seconds, keyed by endpoint function name, e.g. {"get_food_list": 2.0}.
+    route_budgets: dict[str, float] = {}
+    # 0 disables load shedding.
+    max_in_flight: int = 0
+    retry_after: int = 1
+
+
+class RateLimit(BaseModel):
+    rate: float
+    burst: int
+
+
+class RateLimitConfig(BaseModel):
+    enabled: bool = True
+    # "memory" keeps buckets per process, "mongo" shares them between workers.
+    storage: str = "memory"
+    bucket_retention: int = 3600
+    # Tokens per second and bucket size, keyed by path.
+    limits: dict[str, RateLimit] = {
+        "/auth/login": RateLimit(rate=0.2, burst=10),
+        "/auth/register": RateLimit(rate=0.05, burst=5),
+        "/auth/check": RateLimit(rate=1.0, burst=20),
+    }
+
+
+class EmailFilterConfig(BaseModel):
+    enabled: bool = True
+    capacity: int = 100_000
+    false_positive_rate: float = 0.01
+    # Rebuilds drop emails that are no longer registered, and without
+    # change streams pick up accounts registered by other processes.
+    refresh_interval: float = 600.0
+    # Without change streams the filter only sees registrations made by
+    # its own process. Set this if that is the only process writing Users,
+    # one worker on one host, to trust its negatives anyway.
+    single_process: bool = False
 
 
 class Config(BaseModel):
     host: str = "0.0.0.0"
     port: int = 8080
+    # Worker i of main.py generates snowflakes with instance_id + i.
     instance_id: int = 0
+    workers: int = 1
+    graceful_timeout: float = 30.0
+    # Skip index creation at startup, run migrate.py on deploy instead.
+    fast_start: bool = False
     jwt_key: str = urandom(16).hex()
     allow_origins: list[str] = []
     mongodb_config: MongoDBConfig = MongoDBConfig()
+    snapshot_config: SnapshotConfig = SnapshotConfig()
+    feed_config: FeedConfig = FeedConfig()
+    popularity_config: PopularityConfig = PopularityConfig()
+    order_count_config: OrderCountConfig = OrderCountConfig()
+    image_config: ImageConfig = ImageConfig()
+    image_worker_config: ImageWorkerConfig = ImageWorkerConfig()
+    body_limit_config: BodyLimitConfig = BodyLimitConfig()
+    compression_config: CompressionConfig = CompressionConfig()
+    logging_config: LoggingConfig = LoggingConfig()
+    archive_config: ArchiveConfig = ArchiveConfig()
+    food_import_config: FoodImportConfig = FoodImportConfig()
+    profiling_config: ProfilingConfig = ProfilingConfig()
+    metrics_config: MetricsConfig = MetricsConfig()
+    deadline_config: DeadlineConfig = DeadlineConfig()
+    rate_limit_config: RateLimitConfig = RateLimitConfig()
+    email_filter_config: EmailFilterConfig = EmailFilterConfig()
+
+
+def write_config(config: Config) -> None:
+    with open("config.json", "wb") as config_file:
+        config_file.write(dumps(config.model_dump(), option=OPT_INDENT_2))
 
 
 if __name__ == "config":
-    try:
-        with open("config.json", "rb") as config_file:
-            config = Config(**loads(config_file.read()))
-    except:
+    config_exists = path.exists("config.json")
+    if config_exists:
+        # Falling back to defaults here would give every process its own
+        # random jwt_key, which is never saved.
+        try:
+            with open("config.json", "rb") as config_file:
+                config = Config(**loads(config_file.read()))
+        except (OSError, TypeError, ValueError) as error:
+            raise SystemExit(f"config.json exists but can't be loaded: {error}")
+    else:
         config = Config()
 
     HOST = config.host
     PORT = config.port
     INSTANCE_ID = config.instance_id
+    WORKERS = config.workers
+    GRACEFUL_TIMEOUT = config.graceful_timeout
+    FAST_START = config.fast_start
     JWT_KEY = config.jwt_key
     ORIGINS = config.allow_origins
 
@@ -37,6 +244,105 @@ if __name__ == "config":
     MONGODB_DB = config.mongodb_config.db_name
     MONGODB_TLS = config.mongodb_config.use_tls
     MONGODB_CAFILE = config.mongodb_config.tls_cafile
+    MONGODB_MAX_POOL_SIZE = config.mongodb_config.max_pool_size
+    MONGODB_MIN_POOL_SIZE = config.mongodb_config.min_pool_size
+    MONGODB_MAX_IDLE_TIME_MS = config.mongodb_config.max_idle_time_ms
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS = config.mongodb_config.wait_queue_timeout_ms
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = config.mongodb_config.server_selection_timeout_ms
+    MONGODB_COMPRESSORS = config.mongodb_config.compressors
+    MONGODB_MAX_TIME_MS = config.mongodb_config.max_time_ms
+    MONGODB_ROUTE_MAX_TIME_MS = config.mongodb_config.route_max_time_ms
+    MONGODB_SECONDARY_READS = config.mongodb_config.secondary_reads
 
-    with open("config.json", "wb") as config_file:
-        config_file.write(dumps(config.model_dump(), option=OPT_INDENT_2))
+    SNAPSHOT_ENABLED = config.snapshot_config.enabled
+    SNAPSHOT_MAX_STALENESS = config.snapshot_config.max_staleness
+    SNAPSHOT_REFRESH_INTERVAL = config.snapshot_config.refresh_interval
+
+    FEED_DISTANCE_WEIGHT = config.feed_config.distance_weight
+    FEED_DISTANCE_SCALE_KM = config.feed_config.distance_scale_km
+    FEED_URGENCY_WEIGHT = config.feed_config.urgency_weight
+    FEED_URGENCY_SCALE_HOURS = config.feed_config.urgency_scale_hours
+    FEED_TAG_WEIGHT = config.feed_config.tag_weight
+    FEED_LOAD_WEIGHT = config.feed_config.load_weight
+    FEED_LOAD_REFRESH_INTERVAL = config.feed_config.load_refresh_interval
+
+    POPULARITY_FLUSH_INTERVAL = config.popularity_config.flush_interval
+    POPULARITY_MAX_PENDING = config.popularity_config.max_pending
+    POPULARITY_HALF_LIFE_HOURS = config.popularity_config.half_life_hours
+    POPULARITY_DETAIL_VIEW_WEIGHT = config.popularity_config.detail_view_weight
+    POPULARITY_PHOTO_VIEW_WEIGHT = config.popularity_config.photo_view_weight
+    POPULARITY_ORDER_WEIGHT = config.popularity_config.order_weight
+
+    ORDER_COUNT_RECONCILE_INTERVAL = config.order_count_config.reconcile_interval
+    ORDER_COUNT_RECONCILE_PAGE_SIZE = config.order_count_config.reconcile_page_size
+
+    IMAGE_AVATAR_MAX_SIZE = config.image_config.avatar_max_size
+    IMAGE_PHOTO_MAX_SIZE = config.image_config.photo_max_size
+    IMAGE_QUALITY = config.image_config.quality
+    IMAGE_MAX_PIXELS = config.image_config.max_pixels
+    IMAGE_BLOB_GC_INTERVAL = config.image_config.blob_gc_interval
+    IMAGE_BLOB_GC_GRACE = config.image_config.blob_gc_grace
+
+    MAX_BODY_SIZE = config.body_limit_config.max_body_size
+    ROUTE_MAX_BODY_SIZES = config.body_limit_config.route_max_body_sizes
+
+    IMAGE_WORKER_IN_PROCESS = config.image_worker_config.in_process
+    IMAGE_WORKER_CONCURRENCY = config.image_worker_config.concurrency
+    IMAGE_WORKER_POLL_INTERVAL = config.image_worker_config.poll_interval
+    IMAGE_JOB_VISIBILITY_TIMEOUT = config.image_worker_config.visibility_timeout
+    IMAGE_JOB_MAX_ATTEMPTS = config.image_worker_config.max_attempts
+    IMAGE_JOB_RETRY_BACKOFF = config.image_worker_config.retry_backoff
+    IMAGE_JOB_RETENTION = config.image_worker_config.job_retention
+
+    COMPRESSION_ENABLED = config.compression_config.enabled
+    COMPRESSION_MINIMUM_SIZE = config.compression_config.minimum_size
+    COMPRESSION_LEVEL = config.compression_config.level
+    COMPRESSION_CACHED_LEVEL = config.compression_config.cached_level
+
+    LOG_ENABLED = config.logging_config.enabled
+    LOG_PATH = config.logging_config.path
+    LOG_QUEUE_SIZE = config.logging_config.queue_size
+    LOG_BATCH_SIZE = config.logging_config.batch_size
+    LOG_SUCCESS_SAMPLE_RATE = config.logging_config.success_sample_rate
+    LOG_SLOW_REQUEST_SECONDS = config.logging_config.slow_request_seconds
+
+    ARCHIVE_ENABLED = config.archive_config.enabled
+    ARCHIVE_INTERVAL = config.archive_config.interval
+    ARCHIVE_MIN_AGE_HOURS = config.archive_config.min_age_hours
+    ARCHIVE_ABANDON_AFTER_HOURS = config.archive_config.abandon_after_hours
+    ARCHIVE_BATCH_SIZE = config.archive_config.batch_size
+    ARCHIVE_BATCH_PAUSE = config.archive_config.batch_pause
+
+    FOOD_IMPORT_MAX_ITEMS = config.food_import_config.max_items
+    FOOD_IMPORT_CHUNK_SIZE = config.food_import_config.chunk_size
+
+    PROFILING_ENABLED = config.profiling_config.enabled
+    PROFILING_SAMPLE_EVERY = config.profiling_config.sample_every
+    PROFILING_DIRECTORY = config.profiling_config.directory
+    PROFILING_MAX_PROFILES = config.profiling_config.max_profiles
+    PROFILING_SIGNATURE_TTL = config.profiling_config.signature_ttl
+
+    METRICS_PUBLIC = config.metrics_config.public
+    METRICS_DIRECTORY = config.metrics_config.directory
+    METRICS_FLUSH_INTERVAL = config.metrics_config.flush_interval
+
+    DEADLINE_DEFAULT_BUDGET = config.deadline_config.default_budget
+    DEADLINE_ROUTE_BUDGETS = config.deadline_config.route_budgets
+    DEADLINE_MAX_IN_FLIGHT = config.deadline_config.max_in_flight
+    DEADLINE_RETRY_AFTER = config.deadline_config.retry_after
+
+    RATE_LIMIT_ENABLED = config.rate_limit_config.enabled
+    RATE_LIMIT_STORAGE = config.rate_limit_config.storage
+    RATE_LIMIT_BUCKET_RETENTION = config.rate_limit_config.bucket_retention
+    RATE_LIMITS = config.rate_limit_config.limits
+
+    EMAIL_FILTER_ENABLED = config.email_filter_config.enabled
+    EMAIL_FILTER_CAPACITY = config.email_filter_config.capacity
+    EMAIL_FILTER_FALSE_POSITIVE_RATE = config.email_filter_config.false_positive_rate
+    EMAIL_FILTER_REFRESH_INTERVAL = config.email_filter_config.refresh_interval
+    EMAIL_FILTER_SINGLE_PROCESS = config.email_filter_config.single_process
+
+    # Only written on the first run, to keep the generated JWT key. An
+    # existing file is never rewritten; migrate.py fills in new defaults.
+    if not config_exists:
+        write_config(config)
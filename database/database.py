@@ -1,35 +1,127 @@
-from beanie import init_beanie
-from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import Document, init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ReadPreference
+
+from asyncio import gather
+from typing import Any, Type
 
 from config import (
     MONGODB_URI,
     MONGODB_DB,
     MONGODB_TLS,
-    MONGODB_CAFILE
+    MONGODB_CAFILE,
+    MONGODB_COMPRESSORS,
+    MONGODB_MAX_IDLE_TIME_MS,
+    MONGODB_MAX_POOL_SIZE,
+    MONGODB_MAX_TIME_MS,
+    MONGODB_MIN_POOL_SIZE,
+    MONGODB_ROUTE_MAX_TIME_MS,
+    MONGODB_SECONDARY_READS,
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+    FAST_START,
 )
 from schemas.user import User
-from schemas.food import Food
+from schemas.food import ArchivedFood, Food
 from schemas.avatar import Avatar
-from schemas.order import Order
+from schemas.order import ArchivedOrder, Order
 from schemas.food_image import FoodImage
+from schemas.image_blob import ImageBlob
+from schemas.image_job import ImageJob
+from schemas.rate_limit import RateLimitBucket
+from utils.deadline import remaining_ms
+from utils.metrics import CommandMetricsListener, PoolMetricsListener
+
+client_options: dict[str, Any] = {
+    "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+    "minPoolSize": MONGODB_MIN_POOL_SIZE,
+    "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+}
+if MONGODB_MAX_IDLE_TIME_MS is not None:
+    client_options["maxIdleTimeMS"] = MONGODB_MAX_IDLE_TIME_MS
+if MONGODB_WAIT_QUEUE_TIMEOUT_MS is not None:
+    client_options["waitQueueTimeoutMS"] = MONGODB_WAIT_QUEUE_TIMEOUT_MS
+if MONGODB_COMPRESSORS:
+    client_options["compressors"] = MONGODB_COMPRESSORS
 
 client = AsyncIOMotorClient(
     MONGODB_URI,
     tls=MONGODB_TLS,
-    tlsCAFile=MONGODB_CAFILE
+    tlsCAFile=MONGODB_CAFILE,
+    event_listeners=[
+        CommandMetricsListener(),
+        PoolMetricsListener(),
+    ],
+    **client_options
 )
 
 DB = client[MONGODB_DB]
 
+_read_collections: dict[str, AsyncIOMotorCollection] = {}
+
+
+def read_collection(model: Type[Document]) -> AsyncIOMotorCollection:
+    """
+    Collection for read-only endpoints that tolerate replication lag. Reads
+    go to a secondary when secondary_reads is enabled and one is available.
+    """
+    name = model.get_settings().name
+    collection = _read_collections.get(name)
+    if collection is None:
+        collection = model.get_motor_collection()
+        if MONGODB_SECONDARY_READS:
+            collection = collection.with_options(
+                read_preference=ReadPreference.SECONDARY_PREFERRED
+            )
+        _read_collections[name] = collection
+    return collection
+
+
+def query_options(route: str) -> dict[str, Any]:
+    """
+    Extra find() arguments for the queries of an endpoint. The server-side
+    time limit is the configured one or what is left of the request's
+    deadline, whichever is shorter.
+    """
+    max_time_ms = MONGODB_ROUTE_MAX_TIME_MS.get(route, MONGODB_MAX_TIME_MS)
+    remaining = remaining_ms()
+    if remaining is not None and (max_time_ms is None or remaining < max_time_ms):
+        max_time_ms = remaining
+    if max_time_ms is None:
+        return {}
+    return {"max_time_ms": max_time_ms}
+
+
+async def warm_up() -> None:
+    """
+    Open minPoolSize connections before serving, so the first requests
+    after a deploy don't wait for TCP, TLS and authentication. Concurrent
+    pings each check out their own connection.
+    """
+    if MONGODB_MIN_POOL_SIZE <= 0:
+        return
+    await gather(*(
+        DB.command("ping")
+        for _ in range(MONGODB_MIN_POOL_SIZE)
+    ))
+
 
-async def setup():
+async def setup(skip_indexes: bool = FAST_START, allow_index_dropping: bool = False):
     await init_beanie(
         database=DB,
+        skip_indexes=skip_indexes,
+        allow_index_dropping=allow_index_dropping,
         document_models=[
             User,
             Food,
             Avatar,
             Order,
-            FoodImage
+            FoodImage,
+            ImageBlob,
+            ImageJob,
+            RateLimitBucket,
+            ArchivedFood,
+            ArchivedOrder,
         ]
     )
+    await warm_up()
@@ -1,20 +1,101 @@
-# from uvicorn import Config, Server
+"""
+Production entry point. Binds the listening socket once and serves it
+from WORKERS processes, each with its own event loop.
 
-# from asyncio import run
+    python main.py
 
-# from api import app
-# from config import HOST, PORT
+uvicorn picks uvloop and httptools when they are installed. On SIGINT or
+SIGTERM every worker stops accepting connections, finishes the requests
+in flight, uploads included, for up to GRACEFUL_TIMEOUT seconds and runs
+the lifespan shutdown.
+"""
+from uvicorn import Config, Server
 
+from glob import glob
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from os import path, remove, setpgrp
+from signal import SIGINT, SIGTERM, signal
+from socket import socket
+from threading import Event
 
-# async def main():
-#     config = Config(
-#         app=app,
-#         host=HOST,
-#         port=PORT,
-#         proxy_headers=True
-#     )
-#     server = Server(config)
-#     await server.serve()
+import config
+from snowflake.snowflake import MAX_INST
 
-# if __name__ == "__main__":
-#     run(main())
+SUPERVISE_INTERVAL = 0.5
+
+
+def server_config() -> Config:
+    return Config(
+        app="api:app",
+        host=config.HOST,
+        port=config.PORT,
+        proxy_headers=True,
+        loop="auto",
+        http="auto",
+        timeout_graceful_shutdown=config.GRACEFUL_TIMEOUT,
+        # utils.logger writes the access log when it is enabled.
+        access_log=not config.LOG_ENABLED,
+    )
+
+
+def run_worker(index: int, sock: socket) -> None:
+    # A terminal's Ctrl-C goes to the whole process group. Only the parent
+    # should get it, uvicorn treats a second signal as "exit immediately".
+    setpgrp()
+    # Must happen before api is imported, the snowflake generators read
+    # INSTANCE_ID when the schema modules load.
+    config.INSTANCE_ID += index
+    Server(server_config()).run(sockets=[sock])
+
+
+def main() -> None:
+    if config.INSTANCE_ID + config.WORKERS - 1 > MAX_INST:
+        raise SystemExit(
+            f"instance_id + workers - 1 must not exceed {MAX_INST}"
+        )
+
+    if config.WORKERS <= 1:
+        Server(server_config()).run()
+        return
+
+    # Dumps of an earlier run's workers would be merged into /metrics.
+    for dump_path in glob(path.join(config.METRICS_DIRECTORY, "*.json")):
+        remove(dump_path)
+
+    sock = server_config().bind_socket()
+    context = get_context("spawn")
+    stopping = Event()
+
+    def start(index: int) -> BaseProcess:
+        process = context.Process(
+            target=run_worker,
+            args=(index, sock),
+            name=f"worker-{index}",
+        )
+        process.start()
+        return process
+
+    def stop(signum, frame) -> None:
+        stopping.set()
+
+    signal(SIGINT, stop)
+    signal(SIGTERM, stop)
+
+    workers = [start(index) for index in range(config.WORKERS)]
+    while not stopping.wait(SUPERVISE_INTERVAL):
+        for index, process in enumerate(workers):
+            if not process.is_alive():
+                # Same index, so the instance ID stays unique.
+                workers[index] = start(index)
+
+    for process in workers:
+        process.terminate()
+    for process in workers:
+        process.join(config.GRACEFUL_TIMEOUT + 5)
+        if process.is_alive():
+            process.kill()
+    sock.close()
+
+if __name__ == "__main__":
+    main()
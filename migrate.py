@@ -0,0 +1,69 @@
+"""
+One-shot deploy step: create the indexes every model declares and fill
+new defaults into config.json. Run it before starting the servers when
+fast_start is enabled.
+
+    python migrate.py [--drop-stale-indexes]
+
+Orders placed twice by the same user before the unique (foodId, userId)
+index existed are merged first, or building the index would fail. The
+order counts of the foods involved are corrected by the reconciler.
+Foods stored before expiresAt existed get it filled in, the archiver
+only finds foods by it.
+"""
+from asyncio import run
+from sys import argv
+
+from config import config, write_config
+from database.database import DB, setup as setup_db
+from schemas.food import ArchivedFood, Food
+from schemas.order import ArchivedOrder, Order
+from utils.food_snapshot import EXPIRES_AT_EXPRESSION
+
+
+async def dedupe_orders(name: str) -> int:
+    """
+    Keep one order per (foodId, userId), the furthest along, and delete
+    the rest. Returns the number of orders deleted.
+    """
+    collection = DB[name]
+    duplicates = collection.aggregate([
+        {"$sort": {"complete": -1, "received": -1, "_id": 1}},
+        {"$group": {
+            "_id": {"foodId": "$foodId", "userId": "$userId"},
+            "ids": {"$push": "$_id"},
+        }},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ], allowDiskUse=True)
+    deleted = 0
+    async for group in duplicates:
+        result = await collection.delete_many({"_id": {"$in": group["ids"][1:]}})
+        deleted += result.deleted_count
+    return deleted
+
+
+async def fill_expires_at(name: str) -> int:
+    result = await DB[name].update_many(
+        {"expiresAt": None},
+        [{"$set": {"expiresAt": EXPIRES_AT_EXPRESSION}}],
+    )
+    return result.modified_count
+
+
+async def main():
+    write_config(config)
+    for model in (Order, ArchivedOrder):
+        deleted = await dedupe_orders(model.Settings.name)
+        if deleted:
+            print(f"{model.Settings.name}: deleted {deleted} duplicate orders")
+    for model in (Food, ArchivedFood):
+        filled = await fill_expires_at(model.Settings.name)
+        if filled:
+            print(f"{model.Settings.name}: filled in expiresAt on {filled} foods")
+    await setup_db(
+        skip_indexes=False,
+        allow_index_dropping="--drop-stale-indexes" in argv[1:],
+    )
+
+if __name__ == "__main__":
+    run(main())
@@ -0,0 +1,97 @@
+from beanie import Document
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse
+
+from typing import Annotated, Any, Optional, Type
+
+from database.database import query_options
+from schemas.food import ArchivedFood, FOOD_VIEW_PROJECTION, FoodView
+from schemas.order import ArchivedOrder, ORDER_VIEW_PROJECTION, OrderView
+
+from .auth import AdminDepends
+
+FOOD_NOT_FOUND = HTTPException(
+    status_code=status.HTTP_404_NOT_FOUND,
+    detail="Food not found"
+)
+
+router = APIRouter(
+    prefix="/archive",
+    tags=["Archive"],
+    dependencies=[AdminDepends]
+)
+
+LimitQuery = Annotated[int, Query(ge=1, le=500)]
+SkipQuery = Annotated[int, Query(ge=0)]
+
+
+async def find_archived(
+    model: Type[Document],
+    query: dict[str, Any],
+    projection: dict[str, int],
+    route: str,
+    limit: int,
+    skip: int,
+) -> list[dict[str, Any]]:
+    return await model.get_motor_collection().find(
+        query,
+        projection,
+        **query_options(route)
+    ).sort("_id", -1).skip(skip).limit(limit).to_list(None)
+
+
+@router.get(
+    path="/food",
+    response_model=list[FoodView],
+    description="Archived foods, most recently created first.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_archived_foods(
+    authorId: Optional[str] = None,
+    limit: LimitQuery = 50,
+    skip: SkipQuery = 0,
+) -> ORJSONResponse:
+    query = {} if authorId is None else {"authorId": authorId}
+    return ORJSONResponse(await find_archived(
+        ArchivedFood, query, FOOD_VIEW_PROJECTION, "get_archived_foods", limit, skip
+    ))
+
+
+@router.get(
+    path="/food/{food_id}",
+    response_model=FoodView,
+    description="An archived food.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_archived_food(food_id: str) -> ORJSONResponse:
+    food = await ArchivedFood.get_motor_collection().find_one(
+        {"uid": food_id},
+        FOOD_VIEW_PROJECTION,
+        **query_options("get_archived_food")
+    )
+    if food is None:
+        raise FOOD_NOT_FOUND
+
+    return ORJSONResponse(food)
+
+
+@router.get(
+    path="/order",
+    response_model=list[OrderView],
+    description="Archived orders, filtered by food or user, most recently created first.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_archived_orders(
+    foodId: Optional[str] = None,
+    userId: Optional[str] = None,
+    limit: LimitQuery = 50,
+    skip: SkipQuery = 0,
+) -> ORJSONResponse:
+    query = {}
+    if foodId is not None:
+        query["foodId"] = foodId
+    if userId is not None:
+        query["userId"] = userId
+    return ORJSONResponse(await find_archived(
+        ArchivedOrder, query, ORDER_VIEW_PROJECTION, "get_archived_orders", limit, skip
+    ))
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Body, Depends, HTTPException, Security, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jwt import encode, decode
 from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
 
 from typing import Annotated, Optional
 
@@ -10,6 +11,8 @@ from schemas.jwt import JWT, JWTPayload
 from schemas.user import User, UserCreate
 from snowflake import SnowflakeID
 from utils.email_checker import check_is_email
+from utils.email_filter import email_filter
+from utils.logger import log
 
 
 class LoginData(BaseModel):
@@ -95,9 +98,8 @@ def parse_token(optional: bool = False):
                 raise INVALIDE_AUTHENTICATION_CREDENTIALS
 
             return decode_data
-        except:
-            import traceback
-            traceback.print_exc()
+        except Exception as error:
+            log.warning("token_rejected", reason=f"{type(error).__name__}: {error}")
             raise INVALIDE_AUTHENTICATION_CREDENTIALS
     return wrap
 
@@ -178,12 +180,18 @@ async def login(data: LoginData) -> JWT:
     }
 )
 async def register(data: UserCreate) -> JWT:
-    if await User.find_one(User.email == data.email):
+    if email_filter.might_exist(data.email) and await User.find_one(User.email == data.email):
         raise ACCOUNT_ALREADY_EXIST
 
     new_user = User(**data.model_dump())
 
-    await User.insert_one(new_user)
+    try:
+        await User.insert_one(new_user)
+    except DuplicateKeyError:
+        # Registered concurrently, or through a worker whose filter
+        # update this one has not seen yet.
+        raise ACCOUNT_ALREADY_EXIST
+    email_filter.add(new_user.email)
 
     return generate_jwt(new_user)
 
@@ -196,6 +204,8 @@ async def check_exist(email: Annotated[str, Body(embed=True)]) -> None:
     if not check_is_email(email):
         raise INVALIDE_EMAIL_ADDRESS
 
+    if email_filter.is_absent(email):
+        raise ACCOUNT_NOT_FOUND
     if await User.find_one(User.email == email).exists():
         return
     raise ACCOUNT_NOT_FOUND
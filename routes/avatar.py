@@ -1,83 +1,104 @@
-from fastapi import APIRouter, HTTPException, status, UploadFile
+from fastapi import APIRouter, Header, HTTPException, status, UploadFile
 from fastapi.responses import Response
-from PIL import Image, ImageOps
 
-from io import BytesIO
+from functools import cache
+from typing import Annotated, Optional
 
 from schemas.avatar import Avatar
+from schemas.image_job import ImageJobView
+from utils.image import read_image_upload, UnsupportedImage, UploadTooLarge
+from utils.image_store import load, release
+from utils.image_worker import enqueue
 
 from .auth import UIDDepends
+from .job import job_view
 
 FILE_TOO_LARGE = HTTPException(
     status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
     detail="File size exceeds 5MB limit"
 )
-NO_FILE_SIZE = HTTPException(
-    status_code=status.HTTP_411_LENGTH_REQUIRED,
-    detail="File size is required"
-)
 UNSUPPORTED_MEDIA_TYPE = HTTPException(
     status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
     detail="Unsupported media type"
 )
 
+MAX_AVATAR_SIZE = 1024 * 1024 * 5
+
 router = APIRouter(
     prefix="/avatar",
     tags=["Avatar"]
 )
 
-with open("default_avatar.png", "rb") as default_avatar:
-    default_avatar_data = default_avatar.read()
+
+@cache
+def default_avatar_data() -> bytes:
+    with open("default_avatar.png", "rb") as default_avatar:
+        return default_avatar.read()
+
+
+async def avatar_response(
+    avatar: Optional[Avatar],
+    if_none_match: Optional[str]
+) -> Response:
+    if avatar is None:
+        return Response(default_avatar_data(), media_type="image/png")
+    if avatar.blob is None:
+        return Response(avatar.data, media_type=avatar.content_type)
+
+    etag = f"\"{avatar.blob}\""
+    if if_none_match == etag:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag}
+        )
+
+    data = await load(avatar.blob)
+    if data is None:
+        return Response(default_avatar_data(), media_type="image/png")
+    return Response(
+        data,
+        media_type=avatar.content_type,
+        headers={"ETag": etag}
+    )
 
 
 @router.get(
     path="",
     status_code=status.HTTP_200_OK,
 )
-async def get_avatar(uid: UIDDepends) -> Response:
+async def get_avatar(
+    uid: UIDDepends,
+    if_none_match: Annotated[Optional[str], Header()] = None
+) -> Response:
     avatar = await Avatar.find_one(Avatar.uid == uid)
-    if avatar is None:
-        return Response(default_avatar_data, media_type="image/png")
-
-    return Response(avatar.data, media_type=avatar.content_type)
+    return await avatar_response(avatar, if_none_match)
 
 
 @router.post(
     path="",
-    status_code=status.HTTP_201_CREATED,
+    response_model=ImageJobView,
+    description="Queue a new avatar, poll statusUrl until it is done.",
+    status_code=status.HTTP_202_ACCEPTED,
 )
-async def update_avatar(uid: UIDDepends, file: UploadFile) -> None:
-    size = file.size
-    if size is None:
-        raise NO_FILE_SIZE
-    if size > 1024 * 1024 * 5:
-        raise FILE_TOO_LARGE
-
-    data = await file.read()
+async def update_avatar(
+    uid: UIDDepends,
+    file: UploadFile,
+    response: Response
+) -> ImageJobView:
     try:
-        output_bytes = BytesIO()
-        with Image.open(BytesIO(data)) as img:
-            img.verify()
-            content_type = file.content_type or (img.format or "").lower()
-
-        with Image.open(BytesIO(data)) as img:
-            img_sdr = ImageOps.autocontrast(img)
-            img_sdr.save(output_bytes, format=img.format)
-        data = output_bytes.getvalue()
-    except:
-        raise UNSUPPORTED_MEDIA_TYPE
-    
-    avatar = await Avatar.find_one(Avatar.uid == uid)
-    if avatar is None:
-        avatar = Avatar(
-            uid=uid,
-            data=data,
-            content_type=content_type,
+        buffer, image_format, raw_digest = await read_image_upload(
+            file,
+            MAX_AVATAR_SIZE
         )
-    else:
-        avatar.data = data
-        avatar.content_type = content_type
-    await avatar.save()
+    except UploadTooLarge:
+        raise FILE_TOO_LARGE
+    except UnsupportedImage:
+        raise UNSUPPORTED_MEDIA_TYPE
+
+    job = await enqueue("avatar", uid, buffer, image_format, raw_digest)
+    view = job_view(job)
+    response.headers["Location"] = view.statusUrl
+    return view
 
 
 @router.delete(
@@ -85,16 +106,21 @@ async def update_avatar(uid: UIDDepends, file: UploadFile) -> None:
     status_code=status.HTTP_204_NO_CONTENT,
 )
 async def delete_avatar(uid: UIDDepends) -> None:
-    await Avatar.find_one(Avatar.uid == uid).delete()
+    previous = await Avatar.get_motor_collection().find_one_and_delete(
+        {"uid": str(uid)},
+        projection={"_id": 0, "blob": 1},
+    )
+    if previous is not None:
+        await release(previous.get("blob"))
 
 
 @router.get(
     path="/{uid}",
     status_code=status.HTTP_200_OK,
 )
-async def get_avatar_by_uid(uid: str,) -> Response:
+async def get_avatar_by_uid(
+    uid: str,
+    if_none_match: Annotated[Optional[str], Header()] = None
+) -> Response:
     avatar = await Avatar.find_one(Avatar.uid == uid)
-    if avatar is None:
-        return Response(default_avatar_data, media_type="image/png")
-
-    return Response(avatar.data, media_type=avatar.content_type)
+    return await avatar_response(avatar, if_none_match)
@@ -1,19 +1,64 @@
-from fastapi import APIRouter, HTTPException, Response, status, UploadFile
-from PIL import Image, ImageOps
+from fastapi import (
+    APIRouter,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+    UploadFile,
+)
+from fastapi.responses import ORJSONResponse
+from numpy import array, float64
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
-from io import BytesIO
+from time import time
+from typing import Annotated, Literal, Optional
 
-from schemas.food import Food, FoodCreate, FoodView
+from config import COMPRESSION_ENABLED, COMPRESSION_MINIMUM_SIZE
+from database.database import query_options, read_collection
+from schemas.food import (
+    Food,
+    FoodCluster,
+    FoodCreate,
+    FoodImportSummary,
+    FoodOrderCounts,
+    FoodView,
+    FOOD_VIEW_PROJECTION,
+)
 from schemas.food_image import FoodImage
-from schemas.order import Order, OrderView
+from schemas.image_job import ImageJobView
+from schemas.order import Order, ORDER_VIEW_PROJECTION, OrderView
 from snowflake import SnowflakeID
+from utils.compression import accepts_gzip
+from utils.food_counters import food_counters
+from utils.food_import import ImportAborted, import_foods, ImportTooLarge
+from utils.food_ranker import food_ranker, order_preference
+from utils.food_snapshot import active_food_query, food_expires_at, food_snapshot
+from utils.geo_index import cluster_points, geo_index, geohash_cells, MAX_ZOOM
+from utils.image import read_image_upload, UnsupportedImage, UploadTooLarge
+from utils.image_store import load
+from utils.image_worker import enqueue
+from utils.order_counts import adjust_order_counts
+
+from .auth import AdminDepends, UIDDepends
+from .job import job_view
 
-from .auth import UIDDepends
+ORDER_ATTEMPTS = 3
 
 FOOD_NOT_FOUND = HTTPException(
     status_code=status.HTTP_404_NOT_FOUND,
     detail="Food not found"
 )
+FOOD_EXPIRED = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="Food has expired"
+)
+ORDER_CONFLICT = HTTPException(
+    status_code=status.HTTP_409_CONFLICT,
+    detail="The order could not be placed, try again"
+)
 FOOD_FULL = HTTPException(
     status_code=status.HTTP_400_BAD_REQUEST,
     detail="Food is full"
@@ -34,15 +79,13 @@ FILE_TOO_LARGE = HTTPException(
     status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
     detail="File size exceeds 10MB limit"
 )
-NO_FILE_SIZE = HTTPException(
-    status_code=status.HTTP_411_LENGTH_REQUIRED,
-    detail="File size is required"
-)
 UNSUPPORTED_MEDIA_TYPE = HTTPException(
     status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
     detail="Unsupported media type"
 )
 
+MAX_PHOTO_SIZE = 1024 * 1024 * 10
+
 router = APIRouter(
     prefix="/food",
     tags=["Food"]
@@ -54,10 +97,72 @@ router = APIRouter(
     response_model=list[FoodView],
     status_code=status.HTTP_200_OK
 )
-async def get_food_list() -> list[FoodView]:
-    return await Food.find(
-        projection_model=FoodView,
-    ).to_list()
+async def get_food_list(
+    sort: Annotated[Optional[Literal["popular"]], Query(
+        description="popular: most viewed and ordered first, decaying over time."
+    )] = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+    accept_encoding: Annotated[Optional[str], Header()] = None
+) -> Response:
+    if sort == "popular":
+        return await popular_food_list()
+
+    body = food_snapshot.list_body()
+    if body is None:
+        docs = await read_collection(Food).find(
+            active_food_query(),
+            FOOD_VIEW_PROJECTION,
+            **query_options("get_food_list")
+        ).to_list(None)
+        return ORJSONResponse(docs)
+
+    etag = food_snapshot.etag
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if (
+        COMPRESSION_ENABLED
+        and len(body) >= COMPRESSION_MINIMUM_SIZE
+        and accepts_gzip(accept_encoding)
+    ):
+        # Other bytes, so another strong validator.
+        etag = headers["ETag"] = etag[:-1] + "-gzip\""
+        body = food_snapshot.list_body_gzip()
+        headers["Content-Encoding"] = "gzip"
+
+    if if_none_match == etag:
+        headers.pop("Content-Encoding", None)
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers=headers
+        )
+    return Response(
+        body,
+        media_type="application/json",
+        headers=headers
+    )
+
+
+async def popular_food_list() -> Response:
+    now = time()
+    if food_snapshot.is_warm():
+        entries = sorted(
+            food_snapshot.entries(),
+            key=lambda entry: food_counters.popularity(entry.doc, now),
+            reverse=True,
+        )
+        return Response(
+            b"[" + b",".join(entry.body for entry in entries) + b"]",
+            media_type="application/json"
+        )
+
+    docs = await read_collection(Food).find(
+        active_food_query(),
+        {**FOOD_VIEW_PROJECTION, "popularity": 1},
+        **query_options("get_food_list")
+    ).to_list(None)
+    docs.sort(key=lambda doc: food_counters.popularity(doc, now), reverse=True)
+    for doc in docs:
+        doc.pop("popularity", None)
+    return ORJSONResponse(docs)
 
 
 @router.post(
@@ -68,9 +173,133 @@ async def get_food_list() -> list[FoodView]:
 async def create_food(data: FoodCreate, uid: UIDDepends) -> FoodView:
     food = Food(**data.model_dump(), authorId=uid)
     food = await food.save()
+    food_snapshot.notify_upsert(food.model_dump())
     return FoodView(**food.model_dump())
 
 
+@router.post(
+    path="/import",
+    response_model=FoodImportSummary,
+    description=(
+        "Create foods in bulk from a JSON array or NDJSON of FoodCreate. "
+        "Items are validated and inserted as the body arrives, and each "
+        "gets its own result."
+    ),
+    status_code=status.HTTP_200_OK,
+    dependencies=[AdminDepends],
+)
+async def import_food(request: Request, uid: UIDDepends) -> ORJSONResponse:
+    try:
+        return ORJSONResponse(await import_foods(request.stream(), uid))
+    except ImportAborted as error:
+        # Items before the one that stopped the import were imported.
+        raise HTTPException(
+            status_code=(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                if isinstance(error, ImportTooLarge)
+                else status.HTTP_400_BAD_REQUEST
+            ),
+            detail={
+                "message": str(error),
+                "lastIndex": len(error.summary["results"]) - 1,
+                **error.summary,
+            },
+        )
+
+
+@router.get(
+    path="/clusters",
+    response_model=list[FoodCluster],
+    description="Aggregate active foods inside a bounding box for the map zoom level.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_food_clusters(
+    south: Annotated[float, Query(ge=-90, le=90)],
+    west: Annotated[float, Query(ge=-180, le=180)],
+    north: Annotated[float, Query(ge=-90, le=90)],
+    east: Annotated[float, Query(ge=-180, le=180)],
+    zoom: Annotated[int, Query(ge=0, le=MAX_ZOOM)],
+) -> list[FoodCluster]:
+    if food_snapshot.is_warm():
+        return geo_index.clusters(south, west, north, east, zoom)
+
+    query = {
+        "latitude": {"$gte": south, "$lte": north},
+        **active_food_query(),
+    }
+    if west <= east:
+        query["longitude"] = {"$gte": west, "$lte": east}
+    else:
+        query["$or"] = [
+            {"longitude": {"$gte": west}},
+            {"longitude": {"$lte": east}},
+        ]
+
+    uids: list[str] = []
+    latitudes: list[float] = []
+    longitudes: list[float] = []
+    async for doc in read_collection(Food).find(
+        query,
+        {"_id": 0, "uid": 1, "latitude": 1, "longitude": 1},
+        **query_options("get_food_clusters")
+    ):
+        uids.append(doc["uid"])
+        latitudes.append(doc["latitude"])
+        longitudes.append(doc["longitude"])
+
+    latitude = array(latitudes, dtype=float64)
+    longitude = array(longitudes, dtype=float64)
+    counts, lats, lons, samples = cluster_points(
+        latitude,
+        longitude,
+        geohash_cells(latitude, longitude),
+        zoom,
+    )
+    return [
+        FoodCluster(
+            count=int(count),
+            latitude=float(lat),
+            longitude=float(lon),
+            sampleUid=uids[sample],
+        )
+        for count, lat, lon, sample in zip(counts, lats, lons, samples)
+    ]
+
+
+@router.get(
+    path="/feed",
+    response_model=list[FoodView],
+    description="Active foods ranked for the caller by distance, expiry, taste and load.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_food_feed(
+    user_id: UIDDepends,
+    latitude: Annotated[float, Query(ge=-90, le=90)],
+    longitude: Annotated[float, Query(ge=-180, le=180)],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> Response:
+    preference = await order_preference(user_id)
+    origin = (latitude, longitude)
+
+    if food_snapshot.is_warm():
+        bodies = []
+        for uid in food_ranker.rank(origin, preference, limit):
+            entry = food_snapshot.get(uid)
+            if entry is not None:
+                bodies.append(entry.body)
+        return Response(
+            b"[" + b",".join(bodies) + b"]",
+            media_type="application/json"
+        )
+
+    docs = await read_collection(Food).find(
+        active_food_query(),
+        FOOD_VIEW_PROJECTION,
+        **query_options("get_food_feed")
+    ).to_list(None)
+    return ORJSONResponse(food_ranker.rank_documents(docs, origin, preference, limit))
+
+
 @router.get(
     path="/{food_id}",
     response_model=FoodView,
@@ -78,57 +307,59 @@ async def create_food(data: FoodCreate, uid: UIDDepends) -> FoodView:
 )
 async def get_food(
     food_id: str
-) -> FoodView:
-    food = await Food.find_one(Food.uid == food_id, fetch_links=True)
+) -> Response:
+    # Active foods are already encoded in the snapshot.
+    entry = food_snapshot.get(food_id) if food_snapshot.is_warm() else None
+    if entry is not None:
+        food_counters.record(food_id, "detailViews", entry.doc["createdAt"])
+        return Response(entry.body, media_type="application/json")
+
+    food = await Food.get_motor_collection().find_one(
+        {"uid": food_id},
+        FOOD_VIEW_PROJECTION,
+        **query_options("get_food")
+    )
     if food is None:
         raise FOOD_NOT_FOUND
 
-    return FoodView(**food.model_dump())
+    food_counters.record(food_id, "detailViews", food["createdAt"])
+    return ORJSONResponse(food)
 
 
 @router.post(
     path="/{food_id}/photos",
-    status_code=status.HTTP_200_OK,
+    response_model=list[ImageJobView],
+    description="Queue photos of the food, poll each statusUrl until it is done.",
+    status_code=status.HTTP_202_ACCEPTED,
 )
 async def upload_food_photos(
     food_id: str,
     file: list[UploadFile]
-) -> None:
-    food = await Food.find_one(Food.uid == food_id, fetch_links=True)
-    if food is None:
+) -> list[ImageJobView]:
+    if not await Food.find_one(Food.uid == food_id).exists():
         raise FOOD_NOT_FOUND
 
+    jobs = []
     for f in file:
-        size = f.size
-        if size is None:
-            raise NO_FILE_SIZE
-        if size > 1024 * 1024 * 10:
-            raise FILE_TOO_LARGE
-
-        data = await f.read()
         try:
-            output_bytes = BytesIO()
-            with Image.open(BytesIO(data)) as img:
-                img.verify()
-                content_type = f.content_type or (img.format or "").lower()
-
-            with Image.open(BytesIO(data)) as img:
-                img_sdr = ImageOps.autocontrast(img)
-                img_sdr.save(output_bytes, format=img.format)
-            data = output_bytes.getvalue()
-        except:
+            buffer, image_format, raw_digest = await read_image_upload(
+                f,
+                MAX_PHOTO_SIZE
+            )
+        except UploadTooLarge:
+            raise FILE_TOO_LARGE
+        except UnsupportedImage:
             continue
 
-        image = FoodImage(
-            food_id=SnowflakeID(food_id),
-            index=food.imageCount,
-            data=data,
-            content_type=content_type,
+        job = await enqueue(
+            "photo",
+            SnowflakeID(food_id),
+            buffer,
+            image_format,
+            raw_digest
         )
-        food.imageCount += 1
-
-        await image.save()
-    await food.save()
+        jobs.append(job_view(job))
+    return jobs
 
 
 @router.get(
@@ -138,12 +369,37 @@ async def upload_food_photos(
 async def get_food_photos(
     food_id: str,
     index: int,
+    if_none_match: Annotated[Optional[str], Header()] = None
 ) -> Response:
     avatar = await FoodImage.find_one(FoodImage.food_id == food_id, FoodImage.index == index)
     if avatar is None:
         raise FOOD_NOT_FOUND
 
-    return Response(avatar.data, media_type=avatar.content_type)
+    # Expired foods are not in the snapshot and don't gain popularity.
+    entry = food_snapshot.get(food_id)
+    food_counters.record(
+        food_id,
+        "photoViews",
+        entry.doc["createdAt"] if entry is not None else None
+    )
+    if avatar.blob is None:
+        return Response(avatar.data, media_type=avatar.content_type)
+
+    etag = f"\"{avatar.blob}\""
+    if if_none_match == etag:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag}
+        )
+
+    data = await load(avatar.blob)
+    if data is None:
+        raise FOOD_NOT_FOUND
+    return Response(
+        data,
+        media_type=avatar.content_type,
+        headers={"ETag": etag}
+    )
 
 
 @router.get(
@@ -158,21 +414,65 @@ async def order_food(
     food = await Food.find_one(Food.uid == food_id, fetch_links=True)
     if food is None:
         raise FOOD_NOT_FOUND
+    # Expired foods are on their way to the archive, see utils.archiver.
+    if food_expires_at(food.model_dump()) <= time():
+        raise FOOD_EXPIRED
+
+    # Upserting on (food, user) makes the existence check and the insert
+    # one operation. Concurrent upserts can both miss and both insert, the
+    # unique (foodId, userId) index fails all but one, so an order is only
+    # counted once.
+    collection = Order.get_motor_collection()
+    query = {"foodId": food_id, "userId": str(user_id)}
+    for _ in range(ORDER_ATTEMPTS):
+        # A fresh uid each attempt, the duplicate key may be a uid clash.
+        order = Order(
+            foodId=SnowflakeID(food_id),
+            userId=user_id,
+        )
+        try:
+            existing = await collection.find_one_and_update(
+                query,
+                {"$setOnInsert": order.model_dump(mode="json", exclude={"id", "revision_id"})},
+                projection=ORDER_VIEW_PROJECTION,
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+            break
+        except DuplicateKeyError:
+            existing = await collection.find_one(query, ORDER_VIEW_PROJECTION)
+            # Unless the winning order was cancelled since, then try again.
+            if existing is not None:
+                break
+    else:
+        raise ORDER_CONFLICT
+    if existing is not None:
+        return OrderView.model_validate(existing)
 
-    order = await Order.find_one(
-        Order.foodId == food_id,
-        Order.userId == user_id,
-    ).project(OrderView)
+    food_ranker.adjust_load(food_id, 1)
+    food_counters.record(food_id, "orders", food.createdAt)
+    await adjust_order_counts(food_id, orderCount=1)
+    return OrderView(**order.model_dump())
 
-    if order:
-        return order
 
-    order = Order(
-        foodId=SnowflakeID(food_id),
-        userId=user_id,
+@router.get(
+    path="/{food_id}/counts",
+    response_model=FoodOrderCounts,
+    description="Order counts of the food, kept up to date by every order change.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_food_counts(
+    food_id: str
+) -> FoodOrderCounts:
+    counts = await read_collection(Food).find_one(
+        {"uid": food_id},
+        {"_id": 0, "orderCount": 1, "receivedCount": 1, "completeCount": 1},
+        **query_options("get_food_counts")
     )
-    await order.save()
-    return OrderView(**order.model_dump())
+    if counts is None:
+        raise FOOD_NOT_FOUND
+
+    return FoodOrderCounts.model_validate(counts)
 
 
 @router.get(
@@ -182,12 +482,19 @@ async def order_food(
 )
 async def get_food_status(
     food_id: str
-) -> list[OrderView]:
-    food = await Food.find_one(Food.uid == food_id)
-    if food is None:
+) -> ORJSONResponse:
+    options = query_options("get_food_status")
+    orders = await Order.get_motor_collection().find(
+        {"foodId": food_id},
+        ORDER_VIEW_PROJECTION,
+        **options
+    ).to_list(None)
+    # A food with orders exists, only an empty result needs the check.
+    if not orders and await Food.get_motor_collection().find_one(
+        {"uid": food_id},
+        {"_id": 1},
+        **options
+    ) is None:
         raise FOOD_NOT_FOUND
 
-    return await Order.find(
-        Order.foodId == food_id,
-        projection_model=OrderView
-    ).to_list()
+    return ORJSONResponse(orders)
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, status
+
+from schemas.image_job import ImageJob, ImageJobView
+
+JOB_NOT_FOUND = HTTPException(
+    status_code=status.HTTP_404_NOT_FOUND,
+    detail="Job not found"
+)
+
+router = APIRouter(
+    prefix="/job",
+    tags=["Job"]
+)
+
+
+def job_view(job: ImageJob) -> ImageJobView:
+    return ImageJobView(
+        **job.model_dump(include={"uid", "kind", "status", "attempts", "error"}),
+        statusUrl=f"{router.prefix}/{job.uid}",
+    )
+
+
+@router.get(
+    path="/{job_id}",
+    response_model=ImageJobView,
+    description="Status of a deferred image processing job.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_job(job_id: str) -> ImageJobView:
+    job = await ImageJob.find_one(ImageJob.uid == job_id)
+    if job is None:
+        raise JOB_NOT_FOUND
+
+    return job_view(job)
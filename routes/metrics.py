@@ -0,0 +1,26 @@
+from fastapi import APIRouter, status
+from fastapi.responses import PlainTextResponse
+
+from config import METRICS_PUBLIC
+from utils.metrics import metrics_exporter, registry
+
+from .auth import AdminDepends
+
+router = APIRouter(
+    tags=["Metrics"],
+    dependencies=[] if METRICS_PUBLIC else [AdminDepends]
+)
+
+
+@router.get(
+    path="/metrics",
+    response_class=PlainTextResponse,
+    description="Metrics in the Prometheus text exposition format.",
+    status_code=status.HTTP_200_OK,
+    include_in_schema=False,
+)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        registry.render(metrics_exporter.collect()),
+        media_type="text/plain; version=0.0.4"
+    )
@@ -1,6 +1,7 @@
-from beanie.operators import Set
 from fastapi import APIRouter, Body, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from jwt import encode, decode
+from pymongo import ReturnDocument
 
 from datetime import datetime, timedelta
 from typing import Annotated
@@ -11,8 +12,12 @@ except ImportError:
     UTC = timezone.utc
 
 from config import JWT_KEY
-from schemas.order import Order, OrderUpdate, OrderView
+from database.database import query_options
+from schemas.order import Order, ORDER_VIEW_PROJECTION, OrderUpdate, OrderView
 from schemas.user import UserView
+from utils.food_ranker import food_ranker
+from utils.logger import log
+from utils.order_counts import adjust_order_counts
 
 from .auth import UIDDepends
 
@@ -24,6 +29,18 @@ INVALID_CODE = HTTPException(
     status_code=status.HTTP_400_BAD_REQUEST,
     detail="Invalid code"
 )
+ORDER_ALREADY_COMPLETE = HTTPException(
+    status_code=status.HTTP_409_CONFLICT,
+    detail="Order already complete"
+)
+ORDER_NOT_RECEIVED = HTTPException(
+    status_code=status.HTTP_409_CONFLICT,
+    detail="Order not received yet"
+)
+COMPLETE_WITHOUT_RECEIVED = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="An order can't be complete and not received"
+)
 
 router = APIRouter(
     prefix="/order",
@@ -36,11 +53,13 @@ router = APIRouter(
     response_model=list[OrderView],
     status_code=status.HTTP_200_OK,
 )
-async def get_my_orders(user_id: UIDDepends) -> list[OrderView]:
-    return await Order.find(
-        Order.userId == user_id,
-        projection_model=OrderView
-    ).to_list()
+async def get_my_orders(user_id: UIDDepends) -> ORJSONResponse:
+    orders = await Order.get_motor_collection().find(
+        {"userId": str(user_id)},
+        ORDER_VIEW_PROJECTION,
+        **query_options("get_my_orders")
+    ).to_list(None)
+    return ORJSONResponse(orders)
 
 
 @router.delete(
@@ -51,8 +70,23 @@ async def cancel_order(
     order_id: str,
     user_id: UIDDepends
 ) -> None:
-    print(f"Cancel order {order_id} for user {user_id}")
-    await Order.find_one(Order.uid == order_id, Order.userId == user_id).delete()
+    collection = Order.get_motor_collection()
+    order = await collection.find_one_and_delete(
+        {"uid": order_id, "userId": str(user_id), "complete": False},
+        projection={"_id": 0, "foodId": 1, "received": 1},
+    )
+    if order is None:
+        if await collection.find_one({"uid": order_id, "userId": str(user_id)}, {"_id": 1}):
+            raise ORDER_ALREADY_COMPLETE
+        return
+
+    log.info("order_cancelled", order_id=order_id, user_id=str(user_id))
+    food_ranker.adjust_load(order["foodId"], -1)
+    await adjust_order_counts(
+        order["foodId"],
+        orderCount=-1,
+        receivedCount=-1 if order["received"] else 0,
+    )
 
 
 @router.put(
@@ -65,10 +99,44 @@ async def finish_order(
     user_id: UIDDepends,
     data: OrderUpdate
 ) -> OrderView:
-    order = await Order.find_one(Order.uid == order_id, Order.userId == user_id)
-    if order is None:
+    changes = data.model_dump(exclude_none=True)
+    query = {"uid": order_id, "userId": str(user_id)}
+    collection = Order.get_motor_collection()
+    if not changes:
+        order = await collection.find_one(query, ORDER_VIEW_PROJECTION)
+        if order is None:
+            raise ORDER_NOT_FOUND
+        return OrderView.model_validate(order)
+
+    # An order is only complete once received, so completing needs it
+    # received already or in the same update, and un-receiving needs it
+    # not complete. Doing both at once can't hold whatever the order is.
+    if changes.get("complete") and changes.get("received") is False:
+        raise COMPLETE_WITHOUT_RECEIVED
+    guards = {}
+    if changes.get("complete") and not changes.get("received"):
+        guards["received"] = True
+    if changes.get("received") is False and changes.get("complete") is not False:
+        guards["complete"] = False
+
+    before = await collection.find_one_and_update(
+        {**query, **guards},
+        {"$set": changes},
+        projection=ORDER_VIEW_PROJECTION,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        if guards and await collection.find_one(query, {"_id": 1}):
+            raise ORDER_NOT_RECEIVED if "received" in guards else ORDER_ALREADY_COMPLETE
         raise ORDER_NOT_FOUND
 
-    order = await order.update(Set(data.model_dump(exclude_none=True)))
+    order = {**before, **changes}
+    if order["complete"] != before["complete"]:
+        food_ranker.adjust_load(order["foodId"], -1 if order["complete"] else 1)
+    await adjust_order_counts(
+        order["foodId"],
+        receivedCount=order["received"] - before["received"],
+        completeCount=order["complete"] - before["complete"],
+    )
 
-    return OrderView(**order.model_dump())
+    return OrderView.model_validate(order)
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from schemas.profile import ProfileSummary
+from utils.profiler import profile_store
+
+from .auth import AdminDepends
+
+PROFILE_NOT_FOUND = HTTPException(
+    status_code=status.HTTP_404_NOT_FOUND,
+    detail="Profile not found"
+)
+
+router = APIRouter(
+    prefix="/profile",
+    tags=["Profile"],
+    dependencies=[AdminDepends]
+)
+
+
+@router.get(
+    path="",
+    response_model=list[ProfileSummary],
+    description="Recorded request profiles, newest first.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_profiles() -> list[ProfileSummary]:
+    return [
+        ProfileSummary(uid=uid, summary=summary)
+        for uid, summary in await run_in_threadpool(profile_store.summaries)
+    ]
+
+
+@router.get(
+    path="/{profile_id}",
+    response_class=PlainTextResponse,
+    description="Text report of a recorded request profile.",
+    status_code=status.HTTP_200_OK,
+)
+async def get_profile(profile_id: str) -> PlainTextResponse:
+    report = await run_in_threadpool(profile_store.load, profile_id)
+    if report is None:
+        raise PROFILE_NOT_FOUND
+
+    return PlainTextResponse(report)
@@ -1,9 +1,28 @@
-from beanie.operators import Set
 from fastapi import APIRouter, status, HTTPException
+from fastapi.responses import ORJSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
-from schemas.user import User, UserUpdate, UserView
+from database.database import query_options, read_collection
+from schemas.user import (
+    check_password,
+    User,
+    USER_VIEW_PROJECTION,
+    UserUpdate,
+    UserView,
+)
+from utils.email_filter import email_filter
 
-from .auth import UserDepends
+from .auth import (
+    ACCOUNT_ALREADY_EXIST,
+    INVALIDE_AUTHENTICATION_CREDENTIALS,
+    UIDDepends,
+)
+
+USER_NOT_FOUND = HTTPException(
+    status_code=status.HTTP_404_NOT_FOUND,
+    detail="User not found"
+)
 
 router = APIRouter(
     prefix="/user",
@@ -16,8 +35,16 @@ router = APIRouter(
     response_model=UserView,
     status_code=status.HTTP_200_OK
 )
-async def get_self_data(user: UserDepends) -> UserView:
-    return UserView(**user.model_dump())
+async def get_self_data(uid: UIDDepends) -> ORJSONResponse:
+    user = await User.get_motor_collection().find_one(
+        {"uid": str(uid)},
+        USER_VIEW_PROJECTION,
+        **query_options("get_self_data")
+    )
+    if user is None:
+        raise INVALIDE_AUTHENTICATION_CREDENTIALS
+
+    return ORJSONResponse(user)
 
 
 @router.put(
@@ -25,16 +52,41 @@ async def get_self_data(user: UserDepends) -> UserView:
     response_model=UserView,
     status_code=status.HTTP_201_CREATED
 )
-async def update_self_data(user: UserDepends, data: UserUpdate) -> UserView:
-    excludes = ["original_password"]
+async def update_self_data(uid: UIDDepends, data: UserUpdate) -> UserView:
+    collection = User.get_motor_collection()
+    query = {"uid": str(uid)}
+
+    excludes = {"originalPassword"}
     if data.originalPassword is None or data.password is None:
-        excludes.append("password")
-    elif not user.check_password(data.originalPassword):
-        excludes.append("password")
+        excludes.add("password")
+    else:
+        # The hash is only needed to verify a password change.
+        stored = await collection.find_one(query, {"_id": 0, "password": 1})
+        if stored is None:
+            raise INVALIDE_AUTHENTICATION_CREDENTIALS
+        if not check_password(data.originalPassword, stored["password"]):
+            excludes.add("password")
+
+    changes = data.model_dump(exclude_none=True, exclude=excludes)
+    if not changes:
+        user = await collection.find_one(query, USER_VIEW_PROJECTION)
+    else:
+        try:
+            user = await collection.find_one_and_update(
+                query,
+                {"$set": changes},
+                projection=USER_VIEW_PROJECTION,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            raise ACCOUNT_ALREADY_EXIST
+    if user is None:
+        raise INVALIDE_AUTHENTICATION_CREDENTIALS
 
-    user = await user.update(Set(data.model_dump(exclude_none=True, exclude=set(excludes))))
+    if data.email is not None:
+        email_filter.add(data.email)
 
-    return UserView(**user.model_dump())
+    return UserView.model_validate(user)
 
 
 @router.get(
@@ -42,10 +94,13 @@ async def update_self_data(user: UserDepends, data: UserUpdate) -> UserView:
     response_model=UserView,
     status_code=status.HTTP_200_OK,
 )
-async def get_user_data(user_id: str) -> UserView:
-    user = await User.find_one(User.uid == user_id, projection_model=UserView)
+async def get_user_data(user_id: str) -> ORJSONResponse:
+    user = await read_collection(User).find_one(
+        {"uid": user_id},
+        USER_VIEW_PROJECTION,
+        **query_options("get_user_data")
+    )
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        raise USER_NOT_FOUND
 
-    return user
+    return ORJSONResponse(user)
@@ -1,6 +1,6 @@
 from beanie import Document, Indexed
 
-from typing import Annotated
+from typing import Annotated, Optional
 
 from snowflake import SnowflakeID
 
@@ -8,7 +8,8 @@ from snowflake import SnowflakeID
 class Avatar(Document):
     uid: Annotated[SnowflakeID, Indexed(unique=True)]
     content_type: str
-    data: bytes
+    blob: Optional[str] = None
+    data: Optional[bytes] = None
 
     class Settings:
         name = "Avatars"
@@ -1,16 +1,20 @@
 from beanie import Document, Indexed
+from pymongo import ASCENDING, IndexModel
 from pydantic import (
     BaseModel,
     Field,
+    model_validator,
 )
 
-from typing import Annotated
+from typing import Annotated, Optional
 
 from config import INSTANCE_ID
 from snowflake import SnowflakeGenerator, SnowflakeID
 
 uid_generator = SnowflakeGenerator(INSTANCE_ID)
 
+SECONDS_PER_HOUR = 3600
+
 
 class Food(Document):
     uid: Annotated[SnowflakeID, Indexed(unique=True)] = Field(
@@ -83,6 +87,54 @@ class Food(Document):
         description="Timestamp of when the food was created.",
         examples=[1633036800]
     )
+    expiresAt: Optional[float] = Field(
+        title="Expires At",
+        description="Timestamp of when the food expires, createdAt plus the validity period.",
+        default=None,
+        examples=[1633042200]
+    )
+    detailViews: int = Field(
+        title="Detail Views",
+        description="Number of times the food's details were viewed.",
+        default=0,
+        examples=[42]
+    )
+    photoViews: int = Field(
+        title="Photo Views",
+        description="Number of times the food's photos were viewed.",
+        default=0,
+        examples=[42]
+    )
+    orderCount: int = Field(
+        title="Order Count",
+        description="Number of orders on the food that were not cancelled.",
+        default=0,
+        examples=[3]
+    )
+    receivedCount: int = Field(
+        title="Received Count",
+        description="Number of orders on the food that were received.",
+        default=0,
+        examples=[2]
+    )
+    completeCount: int = Field(
+        title="Complete Count",
+        description="Number of orders on the food that were completed.",
+        default=0,
+        examples=[1]
+    )
+    popularity: float = Field(
+        title="Popularity",
+        description="Weighted events, each scaled by 2^(age of the food at the event / half-life).",
+        default=0.0,
+        examples=[12.5]
+    )
+
+    @model_validator(mode="after")
+    def fill_expires_at(self) -> "Food":
+        if self.expiresAt is None:
+            self.expiresAt = self.createdAt + self.validityPeriod * SECONDS_PER_HOUR
+        return self
 
     def __eq__(self, value: object) -> bool:
         if not isinstance(value, self.__class__):
@@ -95,6 +147,16 @@ class Food(Document):
             SnowflakeID: str
         }
         max_nesting_depth = 1
+        indexes = [
+            # The archiver pages expired foods in this order.
+            IndexModel([("expiresAt", ASCENDING), ("_id", ASCENDING)]),
+        ]
+
+
+class ArchivedFood(Food):
+    """Long expired foods, moved here by utils.archiver."""
+    class Settings(Food.Settings):
+        name = "FoodsArchive"
 
 
 class FoodCreate(BaseModel):
@@ -141,3 +203,72 @@ class FoodView(BaseModel):
     validityPeriod: float
     imageCount: int
     createdAt: int
+
+
+FOOD_VIEW_PROJECTION = {"_id": 0, **dict.fromkeys(FoodView.model_fields, 1)}
+
+
+class FoodOrderCounts(BaseModel):
+    orderCount: int = 0
+    receivedCount: int = 0
+    completeCount: int = 0
+
+
+class FoodImportResult(BaseModel):
+    index: int = Field(
+        title="Index",
+        description="Position of the item in the import, from 0.",
+        examples=[0]
+    )
+    uid: Optional[SnowflakeID] = Field(
+        title="UID",
+        description="UID of the created food, if the item was imported.",
+        default=None,
+        examples=["6209533852516352"]
+    )
+    error: Optional[str] = Field(
+        title="Error",
+        description="Why the item was not imported.",
+        default=None,
+        examples=["latitude: Field required"]
+    )
+
+
+class FoodImportSummary(BaseModel):
+    imported: int = Field(
+        title="Imported",
+        description="Number of foods created.",
+        examples=[98]
+    )
+    failed: int = Field(
+        title="Failed",
+        description="Number of items rejected.",
+        examples=[2]
+    )
+    results: list[FoodImportResult] = Field(
+        title="Results",
+        description="One result per item, in the order they were sent.",
+    )
+
+
+class FoodCluster(BaseModel):
+    count: int = Field(
+        title="Count",
+        description="Number of foods in the cluster.",
+        examples=[12]
+    )
+    latitude: float = Field(
+        title="Latitude",
+        description="Latitude of the cluster centroid.",
+        examples=[25.0330]
+    )
+    longitude: float = Field(
+        title="Longitude",
+        description="Longitude of the cluster centroid.",
+        examples=[121.5654]
+    )
+    sampleUid: SnowflakeID = Field(
+        title="Sample UID",
+        description="UID of one food inside the cluster.",
+        examples=["6209533852516352"]
+    )
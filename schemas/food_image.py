@@ -1,4 +1,7 @@
 from beanie import Document
+from pymongo import ASCENDING, IndexModel
+
+from typing import Optional
 
 from snowflake import SnowflakeID
 
@@ -7,10 +10,16 @@ class FoodImage(Document):
     food_id: SnowflakeID
     index: int
     content_type: str
-    data: bytes
+    blob: Optional[str] = None
+    data: Optional[bytes] = None
+    job_id: Optional[SnowflakeID] = None
 
     class Settings:
         name = "FoodImages"
         bson_encoders = {
             SnowflakeID: str
         }
+        indexes = [
+            IndexModel([("food_id", ASCENDING), ("index", ASCENDING)]),
+            IndexModel("job_id"),
+        ]
@@ -0,0 +1,17 @@
+from beanie import Document, Indexed
+from pydantic import Field
+
+from datetime import datetime
+from typing import Annotated, Optional
+
+
+class ImageBlob(Document):
+    sha256: Annotated[str, Indexed(unique=True)]
+    raw_hashes: Annotated[list[str], Indexed()] = Field(default_factory=list)
+    content_type: str
+    data: bytes
+    ref_count: int = 0
+    released_at: Optional[datetime] = None
+
+    class Settings:
+        name = "ImageBlobs"
@@ -0,0 +1,67 @@
+from beanie import Document, Indexed
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING, IndexModel
+
+from datetime import datetime
+from typing import Annotated, Optional
+try:
+    from datetime import UTC
+except ImportError:
+    from datetime import timezone
+    UTC = timezone.utc
+
+from config import INSTANCE_ID, IMAGE_JOB_RETENTION
+from snowflake import SnowflakeGenerator, SnowflakeID
+
+uid_generator = SnowflakeGenerator(INSTANCE_ID)
+
+
+class ImageJob(Document):
+    uid: Annotated[SnowflakeID, Indexed(unique=True)] = Field(
+        title="UID",
+        description="UID of job, use snowflake format.",
+        default_factory=uid_generator.next_id,
+        examples=["6209533852516352"]
+    )
+    kind: str = Field(
+        title="Kind",
+        description="What the image is for, \"avatar\" or \"photo\".",
+        examples=["photo"]
+    )
+    target_id: SnowflakeID = Field(
+        title="Target ID",
+        description="UID of the user for avatars, of the food for photos.",
+        examples=["6209533852516352"]
+    )
+    image_format: str
+    raw_digest: str
+    data: Optional[bytes] = None
+    status: str = Field(
+        title="Status",
+        description="One of pending, running, done and failed.",
+        default="pending",
+        examples=["pending"]
+    )
+    attempts: int = 0
+    visible_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+    class Settings:
+        name = "ImageJobs"
+        bson_encoders = {
+            SnowflakeID: str
+        }
+        indexes = [
+            IndexModel([("status", ASCENDING), ("visible_at", ASCENDING)]),
+            IndexModel("finished_at", expireAfterSeconds=IMAGE_JOB_RETENTION),
+        ]
+
+
+class ImageJobView(BaseModel):
+    uid: SnowflakeID
+    kind: str
+    status: str
+    attempts: int
+    error: Optional[str]
+    statusUrl: str
@@ -1,4 +1,5 @@
 from beanie import Document, Indexed
+from pymongo import ASCENDING, IndexModel
 from pydantic import (
     BaseModel,
     Field,
@@ -52,6 +53,20 @@ class Order(Document):
         bson_encoders = {
             SnowflakeID: str
         }
+        indexes = [
+            IndexModel([("foodId", ASCENDING), ("userId", ASCENDING)], unique=True),
+            IndexModel([("foodId", ASCENDING), ("complete", ASCENDING)]),
+        ]
+
+
+class ArchivedOrder(Order):
+    """Orders of archived foods, moved here by utils.archiver."""
+    class Settings(Order.Settings):
+        name = "OrdersArchive"
+        indexes = [
+            *Order.Settings.indexes,
+            IndexModel("userId"),
+        ]
 
 
 class OrderUpdate(BaseModel):
@@ -59,6 +74,16 @@ class OrderUpdate(BaseModel):
     complete: Optional[bool] = None
 
 
+ORDER_VIEW_PROJECTION = {
+    "_id": 0,
+    "uid": 1,
+    "foodId": 1,
+    "userId": 1,
+    "received": 1,
+    "complete": 1,
+}
+
+
 class OrderView(BaseModel):
     uid: Annotated[SnowflakeID, Indexed(unique=True)]
     foodId: SnowflakeID
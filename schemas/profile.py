@@ -0,0 +1,16 @@
+from pydantic import BaseModel, Field
+
+from snowflake import SnowflakeID
+
+
+class ProfileSummary(BaseModel):
+    uid: SnowflakeID = Field(
+        title="UID",
+        description="UID of profile, use snowflake format.",
+        examples=["6209533852516352"]
+    )
+    summary: str = Field(
+        title="Summary",
+        description="Method, path, status, duration and profiler of the request.",
+        examples=["GET /food/6209533852516352 200 12.31ms pyinstrument"]
+    )
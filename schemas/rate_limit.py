@@ -0,0 +1,19 @@
+from beanie import Document, Indexed
+from pymongo import IndexModel
+
+from datetime import datetime
+from typing import Annotated
+
+from config import RATE_LIMIT_BUCKET_RETENTION
+
+
+class RateLimitBucket(Document):
+    key: Annotated[str, Indexed(unique=True)]
+    tokens: float
+    updated: datetime
+
+    class Settings:
+        name = "RateLimits"
+        indexes = [
+            IndexModel("updated", expireAfterSeconds=RATE_LIMIT_BUCKET_RETENTION),
+        ]
@@ -7,6 +7,7 @@ from pydantic import (
     field_validator,
 )
 
+from time import perf_counter
 from typing import (
     Annotated,
     Optional,
@@ -15,10 +16,25 @@ from typing import (
 from config import INSTANCE_ID
 from snowflake import SnowflakeGenerator, SnowflakeID
 from utils.email_checker import check_is_email
+from utils.metrics import BCRYPT_SECONDS
 
 uid_generator = SnowflakeGenerator(INSTANCE_ID)
 
 
+def hash_password(password: str) -> bytes:
+    start = perf_counter()
+    hashed = hashpw(password.encode("utf-8"), gensalt())
+    BCRYPT_SECONDS.observe(perf_counter() - start, "hash")
+    return hashed
+
+
+def check_password(password: str, hashed: bytes) -> bool:
+    start = perf_counter()
+    result = checkpw(password.encode("utf-8"), hashed)
+    BCRYPT_SECONDS.observe(perf_counter() - start, "check")
+    return result
+
+
 class User(Document):
     uid: Annotated[SnowflakeID, Indexed(unique=True)] = Field(
         title="UID",
@@ -54,7 +70,7 @@ class User(Document):
         return self.uid == value.uid
 
     def check_password(self, password: str) -> bool:
-        return checkpw(password.encode("utf-8"), self.password)
+        return check_password(password, self.password)
 
     class Settings:
         name = "Users"
@@ -80,7 +96,7 @@ class UserCreate(BaseModel):
     @field_serializer("password")
     def password_auto_hash(self, value: str) -> Optional[bytes]:
         if value:
-            return hashpw(value.encode("utf-8"), gensalt())
+            return hash_password(value)
         return None
 
 
@@ -94,7 +110,7 @@ class UserUpdate(BaseModel):
     @field_serializer("password")
     def password_auto_hash(self, value: str) -> Optional[bytes]:
         if value:
-            return hashpw(value.encode("utf-8"), gensalt())
+            return hash_password(value)
         return None
 
 class UserView(BaseModel):
@@ -102,4 +118,6 @@ class UserView(BaseModel):
     email: str
     username: str
     phone: str
-    
\ No newline at end of file
+
+
+USER_VIEW_PROJECTION = {"_id": 0, **dict.fromkeys(UserView.model_fields, 1)}
@@ -103,25 +103,42 @@ class SnowflakeGenerator():
         self._sequence = 0
         self._instance = instance_id
 
-    def __next__(self) -> SnowflakeID:
+    def _now(self) -> int:
         delta = (datetime.now(UTC) - START_TS)
-        current = int(delta.total_seconds() * 1000)
-
-        if current == self._last_timestamp:
-            while current != self._last_timestamp:
-                delta = (datetime.now(UTC) - START_TS)
-                current = int(delta.total_seconds() * 1000)
-            self._sequence += 1
-        else:
-            self._sequence = 0
-
-        self._last_timestamp = current
+        return int(delta.total_seconds() * 1000)
 
-        value = (current << (INST_LEN + SEQ_LEN))
-        value |= self._instance << (SEQ_LEN)
-        value |= self._sequence
-
-        return SnowflakeID(value=value)
+    def __next__(self) -> SnowflakeID:
+        return self.next_ids(1)[0]
+
+    def next_ids(self, count: int) -> list[SnowflakeID]:
+        """
+        Allocate count IDs at once, taking whole runs of sequence numbers
+        per millisecond. When a millisecond's sequence is used up, waits
+        for the next one instead of overflowing into the instance bits.
+        """
+        ids: list[SnowflakeID] = []
+        while len(ids) < count:
+            # A clock stepping back keeps using the last millisecond.
+            current = max(self._now(), self._last_timestamp)
+            if current == self._last_timestamp:
+                if self._sequence >= MAX_SEQ:
+                    continue
+                first = self._sequence + 1
+            else:
+                first = 0
+            last = min(first + count - len(ids), MAX_SEQ + 1) - 1
+
+            base = (current << (INST_LEN + SEQ_LEN))
+            base |= self._instance << (SEQ_LEN)
+            ids.extend(
+                SnowflakeID(value=base | sequence)
+                for sequence in range(first, last + 1)
+            )
+
+            self._last_timestamp = current
+            self._sequence = last
+
+        return ids
 
     def next_id(self) -> SnowflakeID:
         return self.__next__()
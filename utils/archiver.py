@@ -0,0 +1,191 @@
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from asyncio import CancelledError, create_task, sleep, Task
+from time import time
+from typing import Any, Optional
+
+from config import (
+    ARCHIVE_ABANDON_AFTER_HOURS,
+    ARCHIVE_BATCH_PAUSE,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_ENABLED,
+    ARCHIVE_INTERVAL,
+    ARCHIVE_MIN_AGE_HOURS,
+)
+from schemas.food import ArchivedFood, Food
+from schemas.food_image import FoodImage
+from schemas.order import ArchivedOrder, Order
+
+from .food_snapshot import expired_food_query, SECONDS_PER_HOUR
+from .image_store import release
+from .logger import log
+from .metrics import Counter, registry
+
+DUPLICATE_KEY = 11000
+
+ARCHIVED_DOCUMENTS = registry.register(Counter(
+    "archived_documents_total",
+    "Documents moved to the archive collections by collection.",
+    ("collection",),
+))
+
+
+async def move_documents(
+    source: AsyncIOMotorCollection,
+    target: AsyncIOMotorCollection,
+    docs: list[dict[str, Any]],
+) -> int:
+    """
+    Copy docs into target, then delete them from source. Copies left in
+    target by an interrupted run are duplicate keys and count as copied,
+    so a batch is only ever deleted once every document is archived.
+    """
+    try:
+        await target.insert_many(docs, ordered=False)
+    except BulkWriteError as error:
+        if any(
+            write_error["code"] != DUPLICATE_KEY
+            for write_error in error.details["writeErrors"]
+        ):
+            raise
+    result = await source.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+    ARCHIVED_DOCUMENTS.inc(source.name, amount=result.deleted_count)
+    return result.deleted_count
+
+
+async def archive_orders(food_ids: list[str]) -> int:
+    """Move every order of the foods to OrdersArchive, a batch at a time."""
+    source = Order.get_motor_collection()
+    target = ArchivedOrder.get_motor_collection()
+    moved = 0
+    while True:
+        docs = await source.find(
+            {"foodId": {"$in": food_ids}}
+        ).limit(ARCHIVE_BATCH_SIZE).to_list(None)
+        if not docs:
+            return moved
+        moved += await move_documents(source, target, docs)
+        await sleep(ARCHIVE_BATCH_PAUSE)
+
+
+async def release_images(food_ids: list[str]) -> int:
+    """
+    Delete the photos of the foods and drop their blob references. Each
+    image is deleted before its reference is dropped, so an interrupted
+    run never releases a blob twice.
+    """
+    collection = FoodImage.get_motor_collection()
+    released = 0
+    while True:
+        image = await collection.find_one_and_delete(
+            {"food_id": {"$in": food_ids}},
+            projection={"blob": 1},
+        )
+        if image is None:
+            return released
+        await release(image.get("blob"))
+        released += 1
+
+
+async def without_open_orders(
+    orders: AsyncIOMotorCollection,
+    docs: list[dict[str, Any]],
+    abandoned_before: float,
+) -> list[dict[str, Any]]:
+    """
+    The foods in docs that have no order still not complete, or expired
+    before abandoned_before, when such orders no longer hold them back.
+    """
+    held = [doc["uid"] for doc in docs if doc["expiresAt"] > abandoned_before]
+    if not held:
+        return docs
+    open_food_ids = set(await orders.distinct(
+        "foodId",
+        {"foodId": {"$in": held}, "complete": False}
+    ))
+    return [doc for doc in docs if doc["uid"] not in open_food_ids]
+
+
+async def archive_expired_foods(now: Optional[float] = None) -> tuple[int, int]:
+    """
+    Move foods that expired over min_age_hours ago, and their orders, to
+    the archive collections, and release their photos. Foods with orders
+    still not complete stay, their users may yet finish them, until
+    abandon_after_hours. Orders go first, so an interrupted run never
+    leaves an archived food with orders in Orders. Returns the number of
+    foods and orders moved.
+    """
+    if now is None:
+        now = time()
+    query = expired_food_query(now - ARCHIVE_MIN_AGE_HOURS * SECONDS_PER_HOUR)
+    abandoned_before = now - ARCHIVE_ABANDON_AFTER_HOURS * SECONDS_PER_HOUR
+    source = Food.get_motor_collection()
+    target = ArchivedFood.get_motor_collection()
+    orders = Order.get_motor_collection()
+
+    foods_moved = orders_moved = 0
+    last = None
+    while True:
+        # Pages follow the (expiresAt, _id) index, past the foods kept back.
+        page_query = query if last is None else {"$and": [query, {"$or": [
+            {"expiresAt": {"$gt": last["expiresAt"]}},
+            {"expiresAt": last["expiresAt"], "_id": {"$gt": last["_id"]}},
+        ]}]}
+        docs = await source.find(page_query).sort(
+            [("expiresAt", 1), ("_id", 1)]
+        ).limit(ARCHIVE_BATCH_SIZE).to_list(None)
+        if not docs:
+            break
+        last = docs[-1]
+
+        docs = await without_open_orders(orders, docs, abandoned_before)
+        if docs:
+            orders_moved += await archive_orders([doc["uid"] for doc in docs])
+            # order_food turns expired foods away, but a request that
+            # passed its check just before expiry can still land. Such an
+            # order keeps its food hot until the next run.
+            docs = await without_open_orders(orders, docs, abandoned_before)
+            if docs:
+                await release_images([doc["uid"] for doc in docs])
+                foods_moved += await move_documents(source, target, docs)
+        await sleep(ARCHIVE_BATCH_PAUSE)
+
+    return foods_moved, orders_moved
+
+
+class Archiver():
+    """Runs archive_expired_foods every interval, starting one interval in."""
+    _task: Optional[Task]
+
+    def __init__(self):
+        self._task = None
+
+    async def start(self) -> None:
+        if not ARCHIVE_ENABLED:
+            return
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await sleep(ARCHIVE_INTERVAL)
+            try:
+                foods, orders = await archive_expired_foods()
+            except PyMongoError as error:
+                log.error("archive_failed", exc=error)
+                continue
+            if foods or orders:
+                log.info("archive_finished", foods=foods, orders=orders)
+
+
+archiver = Archiver()
@@ -0,0 +1,35 @@
+from jwt import decode
+
+from typing import Any, Optional
+
+from config import JWT_KEY
+
+
+def cookie_value(cookie: bytes, name: bytes) -> Optional[bytes]:
+    """
+    Value of one cookie in a Cookie header. Names must match exactly, so
+    looking up token never returns csrftoken.
+    """
+    for pair in cookie.split(b";"):
+        key, separator, value = pair.partition(b"=")
+        if separator and key.strip() == name:
+            return value.strip().strip(b"\"")
+    return None
+
+
+def decode_bearer(authorization: Optional[bytes]) -> Optional[dict[str, Any]]:
+    """
+    Claims of a raw "Bearer <jwt>" header value, for middleware that runs
+    before FastAPI's security dependencies. None when absent or invalid.
+    """
+    if authorization is None or not authorization.startswith(b"Bearer "):
+        return None
+    try:
+        return decode(
+            jwt=authorization[7:].decode("ascii"),
+            key=JWT_KEY,
+            algorithms=["HS256"],
+            options={"require": ["exp", "iat", "sub"]}
+        )
+    except Exception:
+        return None
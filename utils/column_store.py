@@ -0,0 +1,89 @@
+import numpy as np
+
+from typing import Any, Optional
+
+
+class ColumnStore():
+    """
+    Growable NumPy columns holding one row per uid. Removing a row moves the
+    last row into its slot, so the live rows always stay contiguous.
+    """
+    _columns: dict[str, np.ndarray]
+    _uids: list[str]
+    _rows: dict[str, int]
+    _size: int
+
+    def __init__(self, dtypes: dict[str, Any], capacity: int = 1024):
+        self._columns = {
+            name: np.zeros(capacity, dtype=dtype)
+            for name, dtype in dtypes.items()
+        }
+        self._uids = []
+        self._rows = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._rows
+
+    @property
+    def uids(self) -> list[str]:
+        return self._uids
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name][:self._size]
+
+    def row(self, uid: str) -> Optional[int]:
+        return self._rows.get(uid)
+
+    def set(self, uid: str, values: dict[str, Any]) -> int:
+        row = self._rows.get(uid)
+        if row is None:
+            row = self._size
+            self._reserve(row + 1)
+            self._rows[uid] = row
+            self._uids.append(uid)
+            self._size += 1
+
+        for name, value in values.items():
+            self._columns[name][row] = value
+        return row
+
+    def remove(self, uid: str) -> bool:
+        row = self._rows.pop(uid, None)
+        if row is None:
+            return False
+
+        last = self._size - 1
+        if row != last:
+            for column in self._columns.values():
+                column[row] = column[last]
+            moved = self._uids[last]
+            self._uids[row] = moved
+            self._rows[moved] = row
+        self._uids.pop()
+        self._size = last
+        return True
+
+    def replace(self, uids: list[str], values: dict[str, np.ndarray]) -> None:
+        size = len(uids)
+        self._reserve(size)
+        for name, column in values.items():
+            self._columns[name][:size] = column
+        self._uids = list(uids)
+        self._rows = {uid: row for row, uid in enumerate(self._uids)}
+        self._size = size
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(next(iter(self._columns.values())))
+        if size <= capacity:
+            return
+
+        while capacity < size:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.zeros((capacity, *column.shape[1:]), dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
@@ -0,0 +1,26 @@
+from gzip import compress
+
+from typing import Optional
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q=0."""
+    if not accept_encoding:
+        return False
+    for coding in accept_encoding.lower().split(","):
+        name, _, params = coding.partition(";")
+        if name.strip() not in ("gzip", "*"):
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def gzip_body(body: bytes, level: int) -> bytes:
+    # A fixed mtime makes equal bodies compress to equal bytes.
+    return compress(body, compresslevel=level, mtime=0)
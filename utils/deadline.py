@@ -0,0 +1,36 @@
+from starlette.routing import Match, Router
+from starlette.types import Scope
+
+from contextvars import ContextVar
+from time import monotonic
+from typing import Optional
+
+from config import DEADLINE_DEFAULT_BUDGET, DEADLINE_ROUTE_BUDGETS
+
+request_deadline: ContextVar[Optional[float]] = ContextVar(
+    "request_deadline",
+    default=None
+)
+
+
+def route_budget(router: Router, scope: Scope) -> float:
+    """
+    Budget of the endpoint the request will be routed to. Matching the
+    routes here repeats the router's work, so it is skipped unless some
+    route has its own budget.
+    """
+    if not DEADLINE_ROUTE_BUDGETS:
+        return DEADLINE_DEFAULT_BUDGET
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return DEADLINE_ROUTE_BUDGETS.get(route.name, DEADLINE_DEFAULT_BUDGET)
+    return DEADLINE_DEFAULT_BUDGET
+
+
+def remaining_ms() -> Optional[int]:
+    """Milliseconds left for the current request, None outside of one."""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return max(int((deadline - monotonic()) * 1000), 1)
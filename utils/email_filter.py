@@ -0,0 +1,235 @@
+from pymongo.errors import OperationFailure, PyMongoError
+
+from asyncio import CancelledError, create_task, sleep, Task
+from hashlib import blake2b
+from math import ceil, exp, log
+from time import monotonic
+from typing import Any, Iterator, Optional
+
+from config import (
+    EMAIL_FILTER_CAPACITY,
+    EMAIL_FILTER_ENABLED,
+    EMAIL_FILTER_FALSE_POSITIVE_RATE,
+    EMAIL_FILTER_REFRESH_INTERVAL,
+    EMAIL_FILTER_SINGLE_PROCESS,
+    WORKERS,
+)
+from schemas.user import User
+
+from .metrics import Gauge, registry
+
+LOAD_BATCH_SIZE = 5000
+# "$changeStream is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+class BloomFilter():
+    """
+    Bit array with k positions per item, derived from one BLAKE2b digest by
+    double hashing. Membership answers "maybe" or "definitely not".
+    """
+    size: int
+    hashes: int
+    count: int
+    _bits: bytearray
+
+    def __init__(self, size: int, hashes: int):
+        self.size = size
+        self.hashes = hashes
+        self.count = 0
+        self._bits = bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, false_positive_rate: float) -> "BloomFilter":
+        size = ceil(-capacity * log(false_positive_rate) / log(2) ** 2)
+        hashes = max(round(size / capacity * log(2)), 1)
+        return cls(size, hashes)
+
+    def _positions(self, item: str) -> Iterator[int]:
+        digest = blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def false_positive_rate(self) -> float:
+        """Expected rate at the current fill, above the target once over capacity."""
+        return (1 - exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class EmailFilter():
+    """
+    Bloom filter of registered emails, kept current from a change stream
+    on Users so registrations by every worker and host reach it. Until
+    the first load finishes every email might exist, so callers fall back
+    to the database. Without change streams it is rebuilt every interval,
+    and misses accounts other processes registered since.
+    """
+    _filter: Optional[BloomFilter]
+    _pending: Optional[BloomFilter]
+    _streaming: bool
+    _task: Optional[Task]
+
+    def __init__(self):
+        self._filter = None
+        self._pending = None
+        self._streaming = False
+        self._task = None
+
+    def might_exist(self, email: str) -> bool:
+        if self._filter is None:
+            return True
+        return email in self._filter
+
+    def is_absent(self, email: str) -> bool:
+        """
+        Whether the email is known not to be registered. Negatives are only
+        trusted while the change stream is live, or when this is the one
+        process that registers accounts.
+        """
+        if not self._streaming and not (EMAIL_FILTER_SINGLE_PROCESS and WORKERS <= 1):
+            return False
+        return not self.might_exist(email)
+
+    def add(self, email: str) -> None:
+        if self._filter is not None:
+            self._filter.add(email)
+        if self._pending is not None:
+            self._pending.add(email)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._filter.memory_bytes if self._filter is not None else 0
+
+    @property
+    def false_positive_rate(self) -> float:
+        return self._filter.false_positive_rate if self._filter is not None else 1.0
+
+    async def load(self) -> None:
+        """
+        Build a fresh filter from a projection of the indexed email field,
+        streamed in batches, and swap it in. Emails added meanwhile go into
+        both filters.
+        """
+        collection = User.get_motor_collection()
+        count = await collection.estimated_document_count()
+        self._pending = BloomFilter.for_capacity(
+            max(EMAIL_FILTER_CAPACITY, count * 2),
+            EMAIL_FILTER_FALSE_POSITIVE_RATE
+        )
+        try:
+            async for doc in collection.find(
+                {},
+                {"_id": 0, "email": 1},
+                batch_size=LOAD_BATCH_SIZE
+            ):
+                self._pending.add(doc["email"])
+            self._filter = self._pending
+        finally:
+            self._pending = None
+
+    async def start(self) -> None:
+        if not EMAIL_FILTER_ENABLED:
+            return
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        use_stream = True
+        while True:
+            try:
+                if use_stream:
+                    await self._watch()
+                else:
+                    await self._poll()
+            except OperationFailure as error:
+                if use_stream and error.code == CHANGE_STREAMS_UNSUPPORTED:
+                    # Standalone servers have no change streams.
+                    use_stream = False
+                else:
+                    await sleep(EMAIL_FILTER_REFRESH_INTERVAL)
+            except PyMongoError:
+                await sleep(EMAIL_FILTER_REFRESH_INTERVAL)
+            self._streaming = False
+
+    async def _watch(self) -> None:
+        collection = User.get_motor_collection()
+        async with collection.watch(
+            [
+                {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+                {"$project": {
+                    "fullDocument.email": 1,
+                    "updateDescription.updatedFields.email": 1,
+                }},
+            ],
+            max_await_time_ms=1000,
+        ) as stream:
+            # The stream is open before the load, so no write falls between.
+            await self.load()
+            self._streaming = True
+            rebuild_at = monotonic() + EMAIL_FILTER_REFRESH_INTERVAL
+            while stream.alive:
+                change = await stream.try_next()
+                if change is not None:
+                    self._apply_change(change)
+                if monotonic() >= rebuild_at:
+                    await self.load()
+                    rebuild_at = monotonic() + EMAIL_FILTER_REFRESH_INTERVAL
+
+    async def _poll(self) -> None:
+        while True:
+            await self.load()
+            await sleep(EMAIL_FILTER_REFRESH_INTERVAL)
+
+    def _apply_change(self, change: dict[str, Any]) -> None:
+        email = change.get("fullDocument", {}).get("email")
+        if email is None:
+            email = change.get("updateDescription", {}).get("updatedFields", {}).get("email")
+        if email is not None:
+            self.add(email)
+
+
+email_filter = EmailFilter()
+
+registry.register(Gauge(
+    "email_filter_target_false_positive_rate",
+    "Configured false positive rate of the registered email filter.",
+    callback=lambda: EMAIL_FILTER_FALSE_POSITIVE_RATE,
+    aggregate="max",
+))
+registry.register(Gauge(
+    "email_filter_false_positive_rate",
+    "Expected false positive rate of the registered email filter.",
+    callback=lambda: email_filter.false_positive_rate,
+    aggregate="max",
+))
+registry.register(Gauge(
+    "email_filter_memory_bytes",
+    "Size of the registered email filter's bit array.",
+    callback=lambda: email_filter.memory_bytes,
+))
@@ -0,0 +1,154 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from asyncio import create_task, Event, Task, wait_for
+from asyncio import TimeoutError as AsyncTimeoutError
+from time import time
+from typing import Any, Optional
+
+from config import (
+    POPULARITY_DETAIL_VIEW_WEIGHT,
+    POPULARITY_FLUSH_INTERVAL,
+    POPULARITY_HALF_LIFE_HOURS,
+    POPULARITY_MAX_PENDING,
+    POPULARITY_ORDER_WEIGHT,
+    POPULARITY_PHOTO_VIEW_WEIGHT,
+)
+from schemas.food import Food
+
+from .metrics import Counter, Gauge, registry
+
+SECONDS_PER_HOUR = 3600
+HALF_LIFE = POPULARITY_HALF_LIFE_HOURS * SECONDS_PER_HOUR
+# Keeps 2 ** (age / half-life) finite for foods long past their expiry.
+MAX_AGE = 256 * HALF_LIFE
+
+EVENT_WEIGHTS = {
+    "detailViews": POPULARITY_DETAIL_VIEW_WEIGHT,
+    "photoViews": POPULARITY_PHOTO_VIEW_WEIGHT,
+    "orders": POPULARITY_ORDER_WEIGHT,
+}
+# Events that also keep a plain counter on the food.
+COUNTED_EVENTS = ("detailViews", "photoViews")
+
+COUNTER_UPDATES_DROPPED = registry.register(Counter(
+    "food_counter_updates_dropped_total",
+    "Food counter updates lost to failed bulk writes.",
+))
+
+
+def event_weight(event: str, created_at: float, now: float) -> float:
+    """
+    Forward decay: an event is worth 2^(age / half-life), where age is the
+    food's age when it happened. Every stored score then decays by the same
+    2^(-age / half-life), so the sums only ever need $inc.
+    """
+    age = min(max(now - created_at, 0), MAX_AGE)
+    return EVENT_WEIGHTS[event] * 2 ** (age / HALF_LIFE)
+
+
+def decayed_popularity(popularity: float, created_at: float, now: float) -> float:
+    age = min(max(now - created_at, 0), MAX_AGE)
+    return popularity * 2 ** (-age / HALF_LIFE)
+
+
+class FoodCounters():
+    """
+    Write-behind view and order counters. Events accumulate per food in
+    memory and go out as one unordered bulk_write of $inc updates every
+    flush_interval, or sooner once max_pending foods are waiting.
+    """
+    _pending: dict[str, dict[str, float]]
+    _wake: Event
+    _stopping: bool
+    _task: Optional[Task]
+
+    def __init__(self):
+        self._pending = {}
+        self._wake = Event()
+        self._stopping = False
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, food_id: str, event: str, created_at: Optional[float] = None) -> None:
+        """Count an event; it only adds to popularity when the food's age is known."""
+        fields = self._pending.get(food_id)
+        if fields is None:
+            fields = self._pending[food_id] = {}
+        if event in COUNTED_EVENTS:
+            fields[event] = fields.get(event, 0) + 1
+        if created_at is not None:
+            fields["popularity"] = (
+                fields.get("popularity", 0.0)
+                + event_weight(event, created_at, time())
+            )
+
+        if len(self._pending) >= POPULARITY_MAX_PENDING:
+            self._wake.set()
+
+    def popularity(self, doc: dict[str, Any], now: float) -> float:
+        """Decayed popularity of a food document, including unflushed events."""
+        pending = self._pending.get(str(doc["uid"]))
+        popularity = doc.get("popularity", 0.0)
+        if pending is not None:
+            popularity += pending.get("popularity", 0.0)
+        return decayed_popularity(popularity, doc["createdAt"], now)
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        try:
+            await Food.get_motor_collection().bulk_write(
+                [
+                    UpdateOne({"uid": uid}, {"$inc": fields})
+                    for uid, fields in pending.items()
+                ],
+                ordered=False,
+            )
+        except BulkWriteError as error:
+            # Some updates were applied, retrying would count them twice.
+            COUNTER_UPDATES_DROPPED.inc(amount=len(error.details.get("writeErrors", [])))
+        except PyMongoError:
+            for uid, fields in pending.items():
+                merged = self._pending.setdefault(uid, {})
+                for field, amount in fields.items():
+                    merged[field] = merged.get(field, 0) + amount
+            raise
+
+    async def start(self) -> None:
+        self._stopping = False
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush what is left instead of cancelling a flush halfway."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await wait_for(self._wake.wait(), POPULARITY_FLUSH_INTERVAL)
+            except AsyncTimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except PyMongoError:
+                pass
+
+
+food_counters = FoodCounters()
+
+registry.register(Gauge(
+    "food_counters_pending",
+    "Foods with counter updates waiting for the next flush.",
+    callback=lambda: len(food_counters),
+))
@@ -0,0 +1,268 @@
+from orjson import loads
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from codecs import getincrementaldecoder
+from json import JSONDecodeError
+from re import compile
+from typing import Any, AsyncIterator, Optional
+
+from config import FOOD_IMPORT_CHUNK_SIZE, FOOD_IMPORT_MAX_ITEMS
+from schemas.food import Food, FoodCreate, uid_generator
+from snowflake import SnowflakeID
+
+from .food_snapshot import food_expires_at, food_snapshot
+from .logger import log
+
+SEPARATORS = " \t\r\n,"
+SCALAR_END = compile(r"[\s,\]]")
+STRUCTURE = compile(r'["{}\[\]]')
+STRING_END = compile(r'["\\]')
+
+
+class ImportAborted(Exception):
+    """Ends an import early; summary covers the items read until then."""
+    summary: dict[str, Any]
+
+
+class MalformedImport(ImportAborted):
+    pass
+
+
+class ImportTooLarge(ImportAborted):
+    pass
+
+
+# Food's defaults, for the fields FoodCreate doesn't carry.
+FOOD_DEFAULTS = {
+    name: field.default
+    for name, field in Food.model_fields.items()
+    if not field.is_required()
+    and field.default_factory is None
+    and name not in ("id", "revision_id")
+}
+
+
+async def _ndjson_items(first: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    buffer = first
+    more = True
+    while more:
+        try:
+            buffer += await chunks.__anext__()
+        except StopAsyncIteration:
+            buffer += b"\n"
+            more = False
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield loads(line)
+            except JSONDecodeError as error:
+                yield error
+
+
+def _item_end(buffer: str, start: int) -> Optional[int]:
+    """
+    End of the JSON value starting at start, or None if the buffer ends
+    first. Only brackets and strings are tracked, the value itself is
+    left for the decoder to check. A scalar ends at the next separator,
+    so a number cut at the end of a chunk waits for the rest of it.
+    """
+    if buffer[start] not in "{[\"":
+        match = SCALAR_END.search(buffer, start)
+        return match.start() if match else None
+
+    position = start
+    depth = 0
+    while True:
+        match = STRUCTURE.search(buffer, position)
+        if match is None:
+            return None
+        position = match.end()
+        char = match.group()
+        if char == '"':
+            while True:
+                match = STRING_END.search(buffer, position)
+                if match is None:
+                    return None
+                # An escape skips the character after the backslash.
+                position = match.end() + (match.group() == "\\")
+                if match.group() == '"':
+                    break
+        elif char in "{[":
+            depth += 1
+            continue
+        else:
+            depth -= 1
+        if depth <= 0:
+            return position
+
+
+async def _array_items(first: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    utf8 = getincrementaldecoder("utf-8")()
+    try:
+        buffer = utf8.decode(first)
+    except UnicodeDecodeError as error:
+        raise MalformedImport(str(error))
+    # The first chunk starts at the opening bracket.
+    position = buffer.find("[") + 1
+    more = True
+    while True:
+        while True:
+            while position < len(buffer) and buffer[position] in SEPARATORS:
+                position += 1
+            if buffer.startswith("]", position):
+                return
+            if position == len(buffer):
+                break
+            end = _item_end(buffer, position)
+            if end is None:
+                break
+            try:
+                item = loads(buffer[position:end])
+            except JSONDecodeError as error:
+                raise MalformedImport(str(error))
+            position = end
+            yield item
+
+        if not more:
+            if position < len(buffer):
+                raise MalformedImport("Unexpected end of the body")
+            return
+        try:
+            pending = await chunks.__anext__()
+        except StopAsyncIteration:
+            pending = b""
+            more = False
+        try:
+            buffer = buffer[position:] + utf8.decode(pending, final=not more)
+        except UnicodeDecodeError as error:
+            raise MalformedImport(str(error))
+        position = 0
+
+
+async def iter_json_items(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Items of a JSON array or of NDJSON, decoded as the body arrives. An
+    NDJSON line that fails to decode is yielded as the ValueError instead.
+    A malformed array can't be resynced past the bad item, it raises
+    MalformedImport.
+    """
+    first = b""
+    async for chunk in chunks:
+        first += chunk
+        if first.strip():
+            break
+    if first.lstrip()[:1] == b"[":
+        items = _array_items(first, chunks)
+    else:
+        items = _ndjson_items(first, chunks)
+    async for item in items:
+        yield item
+
+
+def describe(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(map(str, detail['loc'])) or 'item'}: {detail['msg']}"
+        for detail in error.errors()
+    )
+
+
+async def insert_chunk(
+    foods: list[FoodCreate],
+    indexes: list[int],
+    author_id: SnowflakeID,
+    results: list[dict[str, Any]],
+) -> None:
+    uids = uid_generator.next_ids(len(foods))
+    docs = [
+        {
+            **FOOD_DEFAULTS,
+            **food.model_dump(),
+            "uid": str(uid),
+            "authorId": str(author_id),
+        }
+        for food, uid in zip(foods, uids)
+    ]
+    for doc in docs:
+        doc["expiresAt"] = food_expires_at(doc)
+    failed: dict[int, str] = {}
+    try:
+        await Food.get_motor_collection().insert_many(docs, ordered=False)
+    except BulkWriteError as error:
+        for write_error in error.details["writeErrors"]:
+            failed[write_error["index"]] = write_error["errmsg"]
+
+    for position, (index, doc) in enumerate(zip(indexes, docs)):
+        if position in failed:
+            results[index] = {"index": index, "uid": None, "error": failed[position]}
+        else:
+            results[index] = {"index": index, "uid": doc["uid"], "error": None}
+            food_snapshot.notify_upsert(doc)
+
+
+def summarize(results: list[dict[str, Any]]) -> dict[str, Any]:
+    imported = sum(result["uid"] is not None for result in results)
+    return {
+        "imported": imported,
+        "failed": len(results) - imported,
+        "results": results,
+    }
+
+
+async def import_foods(chunks: AsyncIterator[bytes], author_id: SnowflakeID) -> dict[str, Any]:
+    """
+    Validate foods as the body streams in and insert them in unordered
+    chunks of chunk_size, each with one batch of Snowflake IDs. Invalid
+    items and failed inserts are reported per item, the rest are
+    imported. Reading stops at a malformed array or at item max_items + 1;
+    the items before it are still imported, and the ImportAborted raised
+    carries their results.
+    """
+    results: list[dict[str, Any]] = []
+    foods: list[FoodCreate] = []
+    indexes: list[int] = []
+
+    try:
+        async for item in iter_json_items(chunks):
+            index = len(results)
+            if index >= FOOD_IMPORT_MAX_ITEMS:
+                raise ImportTooLarge(f"Imports are limited to {FOOD_IMPORT_MAX_ITEMS} items")
+            results.append({"index": index, "uid": None, "error": None})
+            if isinstance(item, ValueError):
+                results[index]["error"] = f"Invalid JSON: {item}"
+                continue
+            try:
+                foods.append(FoodCreate.model_validate(item))
+            except ValidationError as error:
+                results[index]["error"] = describe(error)
+                continue
+            indexes.append(index)
+            if len(foods) >= FOOD_IMPORT_CHUNK_SIZE:
+                await insert_chunk(foods, indexes, author_id, results)
+                foods, indexes = [], []
+    except ImportAborted as error:
+        if foods:
+            await insert_chunk(foods, indexes, author_id, results)
+        error.summary = summarize(results)
+        log.warning(
+            "food_import_aborted",
+            author_id=str(author_id),
+            reason=str(error),
+            imported=error.summary["imported"],
+            failed=error.summary["failed"],
+        )
+        raise
+
+    if foods:
+        await insert_chunk(foods, indexes, author_id, results)
+
+    summary = summarize(results)
+    log.info(
+        "food_import",
+        author_id=str(author_id),
+        imported=summary["imported"],
+        failed=summary["failed"],
+    )
+    return summary
@@ -0,0 +1,239 @@
+import numpy as np
+from pymongo.errors import PyMongoError
+
+from asyncio import CancelledError, create_task, sleep, Task
+from time import time
+from typing import Any, Iterable, Optional
+
+from config import (
+    FEED_DISTANCE_SCALE_KM,
+    FEED_DISTANCE_WEIGHT,
+    FEED_LOAD_REFRESH_INTERVAL,
+    FEED_LOAD_WEIGHT,
+    FEED_TAG_WEIGHT,
+    FEED_URGENCY_SCALE_HOURS,
+    FEED_URGENCY_WEIGHT,
+)
+from schemas.food import Food
+from schemas.order import Order
+from snowflake import SnowflakeID
+
+from .column_store import ColumnStore
+
+TAG_SLOTS = 64
+EARTH_RADIUS_KM = 6371.0088
+SECONDS_PER_HOUR = 3600
+PREFERENCE_HISTORY = 50
+
+
+def tag_vector(tags: Iterable[int]) -> np.ndarray:
+    vector = np.zeros(TAG_SLOTS, dtype=np.float32)
+    for tag in tags:
+        vector[tag % TAG_SLOTS] = 1
+    return vector
+
+
+async def order_preference(user_id: SnowflakeID) -> np.ndarray:
+    """Tag weights of the caller's recent orders, normalized to sum to 1."""
+    preference = np.zeros(TAG_SLOTS, dtype=np.float32)
+    food_ids = [
+        doc["foodId"]
+        async for doc in Order.get_motor_collection().find(
+            {"userId": str(user_id)},
+            {"_id": 0, "foodId": 1},
+        ).sort("_id", -1).limit(PREFERENCE_HISTORY)
+    ]
+    if not food_ids:
+        return preference
+
+    async for doc in Food.get_motor_collection().find(
+        {"uid": {"$in": food_ids}},
+        {"_id": 0, "tags": 1},
+    ):
+        preference += tag_vector(doc["tags"])
+
+    total = preference.sum()
+    if total > 0:
+        preference /= total
+    return preference
+
+
+def score_foods(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    expires_at: np.ndarray,
+    tags: np.ndarray,
+    load: np.ndarray,
+    origin: tuple[float, float],
+    preference: np.ndarray,
+    now: float,
+) -> np.ndarray:
+    """
+    Score every candidate in one pass. Closer foods, foods that expire
+    sooner, foods sharing tags with the caller's past orders and foods with
+    fewer outstanding orders score higher. Expired foods get -inf.
+    """
+    lat0 = np.radians(origin[0])
+    lat = np.radians(latitude)
+    dlat = lat - lat0
+    dlon = np.radians(longitude - origin[1])
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat0) * np.cos(lat) * np.sin(dlon / 2) ** 2
+    distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+    remaining = (expires_at - now) / SECONDS_PER_HOUR
+
+    score = FEED_DISTANCE_WEIGHT * np.exp(-distance / FEED_DISTANCE_SCALE_KM)
+    score += FEED_URGENCY_WEIGHT * np.exp(-np.maximum(remaining, 0) / FEED_URGENCY_SCALE_HOURS)
+    score += FEED_TAG_WEIGHT * (tags @ preference)
+    score -= FEED_LOAD_WEIGHT * (load / (load + 1))
+    score[remaining <= 0] = -np.inf
+    return score
+
+
+def top_k(score: np.ndarray, limit: int) -> np.ndarray:
+    if limit < len(score):
+        rows = np.argpartition(-score, limit)[:limit]
+    else:
+        rows = np.arange(len(score))
+    rows = rows[np.argsort(-score[rows], kind="stable")]
+    return rows[np.isfinite(score[rows])]
+
+
+class FoodRanker():
+    """
+    Columnar copy of the active foods used by the "for you" feed, fed by the
+    food snapshot. Order load comes from an aggregation refreshed in the
+    background plus this process' own order writes.
+    """
+    _store: ColumnStore
+    _loads: dict[str, int]
+    _task: Optional[Task]
+
+    def __init__(self):
+        self._store = ColumnStore({
+            "latitude": np.float64,
+            "longitude": np.float64,
+            "expires_at": np.float64,
+            "tags": np.dtype((np.float32, (TAG_SLOTS,))),
+            "load": np.float32,
+        })
+        self._loads = {}
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def rank(
+        self,
+        origin: tuple[float, float],
+        preference: np.ndarray,
+        limit: int,
+    ) -> list[str]:
+        store = self._store
+        score = score_foods(
+            store.column("latitude"),
+            store.column("longitude"),
+            store.column("expires_at"),
+            store.column("tags"),
+            store.column("load"),
+            origin,
+            preference,
+            time(),
+        )
+        uids = store.uids
+        return [uids[row] for row in top_k(score, limit)]
+
+    def rank_documents(
+        self,
+        docs: list[dict[str, Any]],
+        origin: tuple[float, float],
+        preference: np.ndarray,
+        limit: int,
+    ) -> list[dict[str, Any]]:
+        if not docs:
+            return []
+
+        score = score_foods(
+            np.array([doc["latitude"] for doc in docs], dtype=np.float64),
+            np.array([doc["longitude"] for doc in docs], dtype=np.float64),
+            np.array([
+                doc["createdAt"] + doc["validityPeriod"] * SECONDS_PER_HOUR
+                for doc in docs
+            ], dtype=np.float64),
+            np.array([tag_vector(doc["tags"]) for doc in docs], dtype=np.float32),
+            np.array([self._loads.get(doc["uid"], 0) for doc in docs], dtype=np.float32),
+            origin,
+            preference,
+            time(),
+        )
+        return [docs[row] for row in top_k(score, limit)]
+
+    def adjust_load(self, food_id: str, delta: int) -> None:
+        load = max(self._loads.get(food_id, 0) + delta, 0)
+        self._loads[food_id] = load
+        if food_id in self._store:
+            self._store.set(food_id, {"load": load})
+
+    async def refresh_loads(self) -> None:
+        loads: dict[str, int] = {}
+        async for row in Order.get_motor_collection().aggregate([
+            {"$match": {"complete": False}},
+            {"$group": {"_id": "$foodId", "count": {"$sum": 1}}},
+        ]):
+            loads[row["_id"]] = row["count"]
+
+        self._loads = loads
+        store = self._store
+        store.column("load")[:] = [loads.get(uid, 0) for uid in store.uids]
+
+    async def start(self) -> None:
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh_loads()
+            except PyMongoError:
+                pass
+            await sleep(FEED_LOAD_REFRESH_INTERVAL)
+
+    def on_upsert(self, entry: Any) -> None:
+        doc = entry.doc
+        self._store.set(entry.uid, {
+            "latitude": doc["latitude"],
+            "longitude": doc["longitude"],
+            "expires_at": entry.expires_at,
+            "tags": tag_vector(doc["tags"]),
+            "load": self._loads.get(entry.uid, 0),
+        })
+
+    def on_remove(self, uid: str) -> None:
+        self._store.remove(uid)
+
+    def on_reset(self, entries: list[Any]) -> None:
+        self._store.replace([entry.uid for entry in entries], {
+            "latitude": np.array([entry.doc["latitude"] for entry in entries], dtype=np.float64),
+            "longitude": np.array([entry.doc["longitude"] for entry in entries], dtype=np.float64),
+            "expires_at": np.array([entry.expires_at for entry in entries], dtype=np.float64),
+            "tags": np.array(
+                [tag_vector(entry.doc["tags"]) for entry in entries],
+                dtype=np.float32
+            ).reshape(len(entries), TAG_SLOTS),
+            "load": np.array(
+                [self._loads.get(entry.uid, 0) for entry in entries],
+                dtype=np.float32
+            ),
+        })
+
+
+food_ranker = FoodRanker()
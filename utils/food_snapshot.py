@@ -0,0 +1,309 @@
+from orjson import dumps
+from pymongo.errors import OperationFailure, PyMongoError
+
+from asyncio import CancelledError, create_task, sleep, Task
+from os import urandom
+from time import monotonic, time
+from typing import Any, Optional, Protocol
+
+from config import (
+    COMPRESSION_CACHED_LEVEL,
+    SNAPSHOT_ENABLED,
+    SNAPSHOT_MAX_STALENESS,
+    SNAPSHOT_REFRESH_INTERVAL,
+)
+from schemas.food import Food, FoodView
+
+from .compression import gzip_body
+
+SECONDS_PER_HOUR = 3600
+# "$changeStream is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+def food_expires_at(doc: dict[str, Any]) -> float:
+    return doc["createdAt"] + doc["validityPeriod"] * SECONDS_PER_HOUR
+
+
+EXPIRES_AT_EXPRESSION = {"$add": [
+    "$createdAt",
+    {"$multiply": ["$validityPeriod", SECONDS_PER_HOUR]}
+]}
+
+
+def active_food_query(now: Optional[float] = None) -> dict[str, Any]:
+    if now is None:
+        now = time()
+    return {"$expr": {"$gt": [EXPIRES_AT_EXPRESSION, now]}}
+
+
+def expired_food_query(before: float) -> dict[str, Any]:
+    """
+    Foods that expired at or before the given time. Foods stored before
+    expiresAt existed are only found once migrate.py has filled it in.
+    """
+    return {"expiresAt": {"$lte": before}}
+
+
+class SnapshotEntry():
+    uid: str
+    doc: dict[str, Any]
+    body: bytes
+    expires_at: float
+
+    def __init__(self, doc: dict[str, Any]):
+        view = FoodView.model_validate(doc)
+        self.uid = str(view.uid)
+        self.doc = doc
+        self.body = dumps(view.model_dump(mode="json"))
+        self.expires_at = food_expires_at(doc)
+
+
+class SnapshotListener(Protocol):
+    def on_upsert(self, entry: SnapshotEntry) -> None: ...
+
+    def on_remove(self, uid: str) -> None: ...
+
+    def on_reset(self, entries: list[SnapshotEntry]) -> None: ...
+
+
+class FoodSnapshot():
+    """
+    In-process copy of the active foods, kept current from a change stream
+    when the deployment supports one, otherwise from this process' own
+    writes plus a periodic full reload.
+    """
+    _entries: dict[str, SnapshotEntry]
+    _object_ids: dict[Any, str]
+    _version: int
+    _epoch: str
+    _list_body: Optional[bytes]
+    _list_version: int
+    _list_gzip: Optional[bytes]
+    _list_gzip_version: int
+    _next_expiry: float
+    _synced_at: Optional[float]
+    _streaming: bool
+    _task: Optional[Task]
+    _listeners: list[SnapshotListener]
+
+    def __init__(self):
+        self._entries = {}
+        self._object_ids = {}
+        self._version = 0
+        self._epoch = urandom(4).hex()
+        self._list_body = None
+        self._list_version = -1
+        self._list_gzip = None
+        self._list_gzip_version = -1
+        self._next_expiry = float("inf")
+        self._synced_at = None
+        self._streaming = False
+        self._task = None
+        self._listeners = []
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def etag(self) -> str:
+        return f"\"{self._epoch}-{self._version}\""
+
+    @property
+    def streaming(self) -> bool:
+        return self._streaming
+
+    def add_listener(self, listener: SnapshotListener) -> None:
+        self._listeners.append(listener)
+        if self._synced_at is not None:
+            listener.on_reset(list(self._entries.values()))
+
+    def is_warm(self) -> bool:
+        if self._synced_at is None:
+            return False
+        return monotonic() - self._synced_at <= SNAPSHOT_MAX_STALENESS
+
+    def entries(self) -> list[SnapshotEntry]:
+        self._prune_expired()
+        return list(self._entries.values())
+
+    def get(self, uid: str) -> Optional[SnapshotEntry]:
+        self._prune_expired()
+        return self._entries.get(uid)
+
+    def list_body(self) -> Optional[bytes]:
+        if not self.is_warm():
+            return None
+
+        self._prune_expired()
+        if self._list_version != self._version:
+            self._list_body = b"[" + b",".join(
+                entry.body for entry in self._entries.values()
+            ) + b"]"
+            self._list_version = self._version
+        return self._list_body
+
+    def list_body_gzip(self) -> Optional[bytes]:
+        """The list body gzipped, compressed once per version."""
+        body = self.list_body()
+        if body is None:
+            return None
+
+        if self._list_gzip_version != self._list_version:
+            self._list_gzip = gzip_body(body, COMPRESSION_CACHED_LEVEL)
+            self._list_gzip_version = self._list_version
+        return self._list_gzip
+
+    def upsert(self, doc: dict[str, Any]) -> None:
+        entry = SnapshotEntry(doc)
+        object_id = doc.get("_id", doc.get("id"))
+        if object_id is not None:
+            self._object_ids[object_id] = entry.uid
+
+        if entry.expires_at <= time():
+            self._discard(entry.uid)
+            return
+
+        previous = self._entries.get(entry.uid)
+        if previous is not None and previous.body == entry.body:
+            previous.doc = doc
+            return
+
+        self._entries[entry.uid] = entry
+        self._next_expiry = min(self._next_expiry, entry.expires_at)
+        self._version += 1
+        for listener in self._listeners:
+            listener.on_upsert(entry)
+
+    def remove(self, uid: str) -> None:
+        self._discard(uid)
+
+    def notify_upsert(self, doc: dict[str, Any]) -> None:
+        """Apply a write made by this process when no change stream is available."""
+        if self._synced_at is not None and not self._streaming:
+            self.upsert(doc)
+
+    def notify_remove(self, uid: str) -> None:
+        if self._synced_at is not None and not self._streaming:
+            self.remove(uid)
+
+    async def load(self) -> None:
+        collection = Food.get_motor_collection()
+        entries: dict[str, SnapshotEntry] = {}
+        object_ids: dict[Any, str] = {}
+        async for doc in collection.find(active_food_query()):
+            entry = SnapshotEntry(doc)
+            entries[entry.uid] = entry
+            object_ids[doc["_id"]] = entry.uid
+
+        changed = entries.keys() != self._entries.keys() or any(
+            entry.body != self._entries[uid].body
+            for uid, entry in entries.items()
+        )
+        self._entries = entries
+        self._object_ids = object_ids
+        self._next_expiry = min(
+            (entry.expires_at for entry in entries.values()),
+            default=float("inf")
+        )
+        if changed:
+            self._version += 1
+            for listener in self._listeners:
+                listener.on_reset(list(entries.values()))
+        self._synced_at = monotonic()
+
+    async def start(self) -> None:
+        if not SNAPSHOT_ENABLED:
+            return
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        use_stream = True
+        while True:
+            try:
+                if use_stream:
+                    await self._watch()
+                else:
+                    await self._poll()
+            except OperationFailure as error:
+                if use_stream and error.code == CHANGE_STREAMS_UNSUPPORTED:
+                    # Standalone servers have no change streams.
+                    use_stream = False
+                else:
+                    # E.g. ChangeStreamHistoryLost after a failover, the
+                    # next _watch reopens the stream and reloads.
+                    await sleep(SNAPSHOT_REFRESH_INTERVAL)
+            except PyMongoError:
+                await sleep(SNAPSHOT_REFRESH_INTERVAL)
+            self._streaming = False
+
+    async def _watch(self) -> None:
+        collection = Food.get_motor_collection()
+        async with collection.watch(
+            full_document="updateLookup",
+            max_await_time_ms=1000,
+        ) as stream:
+            # The stream is open before the load, so no write falls between.
+            await self.load()
+            self._streaming = True
+            while stream.alive:
+                change = await stream.try_next()
+                self._synced_at = monotonic()
+                if change is not None:
+                    self._apply_change(change)
+
+    async def _poll(self) -> None:
+        while True:
+            await self.load()
+            await sleep(SNAPSHOT_REFRESH_INTERVAL)
+
+    def _apply_change(self, change: dict[str, Any]) -> None:
+        operation = change["operationType"]
+        if operation in ("insert", "update", "replace"):
+            doc = change.get("fullDocument")
+            if doc is not None:
+                self.upsert(doc)
+        elif operation == "delete":
+            uid = self._object_ids.pop(change["documentKey"]["_id"], None)
+            if uid is not None:
+                self._discard(uid)
+
+    def _discard(self, uid: str) -> None:
+        if self._entries.pop(uid, None) is not None:
+            self._version += 1
+            for listener in self._listeners:
+                listener.on_remove(uid)
+
+    def _prune_expired(self) -> None:
+        now = time()
+        if now < self._next_expiry:
+            return
+
+        expired = [
+            uid for uid, entry in self._entries.items()
+            if entry.expires_at <= now
+        ]
+        for uid in expired:
+            del self._entries[uid]
+            for listener in self._listeners:
+                listener.on_remove(uid)
+        if expired:
+            self._version += 1
+        self._next_expiry = min(
+            (entry.expires_at for entry in self._entries.values()),
+            default=float("inf")
+        )
+
+
+food_snapshot = FoodSnapshot()
@@ -0,0 +1,181 @@
+import numpy as np
+
+from time import time
+from typing import Any, Iterable
+
+from .column_store import ColumnStore
+
+CELL_BITS = 26
+MAX_ZOOM = 22
+ZOOM_OFFSET = 3
+
+_CELL_SCALE = float(1 << CELL_BITS)
+_MAX_CELL = (1 << CELL_BITS) - 1
+
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    values = (values | (values << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x3333333333333333)
+    values = (values | (values << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return values
+
+
+def geohash_cells(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Integer geohash of every point at CELL_BITS bits per axis, longitude bits
+    first as in the textual geohash. Dropping the lowest 2*k bits of a cell
+    gives its ancestor k levels up.
+    """
+    lat = np.clip(
+        ((np.asarray(latitude, dtype=np.float64) + 90) / 180 * _CELL_SCALE),
+        0, _MAX_CELL
+    )
+    lon = np.clip(
+        ((np.asarray(longitude, dtype=np.float64) + 180) / 360 * _CELL_SCALE),
+        0, _MAX_CELL
+    )
+    return (_spread_bits(lon) << np.uint64(1)) | _spread_bits(lat)
+
+
+def zoom_to_bits(zoom: int) -> int:
+    return max(1, min(CELL_BITS, zoom + ZOOM_OFFSET))
+
+
+def cluster_points(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    cells: np.ndarray,
+    zoom: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Group points by their geohash prefix for the zoom level. Returns the
+    count, centroid latitude, centroid longitude and the index of one sample
+    point of every cluster.
+    """
+    if len(cells) == 0:
+        empty = np.zeros(0)
+        return empty.astype(np.int64), empty, empty, empty.astype(np.int64)
+
+    shift = np.uint64(2 * (CELL_BITS - zoom_to_bits(zoom)))
+    keys = cells >> shift
+    _, samples, inverse, counts = np.unique(
+        keys,
+        return_index=True,
+        return_inverse=True,
+        return_counts=True,
+    )
+    latitudes = np.bincount(inverse, weights=latitude) / counts
+    longitudes = np.bincount(inverse, weights=longitude) / counts
+    return counts, latitudes, longitudes, samples
+
+
+class GeoIndex():
+    """Columnar geohash index of the active foods, fed by the food snapshot."""
+    _store: ColumnStore
+
+    def __init__(self):
+        self._store = ColumnStore({
+            "latitude": np.float64,
+            "longitude": np.float64,
+            "cell": np.uint64,
+            "expires_at": np.float64,
+        })
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def add(
+        self,
+        uid: str,
+        latitude: float,
+        longitude: float,
+        expires_at: float
+    ) -> None:
+        cell = geohash_cells(np.array([latitude]), np.array([longitude]))[0]
+        self._store.set(uid, {
+            "latitude": latitude,
+            "longitude": longitude,
+            "cell": cell,
+            "expires_at": expires_at,
+        })
+
+    def discard(self, uid: str) -> None:
+        self._store.remove(uid)
+
+    def load(self, points: Iterable[tuple[str, float, float, float]]) -> None:
+        uids: list[str] = []
+        latitudes: list[float] = []
+        longitudes: list[float] = []
+        expires: list[float] = []
+        for uid, latitude, longitude, expires_at in points:
+            uids.append(uid)
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+            expires.append(expires_at)
+
+        latitude = np.array(latitudes, dtype=np.float64)
+        longitude = np.array(longitudes, dtype=np.float64)
+        self._store.replace(uids, {
+            "latitude": latitude,
+            "longitude": longitude,
+            "cell": geohash_cells(latitude, longitude),
+            "expires_at": np.array(expires, dtype=np.float64),
+        })
+
+    def clusters(
+        self,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        zoom: int,
+    ) -> list[dict[str, Any]]:
+        store = self._store
+        latitude = store.column("latitude")
+        longitude = store.column("longitude")
+
+        mask = (latitude >= south) & (latitude <= north)
+        if west <= east:
+            mask &= (longitude >= west) & (longitude <= east)
+        else:
+            # The box crosses the antimeridian.
+            mask &= (longitude >= west) | (longitude <= east)
+        mask &= store.column("expires_at") > time()
+
+        rows = np.flatnonzero(mask)
+        counts, latitudes, longitudes, samples = cluster_points(
+            latitude[rows],
+            longitude[rows],
+            store.column("cell")[rows],
+            zoom,
+        )
+        uids = store.uids
+        return [
+            {
+                "count": int(count),
+                "latitude": float(lat),
+                "longitude": float(lon),
+                "sampleUid": uids[rows[sample]],
+            }
+            for count, lat, lon, sample
+            in zip(counts, latitudes, longitudes, samples)
+        ]
+
+    def on_upsert(self, entry: Any) -> None:
+        doc = entry.doc
+        self.add(entry.uid, doc["latitude"], doc["longitude"], entry.expires_at)
+
+    def on_remove(self, uid: str) -> None:
+        self.discard(uid)
+
+    def on_reset(self, entries: Iterable[Any]) -> None:
+        self.load(
+            (entry.uid, entry.doc["latitude"], entry.doc["longitude"], entry.expires_at)
+            for entry in entries
+        )
+
+
+geo_index = GeoIndex()
@@ -0,0 +1,143 @@
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+
+from hashlib import sha256
+from io import BytesIO
+from time import perf_counter
+from typing import Optional
+
+from config import IMAGE_MAX_PIXELS, IMAGE_QUALITY
+
+from .metrics import IMAGE_PROCESS_SECONDS
+
+CHUNK_SIZE = 64 * 1024
+SNIFF_SIZE = 12
+
+CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+class ImageTooManyPixels(UnsupportedImage):
+    pass
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "GIF"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+async def read_image_upload(
+    file: UploadFile,
+    limit: int
+) -> tuple[BytesIO, str, str]:
+    """
+    Read an upload into a single buffer, chunk by chunk. The declared size
+    is only used to fail fast; the limit is enforced on the bytes actually
+    read, and the format comes from the leading bytes, not the client.
+    Returns the buffer, the format and the SHA-256 of the raw bytes.
+    """
+    if file.size is not None and file.size > limit:
+        raise UploadTooLarge
+
+    buffer = BytesIO()
+    digest = sha256()
+    head = b""
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if buffer.tell() + len(chunk) > limit:
+            raise UploadTooLarge
+        buffer.write(chunk)
+        digest.update(chunk)
+
+        if len(head) < SNIFF_SIZE:
+            head += chunk[:SNIFF_SIZE - len(head)]
+            if len(head) == SNIFF_SIZE and sniff_format(head) is None:
+                raise UnsupportedImage
+
+    image_format = sniff_format(head)
+    if image_format is None:
+        raise UnsupportedImage
+
+    buffer.seek(0)
+    return buffer, image_format, digest.hexdigest()
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (
+        img.mode == "P" and "transparency" in img.info
+    )
+
+
+def process_image(
+    buffer: BytesIO,
+    image_format: str,
+    max_size: int,
+) -> tuple[bytes, str]:
+    """
+    Normalize an upload for storage: reject decompression bombs from the
+    header, let the JPEG decoder downscale while decoding, apply the EXIF
+    orientation, cap both sides at max_size and re-encode. Opaque images
+    become JPEG and images with transparency WEBP, both at IMAGE_QUALITY.
+    Returns the encoded bytes and their format.
+    """
+    start = perf_counter()
+    try:
+        with Image.open(buffer, formats=[image_format]) as img:
+            width, height = img.size
+            if width * height > IMAGE_MAX_PIXELS:
+                raise ImageTooManyPixels
+
+            if img.format == "JPEG":
+                scale = min(max_size / max(width, height), 1)
+                # Very thin images would round a side down to 0.
+                img.draft("RGB", (max(1, int(width * scale)), max(1, int(height * scale))))
+            normalized = ImageOps.exif_transpose(img)
+            normalized.thumbnail((max_size, max_size))
+
+            output = BytesIO()
+            if _has_alpha(normalized):
+                normalized = normalized.convert("RGBA")
+                alpha = normalized.getchannel("A")
+                normalized = ImageOps.autocontrast(normalized.convert("RGB"))
+                normalized.putalpha(alpha)
+                output_format = "WEBP"
+                normalized.save(output, format=output_format, quality=IMAGE_QUALITY)
+            else:
+                normalized = ImageOps.autocontrast(normalized.convert("RGB"))
+                output_format = "JPEG"
+                normalized.save(
+                    output,
+                    format=output_format,
+                    quality=IMAGE_QUALITY,
+                    optimize=True,
+                )
+    except UnsupportedImage:
+        raise
+    except Exception:
+        raise UnsupportedImage
+    finally:
+        buffer.close()
+
+    IMAGE_PROCESS_SECONDS.observe(perf_counter() - start, output_format)
+    return output.getvalue(), output_format
@@ -0,0 +1,180 @@
+from bson import Binary
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from starlette.concurrency import run_in_threadpool
+
+from asyncio import CancelledError, create_task, sleep, Task
+from datetime import datetime, timedelta
+from hashlib import sha256
+from io import BytesIO
+from typing import Optional
+try:
+    from datetime import UTC
+except ImportError:
+    from datetime import timezone
+    UTC = timezone.utc
+
+from config import IMAGE_BLOB_GC_GRACE, IMAGE_BLOB_GC_INTERVAL, IMAGE_QUALITY
+from schemas.image_blob import ImageBlob
+
+from .image import CONTENT_TYPES, process_image
+
+
+class BlobRef():
+    sha256: str
+    content_type: str
+
+    def __init__(self, sha256: str, content_type: str):
+        self.sha256 = sha256
+        self.content_type = content_type
+
+    @property
+    def etag(self) -> str:
+        return f"\"{self.sha256}\""
+
+
+def raw_key(profile: str, raw_digest: str) -> str:
+    """
+    Key of an unprocessed upload. The profile names the processing settings,
+    so the same raw bytes normalized differently map to different blobs.
+    """
+    return f"{profile}:{raw_digest}"
+
+
+async def acquire_by_raw(key: str) -> Optional[BlobRef]:
+    """Take a reference on the blob an identical upload already produced."""
+    doc = await ImageBlob.get_motor_collection().find_one_and_update(
+        {"raw_hashes": key},
+        {"$inc": {"ref_count": 1}},
+        projection={"_id": 0, "sha256": 1, "content_type": 1},
+    )
+    if doc is None:
+        return None
+    return BlobRef(doc["sha256"], doc["content_type"])
+
+
+async def store(data: bytes, content_type: str, key: str) -> BlobRef:
+    """Store processed bytes under their hash and take a reference on them."""
+    digest = sha256(data).hexdigest()
+    update = {
+        "$inc": {"ref_count": 1},
+        "$addToSet": {"raw_hashes": key},
+        "$set": {"released_at": None},
+        "$setOnInsert": {
+            "content_type": content_type,
+            "data": Binary(data),
+        },
+    }
+    collection = ImageBlob.get_motor_collection()
+    try:
+        doc = await collection.find_one_and_update(
+            {"sha256": digest},
+            update,
+            projection={"_id": 0, "content_type": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # A concurrent upload inserted the same blob first.
+        doc = await collection.find_one_and_update(
+            {"sha256": digest},
+            update,
+            projection={"_id": 0, "content_type": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+    return BlobRef(digest, doc["content_type"])
+
+
+async def ingest(
+    buffer: BytesIO,
+    image_format: str,
+    raw_digest: str,
+    profile: str,
+    max_size: int,
+) -> BlobRef:
+    """
+    Normalize and store a raw upload. An upload whose raw bytes were seen
+    before with the same settings only takes a reference on the existing
+    blob and is never decoded.
+    """
+    key = raw_key(f"{profile}-{max_size}-{IMAGE_QUALITY}", raw_digest)
+
+    blob = await acquire_by_raw(key)
+    if blob is not None:
+        buffer.close()
+        return blob
+
+    data, image_format = await run_in_threadpool(
+        process_image,
+        buffer,
+        image_format,
+        max_size,
+    )
+    return await store(data, CONTENT_TYPES[image_format], key)
+
+
+async def release(digest: Optional[str]) -> None:
+    if digest is None:
+        return
+    await ImageBlob.get_motor_collection().update_one(
+        {"sha256": digest},
+        {
+            "$inc": {"ref_count": -1},
+            "$set": {"released_at": datetime.now(UTC)},
+        },
+    )
+
+
+async def load(digest: str) -> Optional[bytes]:
+    doc = await ImageBlob.get_motor_collection().find_one(
+        {"sha256": digest},
+        {"_id": 0, "data": 1},
+    )
+    if doc is None:
+        return None
+    return doc["data"]
+
+
+async def collect_garbage() -> int:
+    """
+    Delete blobs nobody references. The grace period keeps a blob around
+    while an in-flight upload may still be about to reference it again.
+    """
+    result = await ImageBlob.get_motor_collection().delete_many({
+        "ref_count": {"$lte": 0},
+        "released_at": {
+            "$lt": datetime.now(UTC) - timedelta(seconds=IMAGE_BLOB_GC_GRACE)
+        },
+    })
+    return result.deleted_count
+
+
+class BlobCollector():
+    _task: Optional[Task]
+
+    def __init__(self):
+        self._task = None
+
+    async def start(self) -> None:
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await sleep(IMAGE_BLOB_GC_INTERVAL)
+            try:
+                await collect_garbage()
+            except PyMongoError:
+                pass
+
+
+blob_collector = BlobCollector()
@@ -0,0 +1,228 @@
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from asyncio import create_task, Event, gather, Task, wait_for
+from asyncio import TimeoutError as AsyncTimeoutError
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Any, Optional
+try:
+    from datetime import UTC
+except ImportError:
+    from datetime import timezone
+    UTC = timezone.utc
+
+from config import (
+    IMAGE_AVATAR_MAX_SIZE,
+    IMAGE_JOB_MAX_ATTEMPTS,
+    IMAGE_JOB_RETRY_BACKOFF,
+    IMAGE_JOB_VISIBILITY_TIMEOUT,
+    IMAGE_PHOTO_MAX_SIZE,
+    IMAGE_WORKER_CONCURRENCY,
+    IMAGE_WORKER_POLL_INTERVAL,
+)
+from schemas.avatar import Avatar
+from schemas.food import Food
+from schemas.food_image import FoodImage
+from schemas.image_job import ImageJob
+
+from .food_snapshot import food_snapshot
+from .image import UnsupportedImage
+from .image_store import BlobRef, ingest, release
+from .logger import log
+
+PROFILES = {
+    "avatar": IMAGE_AVATAR_MAX_SIZE,
+    "photo": IMAGE_PHOTO_MAX_SIZE,
+}
+
+
+async def enqueue(
+    kind: str,
+    target_id: Any,
+    buffer: BytesIO,
+    image_format: str,
+    raw_digest: str,
+) -> ImageJob:
+    job = ImageJob(
+        kind=kind,
+        target_id=target_id,
+        image_format=image_format,
+        raw_digest=raw_digest,
+        data=buffer.getvalue(),
+    )
+    buffer.close()
+    await job.insert()
+    return job
+
+
+async def claim() -> Optional[dict[str, Any]]:
+    """
+    Atomically take the oldest visible job. A running job whose worker has
+    not finished it within the visibility timeout becomes visible again.
+    """
+    now = datetime.now(UTC)
+    return await ImageJob.get_motor_collection().find_one_and_update(
+        {
+            "status": {"$in": ["pending", "running"]},
+            "visible_at": {"$lte": now},
+        },
+        {
+            "$set": {
+                "status": "running",
+                "visible_at": now + timedelta(seconds=IMAGE_JOB_VISIBILITY_TIMEOUT),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("visible_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def assign_avatar(user_id: str, blob: BlobRef) -> None:
+    previous = await Avatar.get_motor_collection().find_one_and_update(
+        {"uid": user_id},
+        {
+            "$set": {"blob": blob.sha256, "content_type": blob.content_type},
+            "$unset": {"data": ""},
+        },
+        projection={"_id": 0, "blob": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if previous is not None:
+        await release(previous.get("blob"))
+
+
+async def append_photo(food_id: str, job_id: str, blob: BlobRef) -> None:
+    if await FoodImage.get_motor_collection().find_one({"job_id": job_id}, {"_id": 1}):
+        # An earlier attempt got this far before losing its lease.
+        await release(blob.sha256)
+        return
+
+    food = await Food.get_motor_collection().find_one_and_update(
+        {"uid": food_id},
+        {"$inc": {"imageCount": 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if food is None:
+        await release(blob.sha256)
+        return
+
+    await FoodImage(
+        food_id=food_id,
+        index=food["imageCount"] - 1,
+        blob=blob.sha256,
+        content_type=blob.content_type,
+        job_id=job_id,
+    ).insert()
+    food_snapshot.notify_upsert(food)
+
+
+async def finish(job: dict[str, Any], status: str, error: Optional[str] = None) -> None:
+    await ImageJob.get_motor_collection().update_one(
+        {"_id": job["_id"]},
+        {
+            "$set": {
+                "status": status,
+                "error": error,
+                "finished_at": datetime.now(UTC),
+            },
+            "$unset": {"data": ""},
+        },
+    )
+
+
+async def process(job: dict[str, Any]) -> None:
+    if job["attempts"] > IMAGE_JOB_MAX_ATTEMPTS:
+        await finish(job, "failed", "Too many attempts")
+        return
+
+    kind = job["kind"]
+    try:
+        blob = await ingest(
+            BytesIO(job["data"]),
+            job["image_format"],
+            job["raw_digest"],
+            kind,
+            PROFILES[kind],
+        )
+        if kind == "avatar":
+            await assign_avatar(job["target_id"], blob)
+        else:
+            await append_photo(job["target_id"], job["uid"], blob)
+    except UnsupportedImage:
+        await finish(job, "failed", "Unsupported media type")
+        return
+    except Exception as error:
+        await ImageJob.get_motor_collection().update_one(
+            {"_id": job["_id"]},
+            {"$set": {
+                "status": "pending",
+                "error": str(error),
+                "visible_at": datetime.now(UTC) + timedelta(
+                    seconds=IMAGE_JOB_RETRY_BACKOFF * job["attempts"]
+                ),
+            }},
+        )
+        return
+
+    await finish(job, "done")
+
+
+class ImageWorker():
+    """
+    Claims jobs from the ImageJobs collection and processes them. Stopping
+    lets the job in hand finish; anything unfinished is retried once its
+    lease runs out.
+    """
+    _tasks: list[Task]
+    _stopping: Event
+
+    def __init__(self):
+        self._tasks = []
+        self._stopping = Event()
+
+    async def start(self, concurrency: int = IMAGE_WORKER_CONCURRENCY) -> None:
+        self._stopping.clear()
+        self._tasks = [create_task(self._run()) for _ in range(concurrency)]
+
+    def request_stop(self) -> None:
+        self._stopping.set()
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        self.request_stop()
+        if not self._tasks:
+            return
+        try:
+            await wait_for(gather(*self._tasks), timeout)
+        except AsyncTimeoutError:
+            pass
+        self._tasks = []
+
+    async def wait(self) -> None:
+        await gather(*self._tasks)
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = await claim()
+            except PyMongoError:
+                job = None
+
+            if job is None:
+                try:
+                    await wait_for(self._stopping.wait(), IMAGE_WORKER_POLL_INTERVAL)
+                except AsyncTimeoutError:
+                    pass
+                continue
+
+            try:
+                await process(job)
+            except Exception as error:
+                # Most likely the database failing under finish() or the
+                # retry; the job's lease expires and it is claimed again.
+                log.error("image_job_failed", exc=error, job_id=str(job["uid"]))
+
+
+image_worker = ImageWorker()
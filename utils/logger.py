@@ -0,0 +1,209 @@
+from orjson import dumps
+
+from contextvars import ContextVar
+from datetime import datetime
+from os import close, O_APPEND, O_CREAT, O_WRONLY, open as open_fd, write
+from queue import Empty, Full, Queue
+from random import random
+from select import PIPE_BUF
+from sys import stdout
+from threading import Thread
+from time import time
+from traceback import format_exception
+from typing import Any, Optional
+try:
+    from datetime import UTC
+except ImportError:
+    from datetime import timezone
+    UTC = timezone.utc
+
+from config import (
+    LOG_BATCH_SIZE,
+    LOG_ENABLED,
+    LOG_PATH,
+    LOG_QUEUE_SIZE,
+    LOG_SLOW_REQUEST_SECONDS,
+    LOG_SUCCESS_SAMPLE_RATE,
+)
+
+from .metrics import Counter, Gauge, registry
+
+STOP = object()
+
+request_id: ContextVar[Optional[str]] = ContextVar(
+    "request_id",
+    default=None
+)
+
+LOG_RECORDS_DROPPED = registry.register(Counter(
+    "log_records_dropped_total",
+    "Log records dropped because the log queue was full.",
+))
+
+
+def encode(record: dict[str, Any]) -> bytes:
+    record["time"] = datetime.fromtimestamp(record["time"], UTC).isoformat()
+    exc = record.pop("exc", None)
+    if exc is not None:
+        record["traceback"] = "".join(format_exception(exc))
+    return dumps(record, default=str) + b"\n"
+
+
+class JsonLogger():
+    """
+    JSON lines access and error log. Records are queued by the event loop
+    and encoded and written by a background thread, in batches of whatever
+    is waiting, so a slow log pipe never blocks a request. Past queue_size
+    records are dropped and counted. Records go straight to the file
+    descriptor, several per write(2) up to PIPE_BUF, so the workers of
+    main.py sharing a stdout pipe don't interleave within a record. A
+    record larger than PIPE_BUF, a long traceback, can still be split on
+    a pipe.
+    """
+    enabled: bool
+    _queue: Queue
+    _thread: Optional[Thread]
+
+    def __init__(self, enabled: bool, queue_size: int):
+        self.enabled = enabled
+        self._queue = Queue(maxsize=queue_size)
+        self._thread = None
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def log(self, level: str, event: str, **fields: Any) -> None:
+        if not self.enabled:
+            return
+        record = {
+            "time": time(),
+            "level": level,
+            "event": event,
+            "request_id": request_id.get(),
+            **fields,
+        }
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def info(self, event: str, **fields: Any) -> None:
+        self.log("info", event, **fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self.log("warning", event, **fields)
+
+    def error(self, event: str, exc: Optional[BaseException] = None, **fields: Any) -> None:
+        """The traceback of exc is formatted by the writer thread."""
+        self.log("error", event, exc=exc, **fields)
+
+    def access(
+        self,
+        method: str,
+        path: str,
+        route: Optional[str],
+        status: int,
+        duration: float,
+        client: Optional[str],
+    ) -> None:
+        """
+        One record per request. Successful requests faster than
+        slow_request_seconds are sampled at success_sample_rate.
+        """
+        if (
+            status < 400
+            and duration < LOG_SLOW_REQUEST_SECONDS
+            and LOG_SUCCESS_SAMPLE_RATE < 1
+            and random() >= LOG_SUCCESS_SAMPLE_RATE
+        ):
+            return
+        self.log(
+            "info",
+            "request",
+            method=method,
+            path=path,
+            route=route,
+            status=status,
+            duration_ms=round(duration * 1000, 3),
+            client=client,
+        )
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="json-logger", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Write what is queued, then end the thread."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(STOP, timeout=timeout)
+        except Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        if LOG_PATH is None:
+            fd = stdout.fileno()
+        else:
+            fd = open_fd(LOG_PATH, O_WRONLY | O_APPEND | O_CREAT, 0o644)
+        try:
+            stopping = False
+            while not stopping:
+                batch = [self._queue.get()]
+                while len(batch) < LOG_BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except Empty:
+                        break
+                if STOP in batch:
+                    batch = batch[:batch.index(STOP)]
+                    stopping = True
+                lines = []
+                for record in batch:
+                    try:
+                        lines.append(encode(record))
+                    except Exception:
+                        LOG_RECORDS_DROPPED.inc()
+                self._write(fd, lines)
+        finally:
+            if LOG_PATH is not None:
+                close(fd)
+
+    def _write(self, fd: int, lines: list[bytes]) -> None:
+        """
+        Whole records per write(2) on the raw descriptor, no more than
+        PIPE_BUF unless a single record is larger.
+        """
+        chunks = []
+        chunk = b""
+        for line in lines:
+            if chunk and len(chunk) + len(line) > PIPE_BUF:
+                chunks.append(chunk)
+                chunk = b""
+            chunk += line
+        if chunk:
+            chunks.append(chunk)
+
+        for number, chunk in enumerate(chunks):
+            try:
+                view = memoryview(chunk)
+                while view:
+                    view = view[write(fd, view):]
+            except OSError:
+                LOG_RECORDS_DROPPED.inc(amount=sum(
+                    rest.count(b"\n") for rest in chunks[number:]
+                ))
+                return
+
+
+log = JsonLogger(LOG_ENABLED, LOG_QUEUE_SIZE)
+
+registry.register(Gauge(
+    "log_queue_records",
+    "Log records waiting for the writer thread.",
+    callback=lambda: len(log),
+))
@@ -0,0 +1,405 @@
+from orjson import dumps, loads
+from pymongo.monitoring import CommandListener, ConnectionPoolListener
+
+from abc import ABC, abstractmethod
+from asyncio import CancelledError, create_task, sleep, Task
+from bisect import bisect_left
+from glob import glob
+from os import makedirs, path, replace
+from threading import Lock
+from typing import Any, Callable, Iterable, Optional
+
+from config import (
+    INSTANCE_ID,
+    METRICS_DIRECTORY,
+    METRICS_FLUSH_INTERVAL,
+    WORKERS,
+)
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Value of every label combination a metric has seen.
+Series = list[tuple[tuple[str, ...], Any]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f"{name}=\"{_escape(value)}\"" for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric(ABC):
+    """
+    Metrics are also updated from the threads Motor and the threadpool run
+    on, so every update holds the metric's lock.
+    """
+    name: str
+    help: str
+    kind: str
+    label_names: tuple[str, ...]
+    _lock: Lock
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = Lock()
+
+    def render(self, series: Optional[Series] = None) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(self.series() if series is None else series),
+        ]
+
+    def merge(self, all_series: list[Series]) -> Series:
+        """The series of several processes summed by labels."""
+        merged: dict[tuple[str, ...], Any] = {}
+        for series in all_series:
+            for labels, value in series:
+                labels = tuple(labels)
+                merged[labels] = merged.get(labels, 0) + value
+        return list(merged.items())
+
+    @abstractmethod
+    def series(self) -> Series:
+        pass
+
+    @abstractmethod
+    def samples(self, series: Series) -> list[str]:
+        pass
+
+
+class Counter(Metric):
+    kind = "counter"
+    _values: dict[tuple[str, ...], float]
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, help, label_names)
+        self._values = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def series(self) -> Series:
+        with self._lock:
+            return list(self._values.items())
+
+    def samples(self, series: Series) -> list[str]:
+        return [
+            f"{self.name}{_labels(self.label_names, labels)} {value}"
+            for labels, value in series
+        ]
+
+
+class Gauge(Counter):
+    """
+    Across processes gauges are summed, or with aggregate="max" the
+    largest value is taken, for those that are not amounts.
+    """
+    kind = "gauge"
+    aggregate: str
+    _callback: Optional[Callable[[], float]]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: tuple[str, ...] = (),
+        callback: Optional[Callable[[], float]] = None,
+        aggregate: str = "sum",
+    ):
+        super().__init__(name, help, label_names)
+        self.aggregate = aggregate
+        self._callback = callback
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def series(self) -> Series:
+        if self._callback is not None:
+            return [((), self._callback())]
+        return super().series()
+
+    def merge(self, all_series: list[Series]) -> Series:
+        if self.aggregate != "max":
+            return super().merge(all_series)
+        merged: dict[tuple[str, ...], Any] = {}
+        for series in all_series:
+            for labels, value in series:
+                labels = tuple(labels)
+                merged[labels] = max(merged.get(labels, value), value)
+        return list(merged.items())
+
+
+class Histogram(Metric):
+    """
+    Bucket counts are kept per bucket, not cumulatively, so an observation
+    is a bisect and two additions. Rendering does the accumulation.
+    """
+    kind = "histogram"
+    buckets: tuple[float, ...]
+    _series: dict[tuple[str, ...], list[float]]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, label_names)
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # One slot per bucket, one for +Inf, then the sum.
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def series(self) -> Series:
+        with self._lock:
+            return [(labels, list(series)) for labels, series in self._series.items()]
+
+    def merge(self, all_series: list[Series]) -> Series:
+        merged: dict[tuple[str, ...], list[float]] = {}
+        for series in all_series:
+            for labels, values in series:
+                labels = tuple(labels)
+                total = merged.get(labels)
+                if total is None:
+                    merged[labels] = list(values)
+                else:
+                    merged[labels] = [a + b for a, b in zip(total, values)]
+        return list(merged.items())
+
+    def samples(self, series: Series) -> list[str]:
+        lines = []
+        for labels, counts in series:
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                le = _labels(self.label_names, labels, f"le=\"{bound}\"")
+                lines.append(f"{self.name}_bucket{le} {total}")
+            total += counts[-2]
+            le = _labels(self.label_names, labels, "le=\"+Inf\"")
+            lines.append(f"{self.name}_bucket{le} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {total}")
+        return lines
+
+
+class Registry():
+    _metrics: list[Metric]
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def dump(self) -> dict[str, Series]:
+        return {metric.name: metric.series() for metric in self._metrics}
+
+    def render(self, others: Iterable[dict[str, Series]] = ()) -> str:
+        """Render this process's metrics, merged with dumps of others."""
+        others = list(others)
+        lines = []
+        for metric in self._metrics:
+            series = metric.series()
+            if others:
+                series = metric.merge([series, *(other.get(metric.name, []) for other in others)])
+            lines.extend(metric.render(series))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter():
+    """
+    With several workers behind one socket, a scrape reaches any one of
+    them. Each worker dumps its registry to directory/<instance_id>.json
+    every flush_interval, and /metrics merges the other workers' dumps
+    into its own. A restarted worker starts its counters over, which
+    Prometheus reads as a counter reset.
+    """
+    _path: str
+    _task: Optional[Task]
+
+    def __init__(self):
+        self._path = path.join(METRICS_DIRECTORY, f"{INSTANCE_ID}.json")
+        self._task = None
+
+    async def start(self) -> None:
+        if WORKERS <= 1:
+            return
+        makedirs(METRICS_DIRECTORY, exist_ok=True)
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+        self.write()
+
+    def write(self) -> None:
+        # Replaced whole, so a reader never sees a half written dump.
+        temporary = self._path + ".tmp"
+        with open(temporary, "wb") as dump_file:
+            dump_file.write(dumps(registry.dump()))
+        replace(temporary, self._path)
+
+    def collect(self) -> list[dict[str, Series]]:
+        """The latest dumps of the other workers."""
+        if WORKERS <= 1:
+            return []
+        dumps_read = []
+        for dump_path in glob(path.join(METRICS_DIRECTORY, "*.json")):
+            if dump_path == self._path:
+                continue
+            try:
+                with open(dump_path, "rb") as dump_file:
+                    dumps_read.append(loads(dump_file.read()))
+            except (OSError, ValueError):
+                continue
+        return dumps_read
+
+    async def _run(self) -> None:
+        while True:
+            self.write()
+            await sleep(METRICS_FLUSH_INTERVAL)
+
+
+registry = Registry()
+metrics_exporter = MetricsExporter()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ("method", "route", "status"),
+))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being served.",
+    ("method",),
+))
+MONGO_COMMAND_SECONDS = registry.register(Histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB command latency by command name.",
+    ("command", "outcome"),
+))
+MONGO_POOL_CONNECTIONS = registry.register(Gauge(
+    "mongodb_pool_connections",
+    "Open MongoDB connections.",
+))
+MONGO_POOL_CHECKED_OUT = registry.register(Gauge(
+    "mongodb_pool_checked_out",
+    "MongoDB connections currently checked out.",
+))
+MONGO_POOL_WAIT_SECONDS = registry.register(Histogram(
+    "mongodb_pool_wait_seconds",
+    "Time spent waiting for a pooled MongoDB connection.",
+))
+MONGO_POOL_CHECKOUT_FAILURES = registry.register(Counter(
+    "mongodb_pool_checkout_failures_total",
+    "Failed MongoDB connection checkouts by reason.",
+    ("reason",),
+))
+IMAGE_PROCESS_SECONDS = registry.register(Histogram(
+    "image_process_duration_seconds",
+    "Pillow normalization time by output format.",
+    ("format",),
+))
+RATE_LIMITED = registry.register(Counter(
+    "http_rate_limited_total",
+    "Requests rejected by the rate limiter by path.",
+    ("path",),
+))
+BCRYPT_SECONDS = registry.register(Histogram(
+    "bcrypt_duration_seconds",
+    "bcrypt time by operation.",
+    ("operation",),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0),
+))
+
+
+class CommandMetricsListener(CommandListener):
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1e6,
+            event.command_name,
+            "ok"
+        )
+
+    def failed(self, event) -> None:
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1e6,
+            event.command_name,
+            "error"
+        )
+
+
+class PoolMetricsListener(ConnectionPoolListener):
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        MONGO_POOL_CONNECTIONS.inc()
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        MONGO_POOL_CONNECTIONS.dec()
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_check_out_failed(self, event) -> None:
+        MONGO_POOL_CHECKOUT_FAILURES.inc(str(event.reason))
+
+    def connection_checked_out(self, event) -> None:
+        MONGO_POOL_CHECKED_OUT.inc()
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            MONGO_POOL_WAIT_SECONDS.observe(duration)
+
+    def connection_checked_in(self, event) -> None:
+        MONGO_POOL_CHECKED_OUT.dec()
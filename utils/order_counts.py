@@ -0,0 +1,134 @@
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from asyncio import CancelledError, create_task, sleep, Task
+from typing import Optional
+
+from config import ORDER_COUNT_RECONCILE_INTERVAL, ORDER_COUNT_RECONCILE_PAGE_SIZE
+from schemas.food import Food
+from schemas.order import Order
+
+COUNT_FIELDS = ("orderCount", "receivedCount", "completeCount")
+
+
+async def adjust_order_counts(food_id: str, **deltas: int) -> None:
+    """Apply order count changes to a food in one $inc."""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    await Food.get_motor_collection().update_one(
+        {"uid": str(food_id)},
+        {"$inc": deltas}
+    )
+
+
+async def stored_counts(food_ids: list[str]) -> dict[str, dict[str, Optional[int]]]:
+    return {
+        doc["uid"]: {field: doc.get(field) for field in COUNT_FIELDS}
+        async for doc in Food.get_motor_collection().find(
+            {"uid": {"$in": food_ids}},
+            {"_id": 0, "uid": 1, **{field: 1 for field in COUNT_FIELDS}},
+        )
+    }
+
+
+async def actual_counts(food_ids: list[str]) -> dict[str, dict[str, int]]:
+    actual = {food_id: dict.fromkeys(COUNT_FIELDS, 0) for food_id in food_ids}
+    async for row in Order.get_motor_collection().aggregate([
+        {"$match": {"foodId": {"$in": food_ids}}},
+        {"$group": {
+            "_id": "$foodId",
+            "orderCount": {"$sum": 1},
+            "receivedCount": {"$sum": {"$cond": ["$received", 1, 0]}},
+            "completeCount": {"$sum": {"$cond": ["$complete", 1, 0]}},
+        }},
+    ]):
+        actual[row.pop("_id")] = row
+    return actual
+
+
+async def find_drift(food_ids: list[str]) -> dict[str, tuple[dict, dict]]:
+    """
+    Stored and actual counts of the foods whose counts differ. The stored
+    counts are read first: an order and its $inc landing between the two
+    reads then shows up as actual > stored, which the guarded $set of a
+    fix can't apply over, rather than the other way round.
+    """
+    stored = await stored_counts(food_ids)
+    actual = await actual_counts(list(stored))
+    return {
+        food_id: (counts, actual[food_id])
+        for food_id, counts in stored.items()
+        if counts != actual[food_id]
+    }
+
+
+def difference(stored: dict[str, Optional[int]], actual: dict[str, int]) -> dict[str, int]:
+    return {field: actual[field] - (stored[field] or 0) for field in COUNT_FIELDS}
+
+
+async def reconcile_order_counts() -> int:
+    """
+    Recompute the foods' order counts from the Orders collection, a page
+    of reconcile_page_size foods at a time, and fix the ones that drifted,
+    returning how many were fixed. A difference is only drift if a second
+    pass finds the same difference, an order caught between its insert
+    and its $inc doesn't; and each fix only applies if the stored counts
+    are still the ones read.
+    """
+    collection = Food.get_motor_collection()
+    fixed = 0
+    last_id = None
+    while True:
+        page = await collection.find(
+            {} if last_id is None else {"_id": {"$gt": last_id}},
+            {"_id": 1, "uid": 1},
+        ).sort("_id", 1).limit(ORDER_COUNT_RECONCILE_PAGE_SIZE).to_list(None)
+        if not page:
+            return fixed
+        last_id = page[-1]["_id"]
+
+        first = await find_drift([doc["uid"] for doc in page])
+        if not first:
+            continue
+        second = await find_drift(list(first))
+        updates = [
+            UpdateOne({"uid": food_id, **stored}, {"$set": actual})
+            for food_id, (stored, actual) in second.items()
+            if difference(*first[food_id]) == difference(stored, actual)
+        ]
+        if updates:
+            await collection.bulk_write(updates, ordered=False)
+            fixed += len(updates)
+
+
+class OrderCountReconciler():
+    """Runs reconcile_order_counts at startup and every reconcile_interval."""
+    _task: Optional[Task]
+
+    def __init__(self):
+        self._task = None
+
+    async def start(self) -> None:
+        self._task = create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await reconcile_order_counts()
+            except PyMongoError:
+                pass
+            await sleep(ORDER_COUNT_RECONCILE_INTERVAL)
+
+
+order_count_reconciler = OrderCountReconciler()
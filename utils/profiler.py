@@ -0,0 +1,172 @@
+from cProfile import Profile
+from hashlib import sha256
+from hmac import compare_digest, new as hmac_new
+from io import StringIO
+from pathlib import Path
+from pstats import SortKey, Stats
+from time import time
+from typing import Optional
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+from config import (
+    INSTANCE_ID,
+    JWT_KEY,
+    PROFILING_DIRECTORY,
+    PROFILING_MAX_PROFILES,
+    PROFILING_SAMPLE_EVERY,
+    PROFILING_SIGNATURE_TTL,
+)
+from snowflake import SnowflakeGenerator
+
+from .bearer import decode_bearer
+
+PROFILE_HEADER = b"x-profile-signature"
+PROFILE_QUERY_FLAG = b"profile=1"
+REPORT_LINES = 60
+
+uid_generator = SnowflakeGenerator(INSTANCE_ID)
+
+
+def sign_profile_request(expires: int) -> str:
+    """Value of the X-Profile-Signature header, valid until expires."""
+    digest = hmac_new(JWT_KEY.encode("utf-8"), str(expires).encode("utf-8"), sha256)
+    return f"{expires}.{digest.hexdigest()}"
+
+
+def verify_signature(value: bytes) -> bool:
+    try:
+        expires, _ = value.decode("ascii").split(".", 1)
+        expires = int(expires)
+    except ValueError:
+        return False
+    now = time()
+    if not now <= expires <= now + PROFILING_SIGNATURE_TTL:
+        return False
+    return compare_digest(sign_profile_request(expires), value.decode("ascii"))
+
+
+def is_admin_token(authorization: Optional[bytes]) -> bool:
+    payload = decode_bearer(authorization)
+    if payload is None:
+        return False
+    return payload.get("is_admin", False)
+
+
+class RequestProfile():
+    """
+    pyinstrument attributes wall time across awaits to the request's own
+    coroutines. cProfile, the fallback, records everything the event loop
+    thread runs meanwhile, including other requests.
+    """
+    _profiler: object
+
+    def __init__(self):
+        if SamplingProfiler is not None:
+            self._profiler = SamplingProfiler(interval=0.0001, async_mode="enabled")
+        else:
+            self._profiler = Profile()
+
+    @property
+    def name(self) -> str:
+        return "pyinstrument" if SamplingProfiler is not None else "cProfile"
+
+    def start(self) -> None:
+        if SamplingProfiler is not None:
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self) -> None:
+        if SamplingProfiler is not None:
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def report(self) -> str:
+        if SamplingProfiler is not None:
+            return self._profiler.output_text(unicode=True)
+        output = StringIO()
+        Stats(self._profiler, stream=output).sort_stats(SortKey.CUMULATIVE).print_stats(REPORT_LINES)
+        return output.getvalue()
+
+
+class ProfileStore():
+    """
+    Ring buffer of text reports on disk. File names are snowflake IDs, so
+    sorting them orders the reports by time and the oldest are dropped
+    first once max_profiles is exceeded.
+    """
+    directory: Path
+    max_profiles: int
+
+    def __init__(self, directory: str, max_profiles: int):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+
+    def _paths(self) -> list[Path]:
+        if not self.directory.is_dir():
+            return []
+        return sorted(self.directory.glob("*.txt"), key=lambda path: int(path.stem))
+
+    def save(self, summary: str, report: str) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        uid = str(uid_generator.next_id())
+        (self.directory / f"{uid}.txt").write_text(f"{summary}\n\n{report}")
+
+        paths = self._paths()
+        for path in paths[:max(len(paths) - self.max_profiles, 0)]:
+            path.unlink(missing_ok=True)
+        return uid
+
+    def summaries(self) -> list[tuple[str, str]]:
+        summaries = []
+        for path in reversed(self._paths()):
+            with path.open() as report:
+                summaries.append((path.stem, report.readline().rstrip("\n")))
+        return summaries
+
+    def load(self, uid: str) -> Optional[str]:
+        if not uid.isdigit():
+            return None
+        path = self.directory / f"{uid}.txt"
+        if not path.is_file():
+            return None
+        return path.read_text()
+
+
+class ProfileTrigger():
+    """
+    Decides which requests get profiled: those with a valid signature
+    header, those with ?profile=1 and an admin token, and every Nth request
+    when sampling is on. Only one request is profiled at a time, a second
+    profiler on the same thread would see the first one's frames.
+    """
+    sample_every: int
+    busy: bool
+    _count: int
+
+    def __init__(self, sample_every: int):
+        self.sample_every = sample_every
+        self.busy = False
+        self._count = 0
+
+    def wants(self, signature: Optional[bytes], authorization: Optional[bytes], query: bytes) -> bool:
+        if self.busy:
+            return False
+        if signature is not None and verify_signature(signature):
+            return True
+        if PROFILE_QUERY_FLAG in query.split(b"&") and is_admin_token(authorization):
+            return True
+        if self.sample_every > 0:
+            self._count += 1
+            if self._count >= self.sample_every:
+                self._count = 0
+                return True
+        return False
+
+
+profile_store = ProfileStore(PROFILING_DIRECTORY, PROFILING_MAX_PROFILES)
+profile_trigger = ProfileTrigger(PROFILING_SAMPLE_EVERY)
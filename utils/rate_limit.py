@@ -0,0 +1,116 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from time import monotonic
+from typing import Optional
+
+from config import RATE_LIMIT_STORAGE, RATE_LIMITS, RateLimit
+from schemas.rate_limit import RateLimitBucket
+
+MAX_MEMORY_BUCKETS = 100_000
+
+
+class MemoryBuckets():
+    """
+    Token buckets of a single process. Least recently used buckets are
+    dropped past MAX_MEMORY_BUCKETS, which only refills them early.
+    """
+    _buckets: dict[str, tuple[float, float]]
+
+    def __init__(self):
+        self._buckets = {}
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        now = monotonic()
+        tokens, updated = self._buckets.pop(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        allowed = tokens >= 1
+        self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+
+        if len(self._buckets) > MAX_MEMORY_BUCKETS:
+            del self._buckets[next(iter(self._buckets))]
+        return 0.0 if allowed else (1 - tokens) / limit.rate
+
+
+class MongoBuckets():
+    """
+    Token buckets shared by every worker. Refill and take happen in one
+    pipeline update against the server clock, so concurrent workers never
+    hand out the same token.
+    """
+    async def take(self, key: str, limit: RateLimit) -> float:
+        elapsed = {"$divide": [
+            {"$subtract": ["$$NOW", {"$ifNull": ["$updated", "$$NOW"]}]},
+            1000
+        ]}
+        refilled = {"$min": [
+            limit.burst,
+            {"$add": [
+                {"$ifNull": ["$tokens", limit.burst]},
+                {"$multiply": [elapsed, limit.rate]}
+            ]}
+        ]}
+        pipeline = [
+            {"$set": {"tokens": refilled, "updated": "$$NOW"}},
+            {"$set": {
+                "allowed": {"$gte": ["$tokens", 1]},
+                "tokens": {"$cond": [
+                    {"$gte": ["$tokens", 1]},
+                    {"$subtract": ["$tokens", 1]},
+                    "$tokens"
+                ]},
+            }},
+        ]
+        collection = RateLimitBucket.get_motor_collection()
+        try:
+            bucket = await collection.find_one_and_update(
+                {"key": key},
+                pipeline,
+                projection={"_id": 0, "tokens": 1, "allowed": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another worker created the bucket first.
+            bucket = await collection.find_one_and_update(
+                {"key": key},
+                pipeline,
+                projection={"_id": 0, "tokens": 1, "allowed": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / limit.rate
+
+
+class RateLimiter():
+    """
+    Limits requests to the configured paths per client IP and, for
+    authenticated requests, per token subject. Both buckets must have a
+    token left.
+    """
+    limits: dict[str, RateLimit]
+    _buckets: object
+
+    def __init__(self, limits: dict[str, RateLimit], storage: str):
+        self.limits = limits
+        self._buckets = MongoBuckets() if storage == "mongo" else MemoryBuckets()
+
+    def limit_for(self, path: str) -> Optional[RateLimit]:
+        return self.limits.get(path)
+
+    async def check(
+        self,
+        path: str,
+        limit: RateLimit,
+        client_ip: Optional[str],
+        subject: Optional[str],
+    ) -> float:
+        """Seconds until the request would be allowed, 0 if it is."""
+        retry_after = await self._buckets.take(f"{path}|ip:{client_ip}", limit)
+        if retry_after or subject is None:
+            return retry_after
+        return await self._buckets.take(f"{path}|sub:{subject}", limit)
+
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_STORAGE)
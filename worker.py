@@ -0,0 +1,24 @@
+from asyncio import get_running_loop, run
+from signal import SIGINT, SIGTERM
+
+from database.database import setup as setup_db
+from utils.image_worker import image_worker
+from utils.logger import log
+
+
+async def main():
+    log.start()
+    await setup_db()
+    await image_worker.start()
+
+    loop = get_running_loop()
+    for sig in (SIGINT, SIGTERM):
+        loop.add_signal_handler(sig, image_worker.request_stop)
+
+    try:
+        await image_worker.wait()
+    finally:
+        log.stop()
+
+if __name__ == "__main__":
+    run(main())